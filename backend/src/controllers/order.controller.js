@@ -149,7 +149,8 @@ const createOrder = async (req, res) => {
       input: inputPath,
       ref: templateId ? `TEMPLATE:${templateId}` : `CATEGORY:${documentType}`,
       output: outputPath,
-      userId: user_id
+      userId: user_id,
+      serviceLevel: serviceLevel // express orders jump the queue
     };
 
     await addToQueue(jobPayload);
@@ -251,8 +252,8 @@ const updateOrderStatus = async (req, res) => {
     const { orderId } = req.params;
     const { status, notes } = req.body;
 
-    // Validate status
-    const validStatuses = ['PENDING_REVIEW', 'IN_PROGRESS', 'READY', 'COMPLETED', 'CANCELLED'];
+    // Validate status (FAILED is also set by the processing engine when a job fails)
+    const validStatuses = ['PENDING_REVIEW', 'IN_PROGRESS', 'READY', 'COMPLETED', 'CANCELLED', 'FAILED'];
     if (!validStatuses.includes(status)) {
       return res.status(400).json({
         success: false,
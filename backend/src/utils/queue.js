@@ -13,15 +13,45 @@ redis.on('connect', () => {
 });
 
 const QUEUE_NAME = 'smartcopy_jobs';
+// Priority queue: sorted set scored by deadline (epoch ms), plus a wake list
+// the worker blocks on. Same names as ReliableQueue in the Python worker.
+const SCHEDULED_QUEUE = `${QUEUE_NAME}:scheduled`;
+const WAKE_LIST = `${QUEUE_NAME}:wake`;
+const WAKE_MAX = 1000;
+// Default deadline per priority class, in seconds after enqueue
+// (keep in sync with PRIORITY_CLASSES in reliable_queue.py)
+const PRIORITY_SLACK = { express: 60, normal: 600, bulk: 3600 };
+const SERVICE_PRIORITY = { express: 'express' };
+const BULK_TYPES = new Set(['compress_pdf', 'batch_format']);
+// Worker publishes results to this key AND to a pub/sub channel of the same name
+const RESULT_PREFIX = 'job_result:';
+// Per-item progress events (batch jobs): list + pub/sub channel of the same name
+const PROGRESS_PREFIX = 'job_progress:';
+
+const priorityFor = (jobData) => {
+  if (PRIORITY_SLACK[jobData.priority]) return jobData.priority;
+  if (SERVICE_PRIORITY[jobData.serviceLevel]) return SERVICE_PRIORITY[jobData.serviceLevel];
+  return BULK_TYPES.has(jobData.type) ? 'bulk' : 'normal';
+};
 
 /**
  * Add job to queue
- * @param {Object} jobData 
+ * @param {Object} jobData - may carry `priority` (express|normal|bulk),
+ *   `serviceLevel`, an absolute `deadline` (epoch ms) and `on_late` (run|demote|shed)
  */
 const addToQueue = async (jobData) => {
   try {
-    await redis.rpush(QUEUE_NAME, JSON.stringify(jobData));
-    console.log(`Job added to queue: ${QUEUE_NAME}`, jobData.type);
+    const now = Date.now();
+    const priority = priorityFor(jobData);
+    // enqueued_at: the worker reports queue wait time per job from this
+    const job = { enqueued_at: now, ...jobData, priority };
+    job.deadline = jobData.deadline || job.enqueued_at + PRIORITY_SLACK[priority] * 1000;
+    await redis.multi()
+      .zadd(SCHEDULED_QUEUE, job.deadline, JSON.stringify(job))
+      .rpush(WAKE_LIST, 1)
+      .ltrim(WAKE_LIST, -WAKE_MAX, -1)
+      .exec();
+    console.log(`Job added to queue: ${SCHEDULED_QUEUE}`, jobData.type, priority);
     return true;
   } catch (error) {
     console.error('Failed to add job to queue:', error);
@@ -29,7 +59,62 @@ const addToQueue = async (jobData) => {
   }
 };
 
+/**
+ * Wait for a job result published by the Python worker (no polling).
+ * Resolves with the result object, or null on timeout.
+ * @param {string|number} jobId
+ * @param {number} timeoutMs
+ */
+const waitForJobResult = async (jobId, timeoutMs = 120000) => {
+  const key = `${RESULT_PREFIX}${jobId}`;
+  const subscriber = redis.duplicate();
+  let timer;
+
+  try {
+    const published = new Promise((resolve) => {
+      subscriber.on('message', (channel, payload) => {
+        if (channel === key) resolve(payload);
+      });
+    });
+    await subscriber.subscribe(key);
+
+    // The result may have been published before we subscribed
+    const existing = await redis.get(key);
+    const payload = existing || await Promise.race([
+      published,
+      new Promise((resolve) => { timer = setTimeout(() => resolve(null), timeoutMs); })
+    ]);
+
+    return payload ? JSON.parse(payload) : null;
+  } finally {
+    clearTimeout(timer);
+    subscriber.disconnect();
+  }
+};
+
+/**
+ * Read a stored job result without waiting.
+ * @param {string|number} jobId
+ */
+const getJobResult = async (jobId) => {
+  const payload = await redis.get(`${RESULT_PREFIX}${jobId}`);
+  return payload ? JSON.parse(payload) : null;
+};
+
+/**
+ * Progress events published so far (e.g. one per finished batch item).
+ * Subscribe to the same channel name for live updates.
+ * @param {string|number} jobId
+ */
+const getJobProgress = async (jobId) => {
+  const events = await redis.lrange(`${PROGRESS_PREFIX}${jobId}`, 0, -1);
+  return events.map((payload) => JSON.parse(payload));
+};
+
 module.exports = {
   addToQueue,
+  waitForJobResult,
+  getJobResult,
+  getJobProgress,
   redis
 };
@@ -0,0 +1,307 @@
+import os
+import io
+import sys
+import json
+import random
+import hashlib
+import zipfile
+import datetime
+from docx import Document
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.shared import Cm, Pt
+from PIL import Image, ImageDraw
+from PyPDF2 import PdfWriter, PageObject
+from PyPDF2.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+# Naikkan kalau generator berubah -> corpus lama dibuat ulang, baseline lama tidak sebanding
+CORPUS_VERSION = 1
+
+# Tanggal tetap untuk metadata & entry zip: file hasil generate identik byte-per-byte
+FIXED_DATE = datetime.datetime(2024, 1, 1)
+ZIP_DATE = (2024, 1, 1, 0, 0, 0)
+
+# Skripsi sintetis: halaman target, jumlah run per paragraf (min, max), tabel, gambar
+THESES = {
+    'thesis_10p': {'pages': 10, 'runs': (1, 3), 'tables': 1, 'images': 1, 'seed': 10},
+    'thesis_100p': {'pages': 100, 'runs': (2, 6), 'tables': 8, 'images': 6, 'seed': 100},
+    'thesis_500p': {'pages': 500, 'runs': (4, 12), 'tables': 30, 'images': 20, 'seed': 500},
+}
+# Master template (pemberi gaya) untuk apply_style / format
+TEMPLATE = {'pages': 12, 'seed': 7}
+# PDF: teks murni (vektor) dan hasil scan (satu gambar per halaman)
+PDFS = {
+    'text_60p': {'kind': 'text', 'pages': 60, 'seed': 60},
+    'scan_8p': {'kind': 'scan', 'pages': 8, 'dpi': 200, 'seed': 8},
+}
+QUICK = ('thesis_10p', 'thesis_100p', 'text_60p', 'scan_8p')
+
+PARAGRAPHS_PER_PAGE = 9
+WORDS = (
+    'penelitian data metode hasil analisis sistem yang dan untuk dengan pada '
+    'dalam sebagai adalah ini dari oleh terhadap pengaruh variabel sampel '
+    'responden menunjukkan bahwa nilai signifikan model pengujian teori '
+    'kerangka konsep informasi pengembangan aplikasi pengguna kinerja'
+).split()
+CHAPTERS = ('PENDAHULUAN', 'TINJAUAN PUSTAKA', 'METODOLOGI PENELITIAN',
+            'HASIL DAN PEMBAHASAN', 'PENUTUP')
+ROMAN = ('I', 'II', 'III', 'IV', 'V')
+# Format "salah" yang sengaja dicampur supaya processor benar-benar bekerja
+MESSY_FONTS = ('Calibri', 'Arial', 'Times New Roman', 'Cambria')
+MESSY_SIZES = (10, 11, 12, 13)
+
+
+def _sentence(rnd, words):
+    return ' '.join(rnd.choice(WORDS) for _ in range(words))
+
+
+def _image(rnd, width=480, height=320):
+    """PNG deterministik: blok warna + noise (mirip foto/grafik, tidak terlalu mudah dikompres)"""
+    image = Image.frombytes('RGB', (width, height), rnd.randbytes(width * height * 3))
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x, y = rnd.randrange(width), rnd.randrange(height)
+        draw.rectangle([x, y, x + rnd.randrange(40, 160), y + rnd.randrange(30, 120)],
+                       fill=tuple(rnd.randrange(256) for _ in range(3)))
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG')
+    buffer.seek(0)
+    return buffer
+
+
+def _normalize_zip(path):
+    """Tulis ulang zip dengan timestamp tetap (python-docx memakai jam sekarang)"""
+    with zipfile.ZipFile(path) as source:
+        members = [(info, source.read(info.filename)) for info in source.infolist()]
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as target:
+        for info, data in members:
+            target.writestr(zipfile.ZipInfo(info.filename, ZIP_DATE), data, zipfile.ZIP_DEFLATED)
+
+
+def _save_docx(doc, path):
+    props = doc.core_properties
+    props.author = props.last_modified_by = 'smartcopy-bench'
+    props.created = props.modified = FIXED_DATE
+    props.revision = 1
+    doc.save(path)
+    _normalize_zip(path)
+
+
+def _messy_paragraph(doc, rnd, runs, words=34):
+    paragraph = doc.add_paragraph()
+    count = rnd.randint(*runs)
+    for index in range(count):
+        run = paragraph.add_run(_sentence(rnd, max(2, words // count)) + ' ')
+        run.font.name = rnd.choice(MESSY_FONTS)
+        run.font.size = Pt(rnd.choice(MESSY_SIZES))
+        if index and rnd.random() < 0.1:
+            run.italic = True
+    paragraph.paragraph_format.line_spacing = rnd.choice((1.0, 1.15, 1.5))
+    return paragraph
+
+
+def make_thesis(path, pages, runs=(1, 4), tables=0, images=0, seed=1):
+    """
+    Skripsi sintetis: ABSTRAK, DAFTAR ISI, BAB I-V (sub-bab, tabel, gambar),
+    DAFTAR PUSTAKA. Format sengaja tidak seragam (font, ukuran, spasi).
+    """
+    rnd = random.Random(seed)
+    doc = Document()
+    for section in doc.sections:
+        section.top_margin = section.bottom_margin = Cm(2)
+        section.left_margin = section.right_margin = Cm(2.5)
+
+    title = doc.add_paragraph(_sentence(rnd, 10).upper())
+    title.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    doc.add_page_break()
+
+    doc.add_paragraph('ABSTRAK')
+    for _ in range(3):
+        _messy_paragraph(doc, rnd, runs, words=60)
+    doc.add_paragraph('Kata kunci: ' + ', '.join(rnd.sample(WORDS, 5)))
+    doc.add_page_break()
+
+    doc.add_paragraph('DAFTAR ISI')
+    for number, chapter in zip(ROMAN, CHAPTERS):
+        doc.add_paragraph(f'BAB {number} {chapter} ........ {rnd.randint(1, pages)}')
+    doc.add_page_break()
+
+    body = max(PARAGRAPHS_PER_PAGE, pages * PARAGRAPHS_PER_PAGE - 40)
+    per_chapter = body // len(CHAPTERS)
+    # Posisi tabel & gambar tersebar merata di seluruh body
+    table_at = {int(i * body / tables) for i in range(tables)} if tables else set()
+    image_at = {int((i + 0.5) * body / images) for i in range(images)} if images else set()
+    written = 0
+    for number, chapter in zip(ROMAN, CHAPTERS):
+        doc.add_paragraph(f'BAB {number}')
+        doc.add_paragraph(chapter)
+        for index in range(per_chapter):
+            if index % 25 == 0:
+                doc.add_paragraph(f'{ROMAN.index(number) + 1}.{index // 25 + 1} {_sentence(rnd, 3).title()}')
+            _messy_paragraph(doc, rnd, runs)
+            if written in table_at:
+                table = doc.add_table(rows=6, cols=4)
+                for row in table.rows:
+                    for cell in row.cells:
+                        cell.text = _sentence(rnd, 2)
+            if written in image_at:
+                doc.add_paragraph().add_run().add_picture(_image(rnd), width=Cm(10))
+                doc.add_paragraph(f'Gambar {len(image_at)} {_sentence(rnd, 4)}')
+            written += 1
+        doc.add_page_break()
+
+    doc.add_paragraph('DAFTAR PUSTAKA')
+    for index in range(max(10, pages // 3)):
+        doc.add_paragraph(
+            f'{_sentence(rnd, 1).title()}, {chr(65 + index % 26)}. ({rnd.randint(1995, 2024)}). '
+            f'{_sentence(rnd, 6).capitalize()}. Jakarta: Penerbit {_sentence(rnd, 1).title()}.'
+        )
+    _save_docx(doc, path)
+
+
+def make_template(path, pages=12, seed=7):
+    """Master rapi: A4, margin 4-3-3-3 cm, Times New Roman 12, spasi 2, rata kiri-kanan"""
+    rnd = random.Random(seed)
+    doc = Document()
+    style = doc.styles['Normal']
+    style.font.name = 'Times New Roman'
+    style.font.size = Pt(12)
+    style.paragraph_format.line_spacing = 2.0
+    style.paragraph_format.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
+    style.paragraph_format.first_line_indent = Cm(1.25)
+    for section in doc.sections:
+        section.page_width, section.page_height = Cm(21), Cm(29.7)
+        section.top_margin, section.left_margin = Cm(4), Cm(4)
+        section.bottom_margin, section.right_margin = Cm(3), Cm(3)
+
+    doc.add_paragraph('ABSTRAK').alignment = WD_ALIGN_PARAGRAPH.CENTER
+    doc.add_paragraph(_sentence(rnd, 120))
+    per_chapter = max(1, pages * 4 // len(CHAPTERS))
+    for number, chapter in zip(ROMAN, CHAPTERS):
+        heading = doc.add_paragraph(f'BAB {number}')
+        heading.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        heading.runs[0].bold = True
+        doc.add_paragraph(chapter).runs[0].bold = True
+        for _ in range(per_chapter):
+            doc.add_paragraph(_sentence(rnd, 40))
+    doc.add_paragraph('DAFTAR PUSTAKA').alignment = WD_ALIGN_PARAGRAPH.CENTER
+    for index in range(10):
+        entry = doc.add_paragraph(f'Penulis {index}. ({2000 + index}). {_sentence(rnd, 6)}.')
+        entry.paragraph_format.first_line_indent = Cm(-1.25)
+        entry.paragraph_format.left_indent = Cm(1.25)
+    _save_docx(doc, path)
+
+
+def make_text_pdf(path, pages, seed=1):
+    """PDF teks vektor (satu font Type1 bersama), sebagian halaman ada blok warna"""
+    rnd = random.Random(seed)
+    writer = PdfWriter()
+    font = writer._add_object(DictionaryObject({
+        NameObject('/Type'): NameObject('/Font'),
+        NameObject('/Subtype'): NameObject('/Type1'),
+        NameObject('/BaseFont'): NameObject('/Times-Roman')
+    }))
+    for index in range(pages):
+        page = PageObject.create_blank_page(None, 595, 842)
+        lines = [f"BT /F1 11 Tf 0 g 72 {y} Td ({_sentence(rnd, 12)}) Tj ET" for y in range(780, 60, -14)]
+        if index % 10 == 0:
+            lines.append("0.2 0.3 0.8 rg 72 72 200 100 re f")
+        stream = DecodedStreamObject()
+        stream.set_data('\n'.join(lines).encode('latin-1'))
+        page[NameObject('/Contents')] = writer._add_object(stream.flate_encode())
+        page[NameObject('/Resources')] = DictionaryObject({
+            NameObject('/Font'): DictionaryObject({NameObject('/F1'): font})
+        })
+        writer.add_page(page)
+    with open(path, 'wb') as f:
+        writer.write(f)
+
+
+def make_scanned_pdf(path, pages, dpi=200, seed=1):
+    """PDF hasil scan: satu gambar A4 per halaman (abu-abu, halaman pertama berwarna)"""
+    rnd = random.Random(seed)
+    width, height = int(8.27 * dpi), int(11.69 * dpi)
+    images = []
+    for index in range(pages):
+        image = Image.new('RGB' if index == 0 else 'L', (width, height), 'white' if index == 0 else 235)
+        draw = ImageDraw.Draw(image)
+        for y in range(dpi, height - dpi, dpi // 6):
+            shade = rnd.randint(20, 80)
+            draw.rectangle([dpi, y, dpi + rnd.randint(width // 2, width - 2 * dpi), y + dpi // 12],
+                           fill=(shade, shade, 160) if index == 0 else shade)
+        images.append(image)
+    images[0].save(path, save_all=True, append_images=images[1:], resolution=dpi, quality=85,
+                   creationDate=FIXED_DATE.timetuple(), modDate=FIXED_DATE.timetuple())
+
+
+def corpus_spec(names=None):
+    """Spesifikasi corpus yang dipakai (untuk fingerprint & regenerasi)"""
+    spec = {'version': CORPUS_VERSION, 'template': TEMPLATE, 'documents': {}}
+    for name, params in list(THESES.items()) + list(PDFS.items()):
+        if names is None or name in names:
+            spec['documents'][name] = params
+    return spec
+
+
+def _sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def build_corpus(corpus_dir, names=None):
+    """
+    Generate corpus ke corpus_dir (dilewati kalau manifest sudah cocok).
+    Return manifest: {'fingerprint': ..., 'files': {nama: {'path', 'bytes', 'sha256'}}}
+    """
+    os.makedirs(corpus_dir, exist_ok=True)
+    spec = corpus_spec(names)
+    manifest_path = os.path.join(corpus_dir, 'manifest.json')
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {'files': {}}
+
+    files = manifest.get('files', {})
+    wanted = dict(spec['documents'], template=TEMPLATE)
+    for name, params in wanted.items():
+        entry = files.get(name)
+        params = json.loads(json.dumps(params))  # tuple -> list, sama seperti di manifest
+        if entry and entry.get('params') == params and entry.get('version') == CORPUS_VERSION \
+                and os.path.exists(entry['path']) and os.path.getsize(entry['path']) == entry['bytes']:
+            continue
+        if name == 'template':
+            path = os.path.join(corpus_dir, 'template.docx')
+            make_template(path, params['pages'], params['seed'])
+        elif name in THESES:
+            path = os.path.join(corpus_dir, f'{name}.docx')
+            make_thesis(path, params['pages'], tuple(params['runs']), params['tables'], params['images'], params['seed'])
+        elif params['kind'] == 'text':
+            path = os.path.join(corpus_dir, f'{name}.pdf')
+            make_text_pdf(path, params['pages'], params['seed'])
+        else:
+            path = os.path.join(corpus_dir, f'{name}.pdf')
+            make_scanned_pdf(path, params['pages'], params['dpi'], params['seed'])
+        print(f"[corpus] generated {name}: {os.path.getsize(path) / 1e6:.2f} MB")
+        files[name] = {
+            'path': path, 'bytes': os.path.getsize(path), 'sha256': _sha256(path),
+            'params': params, 'version': CORPUS_VERSION
+        }
+
+    selected = {name: files[name] for name in wanted}
+    fingerprint = hashlib.sha256(json.dumps(
+        {name: entry['sha256'] for name, entry in sorted(selected.items())}
+    ).encode()).hexdigest()[:16]
+    manifest = {'files': files}
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return {'fingerprint': fingerprint, 'files': selected}
+
+
+if __name__ == '__main__':
+    # python -m benchmarks.corpus <dir> [--quick]
+    target = sys.argv[1] if len(sys.argv) > 1 and not sys.argv[1].startswith('--') else 'bench-corpus'
+    result = build_corpus(target, QUICK if '--quick' in sys.argv else None)
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,141 @@
+"""
+Speedup jalur paralel PDF besar (rentang halaman per worker sandbox)
+terhadap jumlah worker / core.
+
+    cd processing-engine
+    python -m benchmarks.parallel                          # 1, 2, 4, ... sampai jumlah core
+    python -m benchmarks.parallel --workers 1,2,4,8 --pages 240 --repeat 3
+
+PDF scan dibuat sekali (deterministik) di folder corpus. Setiap jumlah
+worker diukur lewat handle_job (preflight -> rentang -> sandbox -> merge),
+sama seperti job dari queue; 1 worker = jalur satu proses. Hasil ke
+benchmarks/results/parallel.json. Speedup hanya bermakna kalau jumlah
+worker <= jumlah core mesin.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import statistics
+
+import worker_manager
+from utils.preflight import preflight_job
+from utils.sandbox import SandboxPool
+from benchmarks.corpus import make_scanned_pdf
+from benchmarks.run import DEFAULT_CORPUS_DIR, RESULTS_DIR, _git_revision
+
+JOBS = ('compress_pdf', 'count_pages')
+
+
+def _default_workers():
+    counts, count = [], 1
+    while count < (os.cpu_count() or 1):
+        counts.append(count)
+        count *= 2
+    return counts + [os.cpu_count() or 1]
+
+
+def _job(job_type, path, out_dir, workers):
+    if job_type == 'compress_pdf':
+        # 'screen': semua gambar scan di-downsample, tahap paling berat ikut terukur
+        return {'type': job_type, 'input': path, 'profile': 'screen',
+                'output': os.path.join(out_dir, f'compressed-{workers}.pdf')}
+    return {'type': job_type, 'input': path}
+
+
+def measure(path, workers, out_dir, repeat):
+    """Median wall time per jenis job dengan `workers` rentang paralel"""
+    worker_manager.PDF_PARALLEL_WORKERS = workers
+    worker_manager._sandbox_pool = SandboxPool(size=workers)
+    results = {}
+    try:
+        for job_type in JOBS:
+            walls = []
+            for _ in range(repeat):
+                job = preflight_job(_job(job_type, path, out_dir, workers))
+                started = time.perf_counter()
+                result = worker_manager.handle_job(job)
+                walls.append(time.perf_counter() - started)
+                if result.get('status') != 'success':
+                    raise RuntimeError(result.get('error') or result.get('message'))
+            results[job_type] = {
+                'wall_s': round(statistics.median(walls), 4),
+                'ranges': result.get('ranges') or 1,
+                'pages': result.get('pages') or result.get('page_count'),
+                'output_bytes': result.get('compressed_size')
+            }
+    finally:
+        worker_manager._sandbox_pool.close()
+        worker_manager._sandbox_pool = None
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Speedup jalur paralel PDF vs jumlah worker')
+    parser.add_argument('--workers', help='Daftar jumlah worker, mis. "1,2,4" (default: 1, 2, 4, ... jumlah core)')
+    parser.add_argument('--pages', type=int, default=120, help='Halaman PDF scan')
+    parser.add_argument('--dpi', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=3, help='Run per ukuran (median dilaporkan)')
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS_DIR)
+    parser.add_argument('--out', default=os.path.join(RESULTS_DIR, 'parallel.json'))
+    parser.add_argument('--verbose', action='store_true', help='Tampilkan output engine')
+    args = parser.parse_args(argv)
+
+    counts = sorted({int(value) for value in args.workers.split(',')}) if args.workers else _default_workers()
+    if counts[0] != 1:
+        counts.insert(0, 1)  # Pembanding speedup
+    os.makedirs(args.corpus, exist_ok=True)
+    path = os.path.join(args.corpus, f'scan_{args.pages}p_{args.dpi}dpi.pdf')
+    if not os.path.exists(path):
+        make_scanned_pdf(path, args.pages, args.dpi, seed=args.pages)
+        print(f"[corpus] generated {os.path.basename(path)}: {os.path.getsize(path) / 1e6:.2f} MB")
+    if max(counts) > (os.cpu_count() or 1):
+        print(f"Warning: {os.cpu_count()} core(s), worker counts above that cannot speed up")
+
+    stdout = sys.stdout
+    rows = {}
+    with tempfile.TemporaryDirectory(prefix='smartcopy-parallel-') as out_dir:
+        for workers in counts:
+            if not args.verbose:
+                sys.stdout = open(os.devnull, 'w')
+            try:
+                rows[workers] = measure(path, workers, out_dir, args.repeat)
+            finally:
+                if sys.stdout is not stdout:
+                    sys.stdout.close()
+                    sys.stdout = stdout
+
+    print(f"\n{'job':<14} {'workers':>7} {'ranges':>6} {'wall':>9} {'speedup':>8} {'efficiency':>10}")
+    for job_type in JOBS:
+        base = rows[1][job_type]['wall_s']
+        for workers in counts:
+            row = rows[workers][job_type]
+            speedup = base / row['wall_s'] if row['wall_s'] else 0.0
+            row['speedup'] = round(speedup, 3)
+            print(f"{job_type:<14} {workers:>7} {row['ranges']:>6} {row['wall_s']:>8.3f}s "
+                  f"{speedup:>7.2f}x {speedup / workers:>9.0%}")
+
+    report = {
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'git': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'input': {'pages': args.pages, 'dpi': args.dpi, 'bytes': os.path.getsize(path)},
+            'repeat': args.repeat
+        },
+        'results': {str(workers): result for workers, result in rows.items()}
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults: {args.out}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
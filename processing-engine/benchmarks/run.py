@@ -0,0 +1,359 @@
+"""
+Benchmark processing engine atas corpus sintetis yang deterministik.
+
+    cd processing-engine
+    python -m benchmarks.run --save-baseline     # sekali, di mesin pembanding
+    python -m benchmarks.run                     # bandingkan; exit 1 kalau regresi
+    python -m benchmarks.run --quick --filter compress_pdf --repeat 5
+
+Per case dicatat wall time (median), CPU time, puncak RSS dan ukuran output
+ke JSON (benchmarks/results/). Baseline hanya sebanding di mesin yang sama.
+"""
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+import multiprocessing
+
+# Modul engine di-import sekali di parent (seperti worker sandbox yang sudah
+# pre-warm); tiap case jalan di proses fork baru supaya cache & memori bersih.
+import style_applicator
+import smart_processor
+import template_scanner
+import worker_manager
+from utils import telemetry, template_cache
+from utils.pdf_compressor import DEFAULT_PROFILE, compress_pdf
+from utils.result_cache import ENGINE_VERSION
+from utils.sandbox import SandboxPool
+from benchmarks.corpus import QUICK, THESES, PDFS, build_corpus
+
+RESULTS_VERSION = 1
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+DEFAULT_CORPUS_DIR = os.getenv('BENCH_CORPUS_DIR', os.path.join(tempfile.gettempdir(), 'smartcopy-bench-corpus'))
+
+# Perubahan di bawah selisih absolut ini dianggap noise, berapa pun rasionya
+MIN_DELTA = {
+    'wall_s': 0.02,
+    'cpu_s': 0.02,
+    'peak_rss': 8 * 1024 * 1024,
+    'output_bytes': 1024,
+}
+
+
+# --- Case ----------------------------------------------------------------
+
+def _size(path):
+    return os.path.getsize(path) if path and os.path.exists(path) else 0
+
+
+def _setup_process_document(corpus, doc, out_dir):
+    rules = template_cache.to_processor_rules(template_cache.get_compiled_rules(corpus['template']['path']))
+    output = os.path.join(out_dir, f'{doc}.docx')
+
+    def run():
+        smart_processor.SmartProcessor(rules).process_document(corpus[doc]['path'], output)
+        return _size(output)
+    return run
+
+
+def _setup_apply_style(corpus, doc, out_dir):
+    template_cache.get_compiled_rules(corpus['template']['path'])  # Template sudah ter-compile, seperti produksi
+    output = os.path.join(out_dir, f'{doc}.docx')
+
+    def run():
+        style_applicator.apply_style(corpus[doc]['path'], corpus['template']['path'], output)
+        return _size(output)
+    return run
+
+
+def _setup_scan_template(corpus, doc, out_dir):
+    state = {'run': 0}
+
+    def run():
+        # Cache template dikosongkan tiap run: yang diukur compile dingin
+        state['run'] += 1
+        template_cache.TEMPLATE_CACHE_DIR = os.path.join(out_dir, f'templates-{state["run"]}')
+        template_cache._load_compiled.cache_clear()
+        return len(json.dumps(template_scanner.scan_template(corpus[doc]['path'])))
+    return run
+
+
+def _setup_compress_pdf(corpus, doc, out_dir):
+    output = os.path.join(out_dir, f'{doc}.pdf')
+
+    def run():
+        compress_pdf(corpus[doc]['path'], output, DEFAULT_PROFILE)
+        return _size(output)
+    return run
+
+
+def _setup_handle_job(corpus, doc, out_dir):
+    """Jalur lengkap worker: dispatch -> sandbox pool -> tool, seperti job dari queue"""
+    if doc in THESES:
+        template_cache.get_compiled_rules(corpus['template']['path'])
+        job = {'type': 'format', 'input': corpus[doc]['path'], 'ref': corpus['template']['path'],
+               'output': os.path.join(out_dir, f'{doc}.docx')}
+    else:
+        job = {'type': 'compress_pdf', 'input': corpus[doc]['path'], 'profile': DEFAULT_PROFILE,
+               'output': os.path.join(out_dir, f'{doc}.pdf')}
+    worker_manager._sandbox_pool = SandboxPool(size=1, max_jobs_per_worker=0)
+
+    def run():
+        result = worker_manager.handle_job(dict(job))
+        if result.get('status') != 'success':
+            raise RuntimeError(result.get('error') or result.get('message'))
+        return _size(job['output'])
+    return run
+
+
+BENCHMARKS = {
+    'process_document': (_setup_process_document, tuple(THESES)),
+    'apply_style': (_setup_apply_style, tuple(THESES)),
+    'scan_template': (_setup_scan_template, tuple(THESES)),
+    'compress_pdf': (_setup_compress_pdf, tuple(PDFS)),
+    'handle_job': (_setup_handle_job, tuple(THESES) + tuple(PDFS)),
+}
+
+
+def list_cases(documents, pattern=None):
+    """['process_document/thesis_10p', ...] untuk dokumen yang ada di corpus"""
+    cases = []
+    for benchmark, (_, docs) in BENCHMARKS.items():
+        for doc in docs:
+            name = f'{benchmark}/{doc}'
+            if doc in documents and (pattern is None or re.search(pattern, name)):
+                cases.append(name)
+    return cases
+
+
+# --- Pengukuran (di proses anak) -------------------------------------------
+
+def _measure(conn, name, corpus, work_dir, repeat, verbose):
+    if not verbose:
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 1)
+    benchmark, doc = name.split('/', 1)
+    out_dir = os.path.join(work_dir, benchmark)
+    os.makedirs(out_dir, exist_ok=True)
+    template_cache.TEMPLATE_CACHE_DIR = os.path.join(work_dir, 'templates')
+    try:
+        run = BENCHMARKS[benchmark][0](corpus, doc, out_dir)
+        samples = []
+        for _ in range(repeat):
+            rss_reset = telemetry.reset_peak_rss()
+            with telemetry.trace(job_type=name) as job_trace:
+                cpu_started = time.process_time()
+                started = time.perf_counter()
+                output_bytes = run()
+                wall = time.perf_counter() - started
+                cpu = time.process_time() - cpu_started
+            samples.append({
+                'wall_s': wall,
+                # Kerja di proses sandbox (handle_job) ikut dihitung
+                'cpu_s': cpu + job_trace.cpu_seconds,
+                'peak_rss': max(telemetry.peak_rss_bytes(), job_trace.peak_rss),
+                'output_bytes': output_bytes,
+                'rss_reset': rss_reset,
+                'stages': job_trace.to_dict()['spans']
+            })
+        conn.send({'samples': samples})
+    except BaseException as e:
+        conn.send({'error': f'{type(e).__name__}: {e}'})
+    finally:
+        if worker_manager._sandbox_pool is not None:
+            worker_manager._sandbox_pool.close()
+        conn.close()
+
+
+def _stage_totals(spans):
+    totals = {}
+    for span_data in spans:
+        totals[span_data['name']] = round(totals.get(span_data['name'], 0) + span_data['duration_ms'], 2)
+    return totals
+
+
+def run_case(name, corpus, work_dir, repeat=3, timeout=900, verbose=False):
+    """Jalankan satu case di proses fork baru; ringkasan median/min/max"""
+    ctx = multiprocessing.get_context('fork')
+    parent_conn, child_conn = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_measure, args=(child_conn, name, corpus, work_dir, repeat, verbose))
+    process.start()
+    child_conn.close()
+    try:
+        reply = parent_conn.recv() if parent_conn.poll(timeout) else {'error': f'Timed out after {timeout}s'}
+    except EOFError:
+        reply = {'error': f'Benchmark process died (exit code {process.exitcode})'}
+    # Beri waktu anak menutup sandbox pool-nya sendiri sebelum dibunuh
+    process.join(30)
+    if process.is_alive():
+        process.kill()
+        process.join()
+
+    doc = name.split('/', 1)[1]
+    summary = {'input_bytes': corpus[doc]['bytes']}
+    if 'error' in reply:
+        summary['error'] = reply['error']
+        return summary
+    samples = reply['samples']
+    walls = [sample['wall_s'] for sample in samples]
+    summary.update({
+        'wall_s': round(statistics.median(walls), 4),
+        'wall_min': round(min(walls), 4),
+        'wall_max': round(max(walls), 4),
+        'cpu_s': round(statistics.median(sample['cpu_s'] for sample in samples), 4),
+        'peak_rss': max(sample['peak_rss'] for sample in samples),
+        'output_bytes': samples[-1]['output_bytes'],
+        'runs': len(samples),
+        'rss_reset': all(sample['rss_reset'] for sample in samples),
+        'stages_ms': _stage_totals(samples[-1]['stages'])
+    })
+    return summary
+
+
+# --- Perbandingan baseline ----------------------------------------------
+
+def compare(current, baseline, threshold=0.10):
+    """
+    Bandingkan hasil dengan baseline per case & metrik.
+    Regresi = naik lebih dari `threshold` (rasio) DAN lebih dari MIN_DELTA.
+    Return list baris {'case', 'metric', 'baseline', 'current', 'change', 'status'}.
+    """
+    rows = []
+    for name, result in current['results'].items():
+        base = baseline.get('results', {}).get(name)
+        if base is None or 'error' in base:
+            rows.append({'case': name, 'metric': '-', 'baseline': None, 'current': None,
+                         'change': None, 'status': 'new'})
+            continue
+        if 'error' in result:
+            rows.append({'case': name, 'metric': '-', 'baseline': None, 'current': None,
+                         'change': None, 'status': 'error'})
+            continue
+        for metric, min_delta in MIN_DELTA.items():
+            old, new = base.get(metric), result.get(metric)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old if old else 0.0
+            status = 'ok'
+            if new - old > min_delta and change > threshold:
+                status = 'regression'
+            elif old - new > min_delta and -change > threshold:
+                status = 'improved'
+            rows.append({'case': name, 'metric': metric, 'baseline': old, 'current': new,
+                         'change': round(change, 4), 'status': status})
+    return rows
+
+
+def _fmt(metric, value):
+    if value is None:
+        return '-'
+    if metric in ('peak_rss', 'output_bytes'):
+        return f'{value / 1024 / 1024:.2f}MB'
+    return f'{value:.3f}s'
+
+
+def print_comparison(rows):
+    flagged = [row for row in rows if row['status'] != 'ok']
+    print(f"\n{'case':<36} {'metric':<13} {'baseline':>10} {'current':>10} {'change':>8}  status")
+    for row in flagged:
+        change = f"{row['change'] * 100:+.1f}%" if row['change'] is not None else '-'
+        print(f"{row['case']:<36} {row['metric']:<13} {_fmt(row['metric'], row['baseline']):>10} "
+              f"{_fmt(row['metric'], row['current']):>10} {change:>8}  {row['status']}")
+    if not flagged:
+        print("(no changes beyond threshold)")
+
+
+# --- CLI ---------------------------------------------------------------------
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, cwd=BENCH_DIR, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='SmartCopy processing engine benchmarks')
+    parser.add_argument('--quick', action='store_true', help=f'Corpus kecil saja ({", ".join(QUICK)})')
+    parser.add_argument('--filter', help='Regex nama case, mis. "compress|scan_template"')
+    parser.add_argument('--repeat', type=int, default=3, help='Run per case (median dilaporkan)')
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS_DIR, help='Folder corpus (dibuat kalau belum ada)')
+    parser.add_argument('--out', default=os.path.join(RESULTS_DIR, 'latest.json'))
+    parser.add_argument('--baseline', default=os.path.join(RESULTS_DIR, 'baseline.json'))
+    parser.add_argument('--threshold', type=float, default=0.10, help='Batas regresi (0.10 = +10%%)')
+    parser.add_argument('--save-baseline', action='store_true', help='Simpan hasil ini sebagai baseline')
+    parser.add_argument('--timeout', type=int, default=900, help='Batas detik per case')
+    parser.add_argument('--verbose', action='store_true', help='Tampilkan output engine')
+    args = parser.parse_args(argv)
+
+    manifest = build_corpus(args.corpus, QUICK if args.quick else None)
+    corpus = manifest['files']
+    cases = list_cases(corpus, args.filter)
+    work_dir = tempfile.mkdtemp(prefix='smartcopy-bench-')
+
+    results = {}
+    try:
+        for name in cases:
+            summary = run_case(name, corpus, work_dir, args.repeat, args.timeout, args.verbose)
+            results[name] = summary
+            if 'error' in summary:
+                print(f"{name:<36} ERROR {summary['error']}", flush=True)
+            else:
+                print(f"{name:<36} wall {summary['wall_s']:8.3f}s  cpu {summary['cpu_s']:8.3f}s  "
+                      f"rss {summary['peak_rss'] / 1024 / 1024:7.1f}MB  out {summary['output_bytes'] / 1024:9.1f}KB", flush=True)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'version': RESULTS_VERSION,
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'git': _git_revision(),
+            'engine_version': ENGINE_VERSION,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'corpus': manifest['fingerprint'],
+            'repeat': args.repeat
+        },
+        'results': results
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults: {args.out}")
+
+    if args.save_baseline:
+        shutil.copyfile(args.out, args.baseline)
+        print(f"Baseline saved: {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print("No baseline yet (run with --save-baseline to create one)")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    for key in ('corpus', 'cpus', 'python'):
+        if baseline['meta'].get(key) != report['meta'][key]:
+            print(f"Warning: baseline {key} differs ({baseline['meta'].get(key)} vs {report['meta'][key]}), "
+                  f"numbers may not be comparable")
+    rows = compare(report, baseline, args.threshold)
+    print_comparison(rows)
+    regressions = [row for row in rows if row['status'] in ('regression', 'error')]
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) above {args.threshold:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,183 @@
+import io
+import os
+import shutil
+import time
+from utils import telemetry
+from utils.docx_io import open_docx
+from utils.page_counter import count_pages
+from utils.pdf_compressor import compress_pdf, DEFAULT_PROFILE
+from utils.template_cache import get_compiled_rules, to_processor_rules, to_scanner_rules
+from style_applicator import style_document
+from smart_processor import SmartProcessor
+
+# Tahap pipeline -> (jenis dokumen yang dibutuhkan, jenis hasil); None = apa saja / tidak berubah
+PIPELINE_STAGES = {
+    'scan_template': (None, None),
+    'format': ('docx', None),
+    'smart_rules': ('docx', None),
+    'count_pages': (None, None),
+    'convert': ('docx', 'pdf'),
+    'compress': ('pdf', None),
+}
+# Tahap yang jalan di parent (pakai converter pool), sisanya di sandbox
+CONVERTER_STAGES = {'convert'}
+
+
+def document_kind(path):
+    return 'pdf' if str(path).lower().endswith('.pdf') else 'docx'
+
+
+def plan_pipeline(stages, input_path, ref=None, rules=None):
+    """
+    Validasi daftar tahap & kelompokkan jadi segmen [(runner, [tahap, ...])].
+    Tahap berurutan di runner yang sama = satu panggilan, dokumen tetap di memori.
+    Raise ValueError kalau daftar tahap tidak valid.
+    """
+    if not isinstance(stages, list) or not stages:
+        raise ValueError("Pipeline needs a non-empty list of stages")
+    unknown = [name for name in stages if name not in PIPELINE_STAGES]
+    if unknown:
+        raise ValueError(f"Unknown pipeline stage(s): {', '.join(map(str, unknown))}")
+    if len(set(stages)) != len(stages):
+        raise ValueError("Pipeline stages must not repeat")
+    needs_template = 'scan_template' in stages or 'format' in stages or ('smart_rules' in stages and not rules)
+    if needs_template and not ref:
+        raise ValueError("Pipeline stages need a template ('ref')")
+
+    kind = document_kind(input_path)
+    segments = []
+    for name in stages:
+        needs, produces = PIPELINE_STAGES[name]
+        if needs is not None and needs != kind:
+            raise ValueError(f"Stage '{name}' needs a {needs} document, got {kind}")
+        kind = produces or kind
+        runner = 'converter' if name in CONVERTER_STAGES else 'sandbox'
+        if segments and segments[-1][0] == runner:
+            segments[-1][1].append(name)
+        else:
+            segments.append((runner, [name]))
+    return segments
+
+
+class _Document:
+    """Dokumen yang sedang diproses satu segmen: sumber (path / bytes) + versi terbuka di memori"""
+
+    def __init__(self, source, kind):
+        self.source = source
+        self.kind = kind
+        self.package = None
+        self.changed = False
+
+    def stream(self):
+        """Sumber sebagai path atau BytesIO (untuk pembaca yang tidak menyentuh isi docx)"""
+        return self.source if isinstance(self.source, str) else io.BytesIO(self.source)
+
+    def docx(self):
+        if self.package is None:
+            self.package = open_docx(self.stream())
+        return self.package.document
+
+    def replace(self, data, kind):
+        self.source, self.kind = data, kind
+        self.package, self.changed = None, False
+
+    def to_bytes(self):
+        """Hasil segmen; None = tidak berubah, tahap berikutnya pakai sumber semula"""
+        if self.package is not None and self.changed:
+            return self.package.to_bytes()
+        return None if isinstance(self.source, str) else self.source
+
+    def save(self, output_path):
+        if self.package is not None and self.changed:
+            self.package.save(output_path)
+        elif isinstance(self.source, str):
+            if os.path.abspath(self.source) != os.path.abspath(output_path):
+                shutil.copyfile(self.source, output_path)
+        else:
+            with open(output_path, 'wb') as f:
+                f.write(self.source)
+
+
+def _stage_scan_template(document, options, context):
+    compiled = context['compiled'] = get_compiled_rules(options['ref'])
+    return {'template': compiled['hash'], 'rules': to_scanner_rules(compiled)}
+
+
+def _template(options, context):
+    if 'compiled' not in context:
+        context['compiled'] = get_compiled_rules(options['ref'])
+    return context['compiled']
+
+
+def _stage_format(document, options, context):
+    changes = style_document(document.docx(), _template(options, context))
+    compliant = not any(changes.values())
+    document.changed |= not compliant
+    return {'compliant': compliant, 'changes': changes}
+
+
+def _stage_smart_rules(document, options, context):
+    rules = options.get('rules') or to_processor_rules(_template(options, context))
+    processor = SmartProcessor(rules, use_styles=bool(options.get('use_styles')))
+    compliant = processor.process(document.docx())
+    document.changed |= not compliant
+    return {'compliant': compliant, 'changes': processor.changes, 'warnings': processor.warnings}
+
+
+def _stage_count_pages(document, options, context):
+    # DOCX: metadata halaman (docProps) tidak diubah tahap format, cukup baca sumbernya
+    return count_pages(document.stream(), options.get('copies', 1), kind=document.kind)
+
+
+def _stage_compress(document, options, context):
+    output = io.BytesIO()
+    report = compress_pdf(document.stream(), output, options.get('profile') or DEFAULT_PROFILE)
+    if report['success']:
+        document.replace(output.getvalue(), 'pdf')
+    return report
+
+
+_STAGE_RUNNERS = {
+    'scan_template': _stage_scan_template,
+    'format': _stage_format,
+    'smart_rules': _stage_smart_rules,
+    'count_pages': _stage_count_pages,
+    'compress': _stage_compress,
+}
+
+
+def run_segment(stages, source, kind, options, output_path=None):
+    """
+    Sandbox entry point: jalankan beberapa tahap berurutan pada satu dokumen.
+    Dokumen dibuka sekali dan diteruskan antar tahap sebagai objek di memori.
+    source: path file atau bytes hasil segmen sebelumnya.
+    output_path: segmen terakhir menulis hasil akhir ke sini; selain itu
+    hasilnya di-return sebagai bytes ('data', None = tidak berubah).
+    """
+    document = _Document(source, kind)
+    context = {}
+    report = {'success': True, 'stages': {}, 'timings_ms': {}}
+    for name in stages:
+        started = time.perf_counter()
+        try:
+            with telemetry.span(f'pipeline.{name}'):
+                result = _STAGE_RUNNERS[name](document, options, context)
+        except Exception as e:
+            result = {'success': False, 'error': str(e)}
+        report['timings_ms'][name] = round((time.perf_counter() - started) * 1000, 1)
+        if result.get('success') is False:
+            report.update({'success': False, 'stage': name, 'error': result.get('error')})
+            return report
+        result.pop('success', None)
+        result.pop('timings', None)
+        report['stages'][name] = result
+
+    started = time.perf_counter()
+    with telemetry.span('pipeline.save'):
+        if output_path:
+            document.save(output_path)
+        else:
+            report['data'] = document.to_bytes()
+    report['timings_ms']['save'] = round((time.perf_counter() - started) * 1000, 1)
+    report['kind'] = document.kind
+    return report
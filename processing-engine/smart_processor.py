@@ -1,32 +1,155 @@
-from docx import Document
-from docx.shared import Pt, Cm, Inches
-from docx.enum.text import WD_ALIGN_PARAGRAPH
 import json
+import shutil
 import sys
-import re
+from utils import telemetry
+from utils.body_walker import DocumentBlocks
+from utils.docx_io import open_docx
+from utils.effective_format import EffectiveFormat, same_value
+from utils.section_map import build_section_map, CHAPTER_HEADING
+from utils.style_writer import (
+    set_doc_defaults, set_style_format, set_run_font_name, strip_run_format,
+    strip_paragraph_line_spacing
+)
+from utils.rule_compiler import compile_rules
+from utils.template_cache import get_compiled_rules, to_processor_rules
+
+# Order in which rule sets are applied; a later rule set wins
+APPLY_ORDER = ['global', 'abstract', 'chapter_headings', 'bibliography', 'table_of_contents']
+
 
 class SmartProcessor:
-    def __init__(self, rules_json):
-        """Initialize processor with rules"""
+    def __init__(self, rules_json, check_only=False, use_styles=False):
+        """
+        Initialize processor with rules.
+        check_only=True only reports what would change, the document is not written.
+        use_styles=True writes global font/size/line spacing into docDefaults and
+        paragraph styles and strips direct run formatting, instead of setting
+        them on every run.
+        Rules are validated and compiled once; invalid rules raise RuleError
+        here, before any document is opened.
+        """
         self.rules = json.loads(rules_json) if isinstance(rules_json, str) else rules_json
+        self.plan = compile_rules(self.rules)
+        self.check_only = check_only
+        self.use_styles = use_styles
         self.warnings = []
+        # Change report: {section: {rule: count}}
+        self.changes = {}
+        self._fmt = None
+        self._blocks = None
+        self._section_map = None
+        self._override_memo = {}
+        self._active_memo = {}
     
-    def process_document(self, input_path, output_path):
-        """Main processing function"""
-        print(f"[SmartProcessor] Loading document: {input_path}")
-        doc = Document(input_path)
+    @classmethod
+    def from_template(cls, template_path, overrides=None):
+        """Build a processor from a master .docx (compiled rules are cached)"""
+        rules = to_processor_rules(get_compiled_rules(template_path))
+        if overrides:
+            for key, value in overrides.items():
+                if isinstance(value, dict) and isinstance(rules.get(key), dict):
+                    rules[key] = {**rules[key], **value}
+                else:
+                    rules[key] = value
+        return cls(rules)
+    
+    def _prepare(self, doc):
+        """Effective-format reader and paragraph walk for this document (memoized style lookups)"""
+        if self._fmt is None or self._fmt.doc is not doc:
+            self._fmt = EffectiveFormat(doc)
+            with telemetry.span('processor.walk'):
+                self._blocks = DocumentBlocks(doc)
+        return self._fmt
+    
+    def _use_section_map(self, doc, section_map):
+        if section_map is None:
+            if self._section_map is not None and self._fmt is not None and self._fmt.doc is doc:
+                return self._section_map
+            section_map = build_section_map(doc.paragraphs)
+        self._section_map = section_map
+        return section_map
+    
+    def _overridden(self, para, stage):
+        """
+        Attributes a later rule set will write for this paragraph anyway.
+        Skipping them avoids writing a value twice and keeps the change
+        report at zero for documents that already match the rules.
+        """
+        section_map = self._section_map
+        index = section_map.index_of(para) if section_map is not None else None
+        if index is None:
+            return frozenset()
+        kinds = section_map.kinds[index]
+        key = (kinds, stage)
+        if key not in self._override_memo:
+            plans = self.plan.sections
+            stages = {'chapter_headings' if kind == CHAPTER_HEADING else kind for kind in kinds}
+            overridden = set()
+            for later in APPLY_ORDER[APPLY_ORDER.index(stage) + 1:]:
+                if later in stages and later in plans:
+                    overridden |= plans[later].targets
+            self._override_memo[key] = frozenset(overridden)
+        return self._override_memo[key]
+    
+    def _active_props(self, plan, skip):
+        """Run and paragraph setters of a plan minus the overridden ones (memoized)"""
+        key = (id(plan), skip)
+        entry = self._active_memo.get(key)
+        # Derived plans are short-lived: an id can be reused by another plan
+        if entry is None or entry[0] is not plan:
+            entry = self._active_memo[key] = (plan, (
+                tuple(prop for prop in plan.run_props if prop.rule not in skip),
+                tuple(prop for prop in plan.paragraph_props if prop.rule not in skip)
+            ))
+        return entry[1]
+    
+    def _needs_change(self, section, rule, current, target):
+        """
+        Record a difference in the change report.
+        Returns True when the caller should write the new value.
+        """
+        if same_value(current, target):
+            return False
+        counts = self.changes.setdefault(section, {})
+        counts[rule] = counts.get(rule, 0) + 1
+        return not self.check_only
+    
+    def process(self, doc):
+        """Apply all rules to an already opened document; True if nothing had to change"""
+        # Classify all paragraphs once, every rule reads from this map
+        with telemetry.span('processor.section_map'):
+            section_map = build_section_map(doc.paragraphs)
         
         # Apply global rules
         print("[SmartProcessor] Applying global rules...")
-        self.apply_global_rules(doc)
+        with telemetry.span('processor.global'):
+            self.apply_global_rules(doc, section_map)
         
         # Apply section-specific rules
         print("[SmartProcessor] Applying section-specific rules...")
-        self.apply_section_rules(doc)
-        
-        # Save
-        doc.save(output_path)
-        print(f"[SmartProcessor] Document saved: {output_path}")
+        self.apply_section_rules(doc, section_map)
+        return not self.changes
+    
+    def process_document(self, input_path, output_path):
+        """Main processing function"""
+        print(f"[SmartProcessor] Loading document: {input_path}")
+        # Media/embeddings stay on disk; untouched parts are copied raw on save
+        with telemetry.span('processor.load'):
+            package = open_docx(input_path)
+            doc = package.document
+        
+        compliant = self.process(doc)
+        if self.check_only:
+            print(f"[SmartProcessor] Check only: {'compliant' if compliant else 'changes needed'}")
+        elif compliant:
+            # Nothing differs from the rules: keep the original bytes, skip re-serialising
+            if output_path != input_path:
+                shutil.copyfile(input_path, output_path)
+            print(f"[SmartProcessor] Already compliant, copied: {output_path}")
+        else:
+            with telemetry.span('processor.save'):
+                package.save(output_path)
+            print(f"[SmartProcessor] Document saved: {output_path}")
         
         # Print warnings
         if self.warnings:
@@ -37,62 +160,135 @@ class SmartProcessor:
         return {
             'success': True,
             'warnings': self.warnings,
-            'output_path': output_path
+            'output_path': None if self.check_only else output_path,
+            'check_only': self.check_only,
+            'compliant': compliant,
+            'changes': self.changes
         }
     
-    def apply_global_rules(self, doc):
+    def apply_global_rules(self, doc, section_map=None):
         """Apply global formatting rules"""
-        if 'global' not in self.rules:
+        plan = self.plan.sections.get('global')
+        if plan is None:
             return
         
-        global_rules = self.rules['global']
+        self._prepare(doc)
+        section_map = self._use_section_map(doc, section_map)
         
         # Apply margins
-        if 'margins' in global_rules:
-            margins = global_rules['margins']
-            for section in doc.sections:
-                if 'top' in margins:
-                    section.top_margin = self._parse_size(margins['top'])
-                if 'bottom' in margins:
-                    section.bottom_margin = self._parse_size(margins['bottom'])
-                if 'left' in margins:
-                    section.left_margin = self._parse_size(margins['left'])
-                if 'right' in margins:
-                    section.right_margin = self._parse_size(margins['right'])
+        for section in doc.sections:
+            for attr, target in self.plan.margins:
+                if self._needs_change('global', 'margins', getattr(section, attr), target):
+                    setattr(section, attr, target)
         
         # Apply font and spacing to all paragraphs
-        if 'font' in global_rules or 'line_spacing' in global_rules:
-            for para in doc.paragraphs:
-                # Skip if paragraph has specific section rule
-                if not self._has_section_marker(para):
-                    self._apply_paragraph_format(para, global_rules)
+        if plan.targets & {'font_name', 'font_size', 'line_spacing'}:
+            if self.use_styles and not self.check_only:
+                self._apply_global_via_styles(doc, section_map, plan)
+            else:
+                # Skip paragraphs that carry a section marker
+                for para in section_map.unmarked():
+                    self._apply_paragraph_format(para, plan, 'global')
+        
+        if 'font_name' in plan.targets:
+            self._apply_outside_body(section_map, plan)
     
-    def apply_section_rules(self, doc):
+    def _apply_outside_body(self, section_map, plan):
+        """
+        Global font name for text outside the body paragraphs: tables, text
+        boxes, content controls, headers, footers, footnotes and endnotes.
+        Sizes, spacing and alignment stay body-only so their layout is kept.
+        Changes are reported per location ('table', 'header', ...).
+        """
+        font_plan = plan._replace(
+            run_props=tuple(prop for prop in plan.run_props if prop.rule == 'font_name'),
+            paragraph_props=()
+        )
+        mapped = {para._p for para in section_map.paragraphs}
+        for block, para in self._blocks.items():
+            if block.p not in mapped:
+                self._apply_paragraph_format(para, font_plan, block.container or block.story)
+    
+    def _apply_global_via_styles(self, doc, section_map, plan):
+        """
+        Style-level variant of the global font/spacing pass.
+        Targets go into docDefaults and the paragraph styles in use; direct
+        run formatting that would shadow them is stripped. A run keeps a
+        direct override only where its character style still disagrees.
+        """
+        fmt = self._fmt
+        paragraphs = section_map.unmarked()
+        values = {prop.rule: prop.value for prop in plan.run_props + plan.paragraph_props}
+        font_name = values.get('font_name')
+        font_size = values.get('font_size')
+        line_spacing = values.get('line_spacing')
+        
+        # 1. docDefaults + paragraph styles used by the affected paragraphs
+        if set_doc_defaults(doc, font_name, font_size):
+            self._needs_change('global', 'styles', False, True)
+        style_ids = {fmt.paragraph_style_id(para) for para in paragraphs}
+        for style_id in sorted(filter(None, style_ids)):
+            style = fmt.style(style_id)
+            if style is None:
+                continue
+            for _ in range(set_style_format(style, fmt, font_name, font_size, line_spacing)):
+                self._needs_change('global', 'styles', False, True)
+        fmt.invalidate()
+        
+        # 2. Strip direct formatting so runs inherit from the styles
+        rest = plan._replace(
+            run_props=(),
+            paragraph_props=tuple(prop for prop in plan.paragraph_props if prop.rule != 'line_spacing')
+        )
+        for para in paragraphs:
+            skip = self._overridden(para, 'global')
+            strip_name = font_name is not None and 'font_name' not in skip
+            strip_size = font_size is not None and 'font_size' not in skip
+            for run in self._blocks.runs(para):
+                if strip_run_format(run, strip_name, strip_size):
+                    self._needs_change('global', 'runs_stripped', False, True)
+                # Character styles can still disagree: keep a per-run override there
+                if strip_name and self._needs_change(
+                        'global', 'font_name', fmt.run_font(run, para, 'name'), font_name):
+                    set_run_font_name(run, font_name)
+                if strip_size and self._needs_change(
+                        'global', 'font_size', fmt.run_font(run, para, 'size'), font_size):
+                    run.font.size = font_size
+            if line_spacing is not None and 'line_spacing' not in skip:
+                if strip_paragraph_line_spacing(para):
+                    self._needs_change('global', 'paragraphs_stripped', False, True)
+            if rest.paragraph_props:
+                self._apply_paragraph_format(para, rest, 'global')
+    
+    def apply_section_rules(self, doc, section_map=None):
         """Apply section-specific rules"""
-        if 'sections' not in self.rules:
-            return
-        
-        sections = self.rules['sections']
+        sections = self.plan.sections
+        self._prepare(doc)
+        section_map = self._use_section_map(doc, section_map)
         
         # Detect and apply abstract rules
         if 'abstract' in sections:
-            self.apply_abstract_rules(doc, sections['abstract'])
+            with telemetry.span('processor.abstract'):
+                self.apply_abstract_rules(section_map, sections['abstract'])
         
         # Detect and apply chapter heading rules
         if 'chapter_headings' in sections:
-            self.apply_chapter_rules(doc, sections['chapter_headings'])
+            with telemetry.span('processor.chapter_headings'):
+                self.apply_chapter_rules(section_map, sections['chapter_headings'])
         
         # Detect and apply bibliography rules
         if 'bibliography' in sections:
-            self.apply_bibliography_rules(doc, sections['bibliography'])
+            with telemetry.span('processor.bibliography'):
+                self.apply_bibliography_rules(section_map, sections['bibliography'])
         
         # Detect and apply table of contents rules
         if 'table_of_contents' in sections:
-            self.apply_toc_rules(doc, sections['table_of_contents'])
+            with telemetry.span('processor.table_of_contents'):
+                self.apply_toc_rules(section_map, sections['table_of_contents'])
     
-    def apply_abstract_rules(self, doc, rules):
+    def apply_abstract_rules(self, section_map, rules):
         """Apply formatting to abstract section"""
-        abstract_paras = self._find_section(doc, ['abstract', 'abstrak'])
+        abstract_paras = section_map.section('abstract')
         
         if not abstract_paras:
             print("  [Abstract] Section not found")
@@ -102,19 +298,19 @@ class SmartProcessor:
         
         # Apply formatting
         for para in abstract_paras:
-            self._apply_paragraph_format(para, rules)
+            self._apply_paragraph_format(para, rules, 'abstract')
         
         # Check word count
-        if 'max_words' in rules:
+        if rules.max_words is not None:
             total_words = sum(len(p.text.split()) for p in abstract_paras)
-            if total_words > rules['max_words']:
+            if total_words > rules.max_words:
                 self.warnings.append(
-                    f"Abstract too long: {total_words} words (max: {rules['max_words']})"
+                    f"Abstract too long: {total_words} words (max: {rules.max_words})"
                 )
     
-    def apply_chapter_rules(self, doc, rules):
+    def apply_chapter_rules(self, section_map, rules):
         """Apply formatting to chapter headings (BAB)"""
-        chapter_paras = self._find_chapters(doc)
+        chapter_paras = section_map.chapter_headings()
         
         if not chapter_paras:
             print("  [Chapters] No chapters found")
@@ -123,18 +319,18 @@ class SmartProcessor:
         print(f"  [Chapters] Found {len(chapter_paras)} chapters")
         
         for para in chapter_paras:
-            self._apply_paragraph_format(para, rules)
+            self._apply_paragraph_format(para, rules, 'chapter_headings')
             
             # Apply text transform
-            if rules.get('text_transform') == 'uppercase':
-                for run in para.runs:
-                    run.text = run.text.upper()
+            if rules.uppercase:
+                for run in self._blocks.runs(para):
+                    text = run.text
+                    if self._needs_change('chapter_headings', 'text_transform', text, text.upper()):
+                        run.text = text.upper()
     
-    def apply_bibliography_rules(self, doc, rules):
+    def apply_bibliography_rules(self, section_map, rules):
         """Apply formatting to bibliography section"""
-        biblio_paras = self._find_section(doc, [
-            'daftar pustaka', 'bibliography', 'references', 'referensi'
-        ])
+        biblio_paras = section_map.section('bibliography')
         
         if not biblio_paras:
             print("  [Bibliography] Section not found")
@@ -142,20 +338,13 @@ class SmartProcessor:
         
         print(f"  [Bibliography] Found {len(biblio_paras)} entries")
         
+        # Hanging indent is part of the compiled paragraph setters
         for para in biblio_paras:
-            self._apply_paragraph_format(para, rules)
-            
-            # Apply hanging indent
-            if 'indent_hanging' in rules:
-                indent_size = self._parse_size(rules['indent_hanging'])
-                para.paragraph_format.left_indent = indent_size
-                para.paragraph_format.first_line_indent = -indent_size
+            self._apply_paragraph_format(para, rules, 'bibliography')
     
-    def apply_toc_rules(self, doc, rules):
+    def apply_toc_rules(self, section_map, rules):
         """Apply formatting to table of contents"""
-        toc_paras = self._find_section(doc, [
-            'daftar isi', 'table of contents', 'contents'
-        ])
+        toc_paras = section_map.section('table_of_contents')
         
         if not toc_paras:
             print("  [TOC] Section not found")
@@ -164,132 +353,57 @@ class SmartProcessor:
         print(f"  [TOC] Found {len(toc_paras)} entries")
         
         for para in toc_paras:
-            self._apply_paragraph_format(para, rules)
+            self._apply_paragraph_format(para, rules, 'table_of_contents')
     
-    def _find_section(self, doc, keywords):
-        """Find paragraphs in a section by keywords"""
-        found = False
-        section_paras = []
+    def _apply_paragraph_format(self, para, plan, section='global'):
+        """
+        Apply a compiled rule set (SectionPlan) to a paragraph.
+        Only values whose effective formatting differs from the rule are written.
+        """
+        fmt = self._fmt
+        run_props, paragraph_props = self._active_props(plan, self._overridden(para, section))
         
-        for para in doc.paragraphs:
-            text_lower = para.text.lower().strip()
-            
-            # Check if this is the section start
-            if not found:
-                for keyword in keywords:
-                    if keyword in text_lower:
-                        found = True
-                        break
-            
-            # If found, collect paragraphs until next major section
-            elif found:
-                # Stop at next BAB or major section
-                if re.match(r'^(bab|chapter)\s+[ivx\d]+', text_lower):
-                    break
-                if para.text.strip():
-                    section_paras.append(para)
-        
-        return section_paras
-    
-    def _find_chapters(self, doc):
-        """Find all chapter headings (BAB)"""
-        chapters = []
-        
-        for para in doc.paragraphs:
-            text = para.text.strip()
-            # Match "BAB I", "BAB II", "CHAPTER 1", etc.
-            if re.match(r'^(BAB|CHAPTER)\s+[IVX\d]+', text, re.IGNORECASE):
-                chapters.append(para)
-        
-        return chapters
-    
-    def _apply_paragraph_format(self, para, rules):
-        """Apply formatting rules to a paragraph"""
         # Apply to all runs in paragraph
-        for run in para.runs:
-            # Font name
-            if 'font' in rules and 'name' in rules['font']:
-                run.font.name = rules['font']['name']
-            
-            # Font size
-            if 'font_size' in rules:
-                run.font.size = self._parse_font_size(rules['font_size'])
-            elif 'font' in rules and 'size' in rules['font']:
-                run.font.size = self._parse_font_size(rules['font']['size'])
-            
-            # Font weight
-            if rules.get('font_weight') == 'bold':
-                run.font.bold = True
-            
-            # Font style
-            if rules.get('title_style') == 'italic':
-                run.font.italic = True
-        
-        # Line spacing
-        if 'line_spacing' in rules:
-            spacing_value = float(rules['line_spacing'])
-            para.paragraph_format.line_spacing = spacing_value
-        
-        # Spacing before/after
-        if 'spacing_before' in rules:
-            para.paragraph_format.space_before = self._parse_size(rules['spacing_before'])
-        if 'spacing_after' in rules:
-            para.paragraph_format.space_after = self._parse_size(rules['spacing_after'])
-    
-    def _parse_size(self, size_str):
-        """Parse size string to docx units"""
-        if isinstance(size_str, (int, float)):
-            return Cm(size_str)
-        
-        size_str = str(size_str).lower().strip()
-        
-        if 'cm' in size_str:
-            value = float(size_str.replace('cm', '').strip())
-            return Cm(value)
-        elif 'in' in size_str:
-            value = float(size_str.replace('in', '').strip())
-            return Inches(value)
-        elif 'pt' in size_str:
-            value = float(size_str.replace('pt', '').strip())
-            return Pt(value)
-        else:
-            # Default to cm
-            return Cm(float(size_str))
-    
-    def _parse_font_size(self, size_str):
-        """Parse font size to points"""
-        if isinstance(size_str, (int, float)):
-            return Pt(size_str)
-        
-        size_str = str(size_str).lower().strip()
-        value = float(size_str.replace('pt', '').strip())
-        return Pt(value)
-    
-    def _has_section_marker(self, para):
-        """Check if paragraph is part of a special section"""
-        text = para.text.lower().strip()
-        markers = [
-            'abstract', 'abstrak', 'bab', 'chapter',
-            'daftar pustaka', 'bibliography', 'daftar isi'
-        ]
-        return any(marker in text for marker in markers)
+        if run_props:
+            for run in self._blocks.runs(para):
+                for rule, attr, value, setter in run_props:
+                    if self._needs_change(section, rule, fmt.run_font(run, para, attr), value):
+                        setter(run, value)
+        
+        # Line spacing, spacing before/after, alignment, indents
+        for rule, attr, value in paragraph_props:
+            if self._needs_change(section, rule, fmt.paragraph_format(para, attr), value):
+                setattr(para.paragraph_format, attr, value)
+
+
+def process_file(input_path, output_path, rules, check_only=False, use_styles=False):
+    """Sandbox entry point: one document against an already compiled rule set"""
+    try:
+        processor = SmartProcessor(rules, check_only=check_only, use_styles=use_styles)
+        return processor.process_document(input_path, output_path)
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
 
 
 def main():
-    if len(sys.argv) < 4:
-        print("Usage: python smart_processor.py <input.docx> <rules.json> <output.docx>")
+    flags = {'--check', '--styles'}
+    args = [arg for arg in sys.argv[1:] if arg not in flags]
+    check_only = '--check' in sys.argv[1:]
+    use_styles = '--styles' in sys.argv[1:]
+    if len(args) < 3:
+        print("Usage: python smart_processor.py <input.docx> <rules.json> <output.docx> [--check] [--styles]")
         sys.exit(1)
     
-    input_file = sys.argv[1]
-    rules_file = sys.argv[2]
-    output_file = sys.argv[3]
+    input_file = args[0]
+    rules_file = args[1]
+    output_file = args[2]
     
     # Load rules
     with open(rules_file, 'r') as f:
         rules = json.load(f)
     
     # Process
-    processor = SmartProcessor(rules)
+    processor = SmartProcessor(rules, check_only=check_only, use_styles=use_styles)
     result = processor.process_document(input_file, output_file)
     
     # Print result
@@ -1,67 +1,140 @@
-from docx import Document
-from docx.shared import Cm, Pt
+from docx.shared import Cm, Pt, Length
 import sys
 import os
+import shutil
+from utils import telemetry
+from utils.body_walker import DocumentBlocks
+from utils.docx_io import open_docx
+from utils.effective_format import EffectiveFormat, same_value
+from utils.style_writer import set_run_font_name
+from utils.template_cache import get_compiled_rules
 
-def apply_style(target_path, reference_path, output_path):
+def _length(emu):
+    return Length(emu) if emu is not None else None
+
+def resolve_reference(reference):
+    """
+    Reference bisa berupa path file atau nama kategori (mis. 'skripsi').
+    Nama kategori dipetakan ke master file di folder templates.
+    """
+    if not os.path.exists(reference):
+        # Check in templates folder
+        possible_path = f"/app/templates/{reference}/master.docx" # Docker path
+        if os.path.exists(possible_path):
+            return possible_path
+        # Fallback check for local dev environment
+        possible_path_local = f"templates/{reference}/master.docx"
+        if os.path.exists(possible_path_local):
+            return possible_path_local
+    return reference
+
+def template_style(compiled):
+    """Margin, ukuran kertas & font dominan dari template yang sudah di-compile"""
+    page = compiled['page']
+    margin_rules = {
+        'top': _length(page['top']),
+        'bottom': _length(page['bottom']),
+        'left': _length(page['left']),
+        'right': _length(page['right']),
+        'page_width': _length(page['width']),
+        'page_height': _length(page['height'])
+    }
+    
+    # Dominant Font (first run font in the master, default fallback)
+    font_rules = {'name': 'Times New Roman', 'size': Pt(12)} # Default fallback
+    if compiled['font']['name']:
+        font_rules['name'] = compiled['font']['name']
+        if compiled['font']['size'] is not None:
+            font_rules['size'] = _length(compiled['font']['size'])
+    return margin_rules, font_rules
+
+def style_document(target_doc, compiled, check_only=False):
+    """
+    Terapkan gaya template ke dokumen yang sudah terbuka (in-place).
+    Font berlaku untuk semua teks: body, tabel, text box, header, footer,
+    footnote & endnote.
+    Return: jumlah perubahan {'margins', 'page_size', 'font_name'}.
+    """
+    margin_rules, font_rules = template_style(compiled)
+    changes = {'margins': 0, 'page_size': 0, 'font_name': 0}
+    
+    # APPLY MARGINS & PAGE SIZE
+    page_attrs = [
+        ('top_margin', 'top', 'margins'),
+        ('bottom_margin', 'bottom', 'margins'),
+        ('left_margin', 'left', 'margins'),
+        ('right_margin', 'right', 'margins'),
+        ('page_width', 'page_width', 'page_size'),
+        ('page_height', 'page_height', 'page_size')
+    ]
+    for section in target_doc.sections:
+        for attr, rule, report_key in page_attrs:
+            if margin_rules[rule] is None:
+                continue  # Template tidak punya nilai ini (tanpa pgMar/pgSz): biarkan
+            if not same_value(getattr(section, attr), margin_rules[rule]):
+                changes[report_key] += 1
+                if not check_only:
+                    setattr(section, attr, margin_rules[rule])
+        
+    # APPLY FONTS (bandingkan font efektif, termasuk warisan style)
+    with telemetry.span('style.fonts'):
+        fmt = EffectiveFormat(target_doc)
+        blocks = DocumentBlocks(target_doc)
+        for paragraph in blocks.paragraphs:
+            for run in blocks.runs(paragraph):
+                if fmt.run_font(run, paragraph, 'name') != font_rules['name']:
+                    changes['font_name'] += 1
+                    if not check_only:
+                        set_run_font_name(run, font_rules['name'])
+            # Optional: Apply size only if not heading? 
+            # For MVP, let's enforce size too to ensure uniformity.
+            # run.font.size = font_rules['size'] 
+    return changes
+
+def apply_style(target_path, reference_path, output_path, check_only=False):
     """
     Two-Input System:
     1. Reference: Master File (Pemberi Gaya)
     2. Target: Customer File (Penerima Gaya)
+    
+    Hanya nilai yang berbeda dari master yang ditulis ulang.
+    check_only=True: cuma laporan perubahan, file tidak ditulis.
+    Return: laporan {'changes': {...}, 'compliant': bool} atau False kalau gagal.
     """
     print(f"Applying style from [{reference_path}] to [{target_path}]...")
     
     try:
-        # Load Reference
-        ref_doc = Document(reference_path)
-        
-        # Extract Style Rules from Reference (Simple Scanner Logic)
-        ref_section = ref_doc.sections[0]
-        margin_rules = {
-            'top': ref_section.top_margin,
-            'bottom': ref_section.bottom_margin,
-            'left': ref_section.left_margin,
-            'right': ref_section.right_margin,
-            'page_width': ref_section.page_width,
-            'page_height': ref_section.page_height
-        }
-        
-        # Detect Dominant Font (Mock logic: take first paragraph font or default)
-        # In real production, this needs robust scanning.
-        font_rules = {'name': 'Times New Roman', 'size': Pt(12)} # Default fallback
-        for p in ref_doc.paragraphs[:5]:
-            if p.runs and p.runs[0].font.name:
-                font_rules['name'] = p.runs[0].font.name
-                if p.runs[0].font.size:
-                    font_rules['size'] = p.runs[0].font.size
-                break
+        # Load Reference (compiled once, cached per template version)
+        with telemetry.span('style.template'):
+            compiled = get_compiled_rules(reference_path)
+        margin_rules, font_rules = template_style(compiled)
 
         # Load Target
-        target_doc = Document(target_path)
+        with telemetry.span('style.load'):
+            target_package = open_docx(target_path)
+            target_doc = target_package.document
         
-        # APPLY MARGINS & PAGE SIZE
-        for section in target_doc.sections:
-            section.top_margin = margin_rules['top']
-            section.bottom_margin = margin_rules['bottom']
-            section.left_margin = margin_rules['left']
-            section.right_margin = margin_rules['right']
-            section.page_width = margin_rules['page_width']
-            section.page_height = margin_rules['page_height']
-            
-        # APPLY FONTS
-        for paragraph in target_doc.paragraphs:
-            for run in paragraph.runs:
-                run.font.name = font_rules['name']
-                # Optional: Apply size only if not heading? 
-                # For MVP, let's enforce size too to ensure uniformity.
-                # run.font.size = font_rules['size'] 
+        changes = style_document(target_doc, compiled, check_only)
+
+        compliant = not any(changes.values())
+        report = {'changes': changes, 'compliant': compliant, 'check_only': check_only}
+        if check_only:
+            print(f">> Check only: {'compliant' if compliant else 'changes needed'} {changes}")
+            return report
 
-        # Save Result
-        target_doc.save(output_path)
+        # Save Result (dokumen yang sudah sesuai cukup disalin apa adanya)
+        if compliant:
+            if output_path != target_path:
+                shutil.copyfile(target_path, output_path)
+        else:
+            with telemetry.span('style.save'):
+                target_package.save(output_path)
         print(f">> Success! Saved to: {output_path}")
-        print(f">> Applied Margins: T={margin_rules['top'].cm:.2f}, B={margin_rules['bottom'].cm:.2f}, L={margin_rules['left'].cm:.2f}, R={margin_rules['right'].cm:.2f}")
-        print(f">> Applied Font: {font_rules['name']}")
-        return True
+        margins = ', '.join(f"{side[0].upper()}={margin_rules[side].cm:.2f}"
+                            for side in ('top', 'bottom', 'left', 'right') if margin_rules[side] is not None)
+        print(f">> Applied Margins: {margins or 'none in template'}")
+        print(f">> Applied Font: {font_rules['name']} ({changes['font_name']} runs changed)")
+        return report
 
     except Exception as e:
         print(f"Error applying style: {e}")
@@ -76,18 +149,6 @@ if __name__ == "__main__":
     reference = sys.argv[2] # Can be a path or a category name
     output = sys.argv[3]
     
-    # If reference is just a category name (e.g. 'skripsi'), map it to the master file in templates
-    # For this POC, we assume absolute path is passed or we resolve it here.
-    # Simple resolution logic:
-    if not os.path.exists(reference):
-        # Check in templates folder
-        possible_path = f"/app/templates/{reference}/master.docx" # Docker path
-        if os.path.exists(possible_path):
-            reference = possible_path
-        else:
-             # Fallback check for local dev environment
-            possible_path_local = f"templates/{reference}/master.docx"
-            if os.path.exists(possible_path_local):
-                reference = possible_path_local
+    reference = resolve_reference(reference)
     
     apply_style(target, reference, output)
@@ -1,6 +1,6 @@
-from docx import Document
 import json
 import sys
+from utils.template_cache import get_compiled_rules, to_scanner_rules
 
 def scan_template(file_path):
     """
@@ -10,39 +10,8 @@ def scan_template(file_path):
     3. Paragraph Spacing (Line Spacing)
     """
     try:
-        doc = Document(file_path)
-        rules = {}
-        
-        # 1. Ambil Margin dari Section Pertama
-        # asumsi: format skripsi konsisten dari awal
-        section = doc.sections[0]
-        rules['margin'] = {
-            'top_cm': round(section.top_margin.cm, 2),
-            'bottom_cm': round(section.bottom_margin.cm, 2),
-            'left_cm': round(section.left_margin.cm, 2),
-            'right_cm': round(section.right_margin.cm, 2)
-        }
-        
-        # 2. Deteksi Font Dominan
-        # Kita scan 5 paragraf awal untuk cari font yang paling banyak muncul
-        fonts_found = {}
-        for i, paragraph in enumerate(doc.paragraphs[:10]):
-            for run in paragraph.runs:
-                font_name = run.font.name
-                if font_name:
-                    fonts_found[font_name] = fonts_found.get(font_name, 0) + 1
-        
-        # Ambil yang terbanyak, default Times New Roman kalau tidak ketemu
-        if fonts_found:
-            dominant_font = max(fonts_found, key=fonts_found.get)
-        else:
-            dominant_font = 'Times New Roman (Default)'
-            
-        rules['font'] = {
-            'name': dominant_font
-        }
-        
-        return rules
+        # Parse master hanya sekali per versi file, selanjutnya dari cache
+        return to_scanner_rules(get_compiled_rules(file_path))
 
     except Exception as e:
         return {"error": str(e)}
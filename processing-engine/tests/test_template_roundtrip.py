@@ -0,0 +1,23 @@
+"""
+Template hasil scan harus lolos cek terhadap rules-nya sendiri.
+
+    cd processing-engine
+    python -m pytest -q tests
+"""
+from benchmarks.corpus import make_template
+from smart_processor import SmartProcessor
+from utils.template_cache import compile_template, to_processor_rules
+
+
+def test_scanned_template_is_compliant_with_its_own_rules(tmp_path):
+    template = str(tmp_path / 'template.docx')
+    make_template(template)
+    rules = to_processor_rules(compile_template(template))
+    # Template corpus punya indent pertama (global) dan hanging indent (daftar pustaka)
+    assert 'indent_first_line' in rules['global']
+    assert 'indent_hanging' in rules['sections']['bibliography']
+
+    result = SmartProcessor(rules, check_only=True).process_document(template, None)
+
+    assert result['compliant'], result['changes']
+    assert result['changes'] == {}
@@ -0,0 +1,163 @@
+import posixpath
+from collections import namedtuple
+from lxml import etree
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.text.paragraph import Paragraph
+from docx.text.run import Run
+
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+MC_NS = 'http://schemas.openxmlformats.org/markup-compatibility/2006'
+_W = f'{{{W_NS}}}'
+_P, _R, _T, _TC, _TXBX = f'{_W}p', f'{_W}r', f'{_W}t', f'{_W}tc', f'{_W}txbxContent'
+_FALLBACK = f'{{{MC_NS}}}Fallback'
+
+# Part selain body yang berisi teks dokumen -> nama lokasinya
+STORY_RELATIONSHIPS = {
+    RT.HEADER: 'header',
+    RT.FOOTER: 'footer',
+    RT.FOOTNOTES: 'footnote',
+    RT.ENDNOTES: 'endnote',
+}
+
+# Satu paragraf: lokasi part ('body', 'header', ...), wadahnya di part itu
+# ('table', 'textbox', None = langsung di part), elemen w:p & run miliknya
+# sendiri (run paragraf text box di dalamnya tidak ikut)
+Block = namedtuple('Block', ['story', 'container', 'p', 'runs'])
+
+
+def _owner(run):
+    """w:p terdekat di atas sebuah w:r (run di hyperlink / field / sdt ikut paragrafnya)"""
+    node = run.getparent()
+    while node is not None and node.tag != _P:
+        node = node.getparent()
+    return node
+
+
+def _container(p, root):
+    for ancestor in p.iterancestors():
+        if ancestor is root:
+            break
+        if ancestor.tag == _TXBX:
+            return 'textbox'
+        if ancestor.tag == _TC:
+            return 'table'
+    return None
+
+
+def walk_part(root, story):
+    """
+    Semua paragraf satu part (urut dokumen) dalam satu kali jalan atas tree:
+    w:p & w:r sekaligus, termasuk tabel, text box & content control.
+    mc:Fallback = salinan VML lama dari text box yang sama, dilewati supaya
+    tidak diproses dua kali.
+    """
+    skipped = set()
+    for fallback in root.iter(_FALLBACK):
+        skipped.update(fallback.iter(_P, _R))
+    blocks = []
+    owners = {}
+    for node in root.iter(_P, _R):
+        if node in skipped:
+            continue
+        if node.tag == _P:
+            block = Block(story, _container(node, root), node, [])
+            owners[node] = block
+            blocks.append(block)
+        else:
+            block = owners.get(_owner(node))
+            if block is not None:
+                block.runs.append(node)
+    return blocks
+
+
+def story_parts(document_part):
+    """[(lokasi, part)] header/footer/footnote/endnote yang di-parse, urut nama part"""
+    parts = {}
+    for rel in document_part.rels.values():
+        story = STORY_RELATIONSHIPS.get(rel.reltype)
+        if story is None or rel.is_external:
+            continue
+        part = rel.target_part
+        # Part yang tidak di-parse (placeholder docx_io / tipe tak dikenal) tidak punya element
+        if getattr(part, 'element', None) is not None:
+            parts[str(part.partname)] = (story, part)
+    return [parts[name] for name in sorted(parts)]
+
+
+class _Story:
+    """Parent minimal untuk proxy Paragraph di part selain body (cukup .part)"""
+
+    def __init__(self, part):
+        self.part = part
+
+
+class DocumentBlocks:
+    """
+    Semua paragraf dokumen: body (termasuk tabel & text box), lalu header,
+    footer, footnote & endnote, dengan proxy python-docx yang dibuat sekali
+    per paragraf/run. Proxy dibuat langsung dari elemen (tanpa table.rows[].cells[] yang
+    membangun ulang grid tabel di setiap akses).
+    """
+
+    def __init__(self, doc):
+        self.blocks = []
+        self.paragraphs = []
+        self._runs = {}
+        self._add(walk_part(doc.element.body, 'body'), doc._body)
+        for story, part in story_parts(doc.part):
+            self._add(walk_part(part.element, story), _Story(part))
+
+    def _add(self, blocks, parent):
+        for block in blocks:
+            para = Paragraph(block.p, parent)
+            self.blocks.append(block)
+            self.paragraphs.append(para)
+            self._runs[block.p] = [Run(r, para) for r in block.runs]
+
+    def items(self):
+        """(Block, Paragraph) urut dokumen"""
+        return zip(self.blocks, self.paragraphs)
+
+    def runs(self, para):
+        """Run milik paragraf (termasuk run di hyperlink / field), fallback para.runs"""
+        runs = self._runs.get(para._p)
+        return runs if runs is not None else para.runs
+
+
+def paragraph_runs(p):
+    """
+    Run milik satu w:p untuk pembaca streaming (iterparse) yang tidak
+    punya Block: run paragraf text box di dalamnya & mc:Fallback tidak ikut.
+    """
+    return [r for r in p.iter(_R) if _owner(r) is p]
+
+
+def in_fallback(element):
+    """Elemen ada di dalam mc:Fallback (salinan konten yang sama)"""
+    return any(ancestor.tag == _FALLBACK for ancestor in element.iterancestors())
+
+
+def runs_text(runs):
+    """Teks dari w:t langsung di bawah run (teks text box di dalam run tidak ikut)"""
+    return ''.join(t.text or '' for r in runs for t in r.iterchildren(_T))
+
+
+def package_story_names(package):
+    """
+    [(lokasi, nama member zip)] untuk pembaca streaming (tanpa python-docx):
+    body dulu, lalu part cerita lain dari word/_rels/document.xml.rels.
+    """
+    names = [('body', 'word/document.xml')]
+    try:
+        rels = etree.fromstring(package.read('word/_rels/document.xml.rels'))
+    except KeyError:
+        return names
+    stories = []
+    for rel in rels:
+        story = STORY_RELATIONSHIPS.get(rel.get('Type'))
+        if story is None or rel.get('TargetMode') == 'External':
+            continue
+        target = rel.get('Target', '')
+        name = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('word', target))
+        stories.append((name, story))
+    return names + [(story, name) for name, story in sorted(stories)]
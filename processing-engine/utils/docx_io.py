@@ -0,0 +1,195 @@
+import io
+import os
+import struct
+import tempfile
+import zipfile
+from lxml import etree
+from docx import Document
+from docx.opc.constants import CONTENT_TYPE as CT
+from docx.opc.packuri import PackURI
+from docx.opc.part import PartFactory, XmlPart
+from docx.opc.pkgreader import _ContentTypeMap
+from docx.oxml.simpletypes import ST_SignedTwipsMeasure, ST_TwipsMeasure
+
+_W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+COPY_CHUNK = 1024 * 1024
+
+# python-docx tidak punya kelas part untuk footnote/endnote: parse sebagai
+# XmlPart supaya teksnya ikut diproses (body_walker) & ditulis ulang saat save
+for _content_type in (CT.WML_FOOTNOTES, CT.WML_ENDNOTES):
+    PartFactory.part_type_for.setdefault(_content_type, XmlPart)
+
+
+def _is_lazy(content_type):
+    """Part yang tidak di-parse python-docx (gambar, font, embedding, chart, ...)"""
+    if content_type == CT.OFC_THEME:
+        return False  # Kecil, dibutuhkan untuk resolve font tema
+    part_type = PartFactory.part_type_for.get(content_type, PartFactory.default_part_type)
+    return not issubclass(part_type, XmlPart)
+
+
+def _copy_raw(source, info, target):
+    """
+    Salin satu member zip apa adanya (data terkompresi, tanpa decompress /
+    recompress), dengan pola yang sama seperti ZipFile.mkdir().
+    """
+    source.fp.seek(info.header_offset)
+    header = source.fp.read(30)
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    source.fp.seek(info.header_offset + 30 + name_length + extra_length)
+
+    zinfo = zipfile.ZipInfo(info.filename, info.date_time)
+    zinfo.compress_type = info.compress_type
+    zinfo.CRC = info.CRC
+    zinfo.compress_size = info.compress_size
+    zinfo.file_size = info.file_size
+    zinfo.external_attr = info.external_attr
+    zinfo.flag_bits = info.flag_bits & ~0x08  # ukuran sudah diketahui: tanpa data descriptor
+
+    zip64 = info.file_size > zipfile.ZIP64_LIMIT or info.compress_size > zipfile.ZIP64_LIMIT
+    target.fp.seek(target.start_dir)
+    zinfo.header_offset = target.fp.tell()
+    target._writecheck(zinfo)
+    target._didModify = True
+    target.fp.write(zinfo.FileHeader(zip64))
+
+    remaining = info.compress_size
+    while remaining > 0:
+        chunk = source.fp.read(min(COPY_CHUNK, remaining))
+        if not chunk:
+            raise zipfile.BadZipFile(f"Truncated member: {info.filename}")
+        target.fp.write(chunk)
+        remaining -= len(chunk)
+
+    target.filelist.append(zinfo)
+    target.NameToInfo[zinfo.filename] = zinfo
+    target.start_dir = target.fp.tell()
+
+
+class DocxPackage:
+    """
+    Buka .docx tanpa memuat part biner ke memori.
+
+    python-docx hanya menerima part XML-nya (document, styles, header, ...);
+    gambar, font, embedding & part lain yang tidak di-parse diganti
+    placeholder kosong. Saat save, part yang tidak berubah disalin
+    byte-per-byte dari zip input (tanpa recompress), jadi memori puncak
+    mengikuti ukuran XML teks, bukan ukuran paket.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.placeholders = set()
+        with zipfile.ZipFile(path) as source:
+            content_types = _ContentTypeMap.from_xml(source.read('[Content_Types].xml'))
+            stripped = io.BytesIO()
+            with zipfile.ZipFile(stripped, 'w', zipfile.ZIP_STORED) as package:
+                for info in source.infolist():
+                    name = info.filename
+                    if not name.endswith('.rels') and name != '[Content_Types].xml':
+                        try:
+                            lazy = _is_lazy(content_types[PackURI('/' + name)])
+                        except KeyError:
+                            lazy = True
+                        if lazy:
+                            self.placeholders.add(name)
+                            package.writestr(name, b'')
+                            continue
+                    package.writestr(name, source.read(name))
+        stripped.seek(0)
+        self.document = Document(stripped)
+
+    def _render(self):
+        rendered = io.BytesIO()
+        self.document.save(rendered)
+        rendered.seek(0)
+        return rendered
+
+    def save(self, output_path):
+        """Tulis dokumen; part yang sama dengan input disalin mentah dari zip input"""
+        rendered = self._render()
+
+        # Tulis ke file sementara lalu rename: aman juga kalau output == input
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(output_path)), suffix='.tmp')
+        os.close(fd)
+        try:
+            self._write(rendered, tmp_path)
+            os.replace(tmp_path, output_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def to_bytes(self):
+        """Seperti save(), tapi hasilnya bytes di memori (untuk tahap berikutnya di pipeline)"""
+        buffer = io.BytesIO()
+        self._write(self._render(), buffer)
+        return buffer.getvalue()
+
+    def _write(self, rendered, output_path):
+        with zipfile.ZipFile(self.path) as source, \
+                zipfile.ZipFile(rendered) as new, \
+                zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as target:
+            originals = {info.filename: info for info in source.infolist()}
+            for info in new.infolist():
+                name = info.filename
+                original = originals.get(name)
+                if original is not None:
+                    if name in self.placeholders:
+                        _copy_raw(source, original, target)
+                        continue
+                    data = new.read(name)
+                    if data == source.read(name):
+                        _copy_raw(source, original, target)
+                        continue
+                else:
+                    data = new.read(name)
+                target.writestr(name, data)
+
+
+def open_docx(path):
+    return DocxPackage(path)
+
+
+def _section_layout(sect_pr):
+    """Margin + ukuran kertas (Length) dari satu w:sectPr, seperti docx Section"""
+    def measure(tag, attr, simple_type):
+        element = sect_pr.find(f'{_W}{tag}')
+        value = element.get(f'{_W}{attr}') if element is not None else None
+        return simple_type.convert_from_xml(value) if value is not None else None
+
+    return {
+        'top': measure('pgMar', 'top', ST_SignedTwipsMeasure),
+        'bottom': measure('pgMar', 'bottom', ST_SignedTwipsMeasure),
+        'left': measure('pgMar', 'left', ST_TwipsMeasure),
+        'right': measure('pgMar', 'right', ST_TwipsMeasure),
+        'width': measure('pgSz', 'w', ST_TwipsMeasure),
+        'height': measure('pgSz', 'h', ST_TwipsMeasure)
+    }
+
+
+def read_layout(path):
+    """
+    Margin + ukuran kertas section pertama langsung dari word/document.xml
+    (iterparse, berhenti di w:sectPr pertama). Untuk template scanner:
+    tidak perlu memuat seluruh dokumen. Nilai yang tidak ada = None.
+    """
+    with zipfile.ZipFile(path) as package:
+        with package.open('word/document.xml') as xml:
+            depth = 0
+            for event, element in etree.iterparse(xml, events=('start', 'end')):
+                if event == 'start':
+                    depth += 1
+                    continue
+                depth -= 1
+                # depth 2 = anak langsung w:body (w:document > w:body > ...)
+                if depth != 2:
+                    continue
+                if element.tag == f'{_W}p':
+                    sect_pr = element.find(f'{_W}pPr/{_W}sectPr')
+                    if sect_pr is not None:
+                        return _section_layout(sect_pr)
+                elif element.tag == f'{_W}sectPr':
+                    return _section_layout(element)
+                element.clear()
+    return dict.fromkeys(('top', 'bottom', 'left', 'right', 'width', 'height'))
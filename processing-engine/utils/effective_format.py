@@ -0,0 +1,167 @@
+from lxml import etree
+from docx.enum.style import WD_STYLE_TYPE
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.oxml.ns import qn
+from docx.shared import Length, Pt, Twips
+
+# Nilai default Word kalau tidak ada di style maupun docDefaults
+_BUILTIN_DEFAULTS = {'bold': False, 'italic': False}
+
+_DRAWING_NS = 'http://schemas.openxmlformats.org/drawingml/2006/main'
+
+
+def read_theme_fonts(theme_xml):
+    """Font latin tema {'minor': ..., 'major': ...} dari theme1.xml"""
+    fonts = {}
+    theme = etree.fromstring(theme_xml)
+    for kind in ('minor', 'major'):
+        latin = theme.find(f".//{{{_DRAWING_NS}}}{kind}Font/{{{_DRAWING_NS}}}latin")
+        if latin is not None and latin.get('typeface'):
+            fonts[kind] = latin.get('typeface')
+    return fonts
+
+
+def rpr_font_name(r_pr, theme_fonts):
+    """
+    Nama font dari satu w:rPr. Atribut tema (asciiTheme) menang atas
+    w:ascii di elemen yang sama; None kalau level ini tidak menentukan font.
+    """
+    r_fonts = r_pr.find(qn('w:rFonts')) if r_pr is not None else None
+    if r_fonts is None:
+        return None
+    theme = r_fonts.get(qn('w:asciiTheme'))
+    if theme:
+        return theme_fonts.get('major' if theme.startswith('major') else 'minor')
+    return r_fonts.get(qn('w:ascii'))
+
+
+def same_value(current, target):
+    """Bandingkan nilai format saat ini dengan target (toleran float/twips)"""
+    if current is None or target is None:
+        return current is target
+    if isinstance(current, float) or isinstance(target, float):
+        return abs(float(current) - float(target)) < 1e-6
+    if isinstance(current, Length) and isinstance(target, Length):
+        # docx menyimpan kebanyakan ukuran dalam twips (635 EMU): toleransi setengah twip
+        return abs(current - target) <= 317
+    return current == target
+
+
+class EffectiveFormat:
+    """
+    Membaca format EFEKTIF run/paragraf: nilai langsung (direct), lalu
+    character style, paragraph style (mengikuti base_style), lalu docDefaults.
+    Lookup style di-memo per (style_id, atribut) karena ribuan paragraf
+    memakai segelintir style yang sama.
+
+    Memo hanya valid selama definisi style tidak diubah; panggil
+    invalidate() setelah mengubah style dokumen.
+    """
+
+    def __init__(self, doc):
+        self.doc = doc
+        styles = doc.styles
+        self._styles = {style.style_id: style for style in styles}
+        default_para = styles.default(WD_STYLE_TYPE.PARAGRAPH)
+        self._default_para_id = default_para.style_id if default_para is not None else None
+        self.theme_fonts = self._read_theme(doc)
+        self._doc_defaults = self._read_doc_defaults(styles.element)
+        self._memo = {}
+
+    def invalidate(self):
+        self._memo.clear()
+        self._doc_defaults = self._read_doc_defaults(self.doc.styles.element)
+
+    @staticmethod
+    def _read_theme(doc):
+        try:
+            theme_part = doc.part.part_related_by(RT.THEME)
+            return read_theme_fonts(theme_part.blob) if theme_part.blob else {}
+        except (KeyError, ValueError, etree.XMLSyntaxError):
+            return {}
+
+    def _read_doc_defaults(self, styles_element):
+        defaults = {}
+        doc_defaults = styles_element.find(qn('w:docDefaults'))
+        if doc_defaults is None:
+            return defaults
+        r_pr = doc_defaults.find(f"{qn('w:rPrDefault')}/{qn('w:rPr')}")
+        name = rpr_font_name(r_pr, self.theme_fonts)
+        if name:
+            defaults['name'] = name
+        size = r_pr.find(qn('w:sz')) if r_pr is not None else None
+        if size is not None and size.get(qn('w:val')):
+            defaults['size'] = Pt(int(size.get(qn('w:val'))) / 2)
+
+        # Spasi paragraf default (pPrDefault), satuan sama dengan ParagraphFormat
+        spacing = doc_defaults.find(f"{qn('w:pPrDefault')}/{qn('w:pPr')}/{qn('w:spacing')}")
+        if spacing is not None:
+            line = spacing.get(qn('w:line'))
+            if line is not None:
+                if spacing.get(qn('w:lineRule'), 'auto') == 'auto':
+                    defaults['line_spacing'] = int(line) / 240
+                else:
+                    defaults['line_spacing'] = Twips(int(line))
+            for side, attr in (('w:before', 'space_before'), ('w:after', 'space_after')):
+                if spacing.get(qn(side)) is not None:
+                    defaults[attr] = Twips(int(spacing.get(qn(side))))
+        return defaults
+
+    def style_value(self, style_id, group, attr):
+        """Nilai atribut dari rantai style (style -> base_style -> ...)"""
+        key = (style_id, group, attr)
+        if key in self._memo:
+            return self._memo[key]
+
+        value = None
+        style = self._styles.get(style_id)
+        seen = set()
+        while style is not None and style.style_id not in seen:
+            seen.add(style.style_id)
+            if group == 'font' and attr == 'name':
+                value = rpr_font_name(style.element.rPr, self.theme_fonts)
+            else:
+                source = style.font if group == 'font' else style.paragraph_format
+                value = getattr(source, attr)
+            if value is not None:
+                break
+            style = style.base_style
+
+        self._memo[key] = value
+        return value
+
+    def style(self, style_id):
+        return self._styles.get(style_id)
+
+    def paragraph_style_id(self, para):
+        return para._p.style or self._default_para_id
+
+    def run_font(self, run, para, attr):
+        """Atribut font efektif: 'name', 'size', 'bold', 'italic'"""
+        if attr == 'name':
+            value = rpr_font_name(run._r.rPr, self.theme_fonts)
+        else:
+            value = getattr(run.font, attr)
+        if value is not None:
+            return value
+
+        char_style = run._r.style
+        if char_style:
+            value = self.style_value(char_style, 'font', attr)
+            if value is not None:
+                return value
+
+        value = self.style_value(self.paragraph_style_id(para), 'font', attr)
+        if value is not None:
+            return value
+        return self._doc_defaults.get(attr, _BUILTIN_DEFAULTS.get(attr))
+
+    def paragraph_format(self, para, attr):
+        """Atribut paragraph_format efektif (line_spacing, space_before, ...)"""
+        value = getattr(para.paragraph_format, attr)
+        if value is not None:
+            return value
+        value = self.style_value(self.paragraph_style_id(para), 'paragraph', attr)
+        if value is not None:
+            return value
+        return self._doc_defaults.get(attr)
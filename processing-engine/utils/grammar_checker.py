@@ -1,62 +1,252 @@
-from Sastrawi.Stemmer.StemmerFactory import StemmerFactory
+from collections import deque
+from functools import lru_cache
+import os
 import re
+import time
+import zipfile
+from lxml import etree
+
+from utils.body_walker import in_fallback, package_story_names, paragraph_runs, runs_text
+
+# Batas detail yang dikirim balik (hasil job lewat Redis); issues_count tetap total
+GRAMMAR_MAX_DETAILS = int(os.getenv('GRAMMAR_MAX_DETAILS', '500'))
+STEM_CACHE_SIZE = int(os.getenv('GRAMMAR_STEM_CACHE_SIZE', '20000'))
+
+# Database Kata Tidak Baku (Bisa diperluas)
+NON_FORMAL = {
+    'gak': 'tidak',
+    'ngga': 'tidak',
+    'nggak': 'tidak',
+    'gimana': 'bagaimana',
+    'kalo': 'kalau',
+    'krn': 'karena',
+    'dgn': 'dengan',
+    'yg': 'yang',
+    'sy': 'saya',
+    'aq': 'aku',
+    'makasih': 'terima kasih',
+    'bgt': 'banget'
+}
+
+# Pemborosan kata: frasa -> bentuk yang disarankan
+REDUNDANT = {
+    'sangat sekali': 'sangat',
+    'agar supaya': 'agar',
+    'demi untuk': 'untuk',
+    'adalah merupakan': 'adalah',
+    'seperti misalnya': 'seperti',
+    'sejak dari': 'sejak',
+    'naik ke atas': 'naik',
+    'turun ke bawah': 'turun',
+    'maju ke depan': 'maju',
+    'mundur ke belakang': 'mundur',
+}
+
+# Satu pass tokenisasi per paragraf (tanda baca otomatis terbuang)
+TOKEN_RE = re.compile(r'\w+')
+# Hanya token berbentuk [awalan] + akar kata tidak baku + [akhiran] yang perlu
+# di-stem ("kalonya" -> "kalo"); Sastrawi lambat untuk kata yang tidak dikenalnya.
+# Harus utuh satu token: "sy" di "masyarakat" / "ngga" di "menggunakan" tidak ikut.
+ROOT_RE = re.compile(r'(?:ber|me|di|ke|se)?(?:%s)(?:nya|kan|in|an|lah|kah|pun)?$' % '|'.join(
+    sorted(map(re.escape, NON_FORMAL), key=len, reverse=True)))
+
+_W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+_stemmer = None
+
+
+def get_stemmer():
+    """Sastrawi dimuat saat pertama dibutuhkan, lalu dipakai ulang (per proses)"""
+    global _stemmer
+    if _stemmer is None:
+        try:
+            from Sastrawi.Stemmer.StemmerFactory import StemmerFactory
+        except ImportError:
+            _stemmer = False
+        else:
+            _stemmer = StemmerFactory().create_stemmer()
+    return _stemmer or None
+
+
+@lru_cache(maxsize=STEM_CACHE_SIZE)
+def _stem(token):
+    stemmer = get_stemmer()
+    return stemmer.stem(token) if stemmer is not None else token
+
+
+class _PhraseMatcher:
+    """
+    Automaton Aho-Corasick di level token: semua frasa (1 kata atau lebih)
+    dicocokkan dalam satu kali jalan atas deretan token.
+    Dibangun sekali, tidak diubah lagi.
+    """
+
+    def __init__(self, phrases):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        for tokens, entry in phrases.items():
+            state = 0
+            for token in tokens:
+                nxt = self._goto[state].get(token)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                    self._goto[state][token] = nxt
+                state = nxt
+            self._out[state] += ((len(tokens), entry),)
+
+        # Failure link (BFS): state terpanjang yang juga akhiran state ini
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for token, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fallback = self._fail[state]
+                while fallback and token not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[nxt] = self._goto[fallback].get(token, 0)
+                self._out[nxt] += self._out[self._fail[nxt]]
+
+        self.vocabulary = frozenset(token for tokens in phrases for token in tokens)
+
+    def matches(self, tokens):
+        """Yield (index token awal, jumlah token, entry)"""
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for index, token in enumerate(tokens):
+            while state and token not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(token, 0)
+            for length, entry in out[state]:
+                yield index - length + 1, length, entry
+
+
+def iter_docx_paragraphs(file_path):
+    """
+    Stream (lokasi, teks) paragraf tanpa memuat dokumen ke python-docx:
+    body (termasuk tabel & text box), lalu header, footer, footnote, endnote.
+    Teks text box jadi paragrafnya sendiri, tidak digabung ke paragraf induk;
+    salinan mc:Fallback dilewati.
+    """
+    with zipfile.ZipFile(file_path) as package:
+        for location, name in package_story_names(package):
+            try:
+                xml = package.open(name)
+            except KeyError:
+                continue
+            with xml:
+                for _, p in etree.iterparse(xml, events=('end',), tag=f'{_W}p'):
+                    if not in_fallback(p):
+                        yield location, runs_text(paragraph_runs(p))
+                    p.clear()
+                    # Lepas paragraf yang sudah dibaca (memori tetap kecil)
+                    while p.getprevious() is not None:
+                        del p.getparent()[0]
+
 
 class IndoGrammarAgent:
     def __init__(self):
-        # Hemat RAM: Load Sastrawi cuma sekali saat start
-        self.factory = StemmerFactory()
-        self.stemmer = self.factory.create_stemmer()
-        
-        # Database Kata Tidak Baku (Bisa diperluas)
-        self.typo_dict = {
-            'gak': 'tidak',
-            'ngga': 'tidak',
-            'nggak': 'tidak',
-            'gimana': 'bagaimana',
-            'kalo': 'kalau',
-            'krn': 'karena',
-            'dgn': 'dengan',
-            'yg': 'yang',
-            'sy': 'saya',
-            'aq': 'aku',
-            'makasih': 'terima kasih',
-            'bgt': 'banget'
-        }
+        phrases = {(word,): ('non_formal', formal) for word, formal in NON_FORMAL.items()}
+        phrases.update({tuple(phrase.split()): ('redundant', fix) for phrase, fix in REDUNDANT.items()})
+        self.matcher = _PhraseMatcher(phrases)
 
-    def check(self, text):
-        suggestions = []
-        words = text.split()
-        
-        for index, word in enumerate(words):
-            clean_word = re.sub(r'[^\w\s]','',word).lower() # Hapus tanda baca
-            
-            # 1. Cek Kata Tidak Baku
-            if clean_word in self.typo_dict:
-                suggestions.append({
-                    'type': 'non_formal',
-                    'original': word,
-                    'suggestion': self.typo_dict[clean_word],
-                    'position': index
-                })
-            
-            # 2. Cek Redundansi (Contoh: "Sangat ... Sekali")
-            if index < len(words) - 1:
-                next_word_clean = re.sub(r'[^\w\s]','',words[index+1]).lower()
-                bigram = f"{clean_word} {next_word_clean}"
-                if bigram == "sangat sekali" or bigram == "agar supaya":
-                    suggestions.append({
-                        'type': 'redundant',
-                        'original': bigram,
-                        'suggestion': clean_word, # Pilih satu saja
-                        'message': 'Pemborosan kata'
-                    })
+    @lru_cache(maxsize=STEM_CACHE_SIZE)
+    def _normalize(self, token):
+        """Token (lowercase) -> bentuk yang dicari di automaton"""
+        if token in self.matcher.vocabulary or not ROOT_RE.match(token):
+            return token
+        stem = _stem(token)
+        return stem if stem in NON_FORMAL else token
+
+    def _check_paragraph(self, text, paragraph, sink, location=None):
+        spans = [(match.start(), match.end()) for match in TOKEN_RE.finditer(text)]
+        if not spans:
+            return 0
+        lowered = text.lower()
+        tokens = [self._normalize(lowered[start:end]) for start, end in spans]
+
+        for first, length, (kind, suggestion) in self.matcher.matches(tokens):
+            start, end = spans[first][0], spans[first + length - 1][1]
+            issue = {
+                'type': kind,
+                'original': text[start:end],
+                'suggestion': suggestion,
+                'paragraph': paragraph,
+                'offset': start,
+                'length': end - start,
+                'position': first
+            }
+            if location is not None:
+                issue['location'] = location
+            if kind == 'redundant':
+                issue['message'] = 'Pemborosan kata'
+            sink(issue)
+        return len(tokens)
+
+    def check_paragraphs(self, paragraphs, max_details=None):
+        """
+        Cek banyak paragraf sekaligus; posisi = (paragraf, offset karakter).
+        Item boleh teks atau (lokasi, teks) dari iter_docx_paragraphs.
+        """
+        details = []
+        counts = {'non_formal': 0, 'redundant': 0}
+
+        def sink(issue):
+            counts[issue['type']] += 1
+            if max_details is None or len(details) < max_details:
+                details.append(issue)
+
+        words = 0
+        for index, item in enumerate(paragraphs):
+            location, text = item if isinstance(item, tuple) else (None, item)
+            words += self._check_paragraph(text, index, sink, location)
 
+        issues = sum(counts.values())
+        # Skala sama dengan teks 100 kata: -2 poin per masalah
+        score = 100 - issues * 2 * 100 / max(words, 100)
         return {
-            "score": 100 - (len(suggestions) * 2), # Nilai asal
-            "issues_count": len(suggestions),
-            "details": suggestions
+            "score": max(0, round(score)),
+            "issues_count": issues,
+            "counts": counts,
+            "words": words,
+            "truncated": len(details) < issues,
+            "details": details
         }
 
+    def check(self, text):
+        return self.check_paragraphs(text.splitlines() or [text])
+
+
+_agent = None
+
+
+def get_agent():
+    """Satu agent per proses worker: automaton & cache stem dipakai antar job"""
+    global _agent
+    if _agent is None:
+        _agent = IndoGrammarAgent()
+    return _agent
+
+
+def check_document(file_path, max_details=GRAMMAR_MAX_DETAILS):
+    """Cek seluruh dokumen (.docx di-stream per paragraf, selain itu teks biasa)"""
+    started = time.perf_counter()
+    try:
+        if file_path.lower().endswith('.docx'):
+            paragraphs = iter_docx_paragraphs(file_path)
+            report = get_agent().check_paragraphs(paragraphs, max_details)
+        else:
+            with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+                report = get_agent().check_paragraphs(f, max_details)
+        report['success'] = True
+        report['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        return report
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
 # Test Direct Run
 if __name__ == "__main__":
     agent = IndoGrammarAgent()
@@ -0,0 +1,210 @@
+import os
+import zipfile
+import threading
+import contextvars
+from collections import namedtuple
+from contextlib import contextmanager
+
+from utils import telemetry
+from utils.page_counter import docx_app_pages
+from utils.pdf_compressor import page_ranges
+
+MB = 1024 * 1024
+
+# Anggaran memori kerja semua job yang berjalan bersamaan (di luar baseline
+# proses worker yang sudah hangat). 0 = 60% dari batas memori container.
+MEMORY_BUDGET_MB = int(os.getenv('MEMORY_BUDGET_MB', '0'))
+# Job dengan estimasi di atas ini masuk lane 'large' (konkurensi rendah)
+LARGE_JOB_MB = int(os.getenv('LARGE_JOB_MB', '384'))
+# Batas RLIMIT_AS per job = estimasi x faktor ini (minimal SANDBOX_JOB_MIN_MB)
+MEMORY_HEADROOM = float(os.getenv('MEMORY_HEADROOM', '3'))
+SANDBOX_JOB_MIN_MB = int(os.getenv('SANDBOX_JOB_MIN_MB', '256'))
+
+# Faktor hasil ukur benchmarks/ (peak RSS - baseline worker):
+# XML docx ter-parse (lxml + proxy python-docx) ~16x ukuran XML mentah,
+# PDF (PyPDF2 baca seluruh file + gambar ter-decode) ~16x ukuran file
+DOCX_XML_FACTOR = 16
+PDF_FACTOR = 16
+PAGE_COST = 256 * 1024  # Per halaman: layout LibreOffice saat konversi
+JOB_FLOOR = 8 * MB  # Job sekecil apa pun tetap dihitung
+
+Estimate = namedtuple('Estimate', ['total', 'per_process'])
+
+# Batas memori per proses untuk job yang sedang berjalan (dibaca SandboxPool.run)
+_process_limit = contextvars.ContextVar('smartcopy_memory_limit', default=None)
+
+JOBS_OVERSIZED = telemetry.REGISTRY.counter(
+    'smartcopy_jobs_oversized_total', 'Jobs routed to the large lane', ('type',))
+
+
+def _container_memory():
+    """Batas memori cgroup (v2 / v1), fallback RAM fisik; None kalau tidak diketahui"""
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        # cgroup v1 tanpa batas melaporkan angka raksasa
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value)
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def default_budget():
+    if MEMORY_BUDGET_MB:
+        return MEMORY_BUDGET_MB * MB
+    total = _container_memory()
+    return int(total * 0.6) if total else 2048 * MB
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except (OSError, TypeError):
+        return 0
+
+
+def _docx_cost(path):
+    """
+    Dari central directory zip (tanpa decompress): ukuran asli part XML yang
+    di-parse python-docx. Gambar/media tidak dimuat (docx_io), jadi tidak dihitung.
+    """
+    try:
+        with zipfile.ZipFile(path) as package:
+            xml_bytes = sum(info.file_size for info in package.infolist()
+                            if info.filename.endswith('.xml') or info.filename.endswith('.rels'))
+            pages = docx_app_pages(package) or 0
+    except (OSError, zipfile.BadZipFile):
+        # Bukan zip valid: job akan gagal cepat, hitung dari ukuran file saja
+        return _file_size(path) * DOCX_XML_FACTOR, 0
+    return xml_bytes * DOCX_XML_FACTOR, pages
+
+
+def document_cost(path, converting=False, meta=None):
+    """
+    Perkiraan memori kerja satu dokumen (byte).
+    meta: hasil preflight (ukuran XML & halaman sudah dibaca, zip tidak dibuka lagi).
+    """
+    if not path:
+        return JOB_FLOOR
+    size = meta['size'] if meta and 'size' in meta else _file_size(path)
+    if str(path).lower().endswith('.pdf'):
+        return max(JOB_FLOOR, size * PDF_FACTOR)
+    if meta and 'xml_bytes' in meta:
+        cost, pages = meta['xml_bytes'] * DOCX_XML_FACTOR, meta.get('pages') or 0
+    else:
+        cost, pages = _docx_cost(path)
+    if converting:
+        # LibreOffice (proses terpisah, tapi container yang sama) + PDF hasilnya
+        cost += pages * PAGE_COST + size * PDF_FACTOR
+    return max(JOB_FLOOR, cost)
+
+
+def estimate_job_memory(job, batch_concurrency=1, pdf_workers=1):
+    """
+    Estimasi memori job sebelum dijalankan: total (semua proses sekaligus)
+    dan per proses (dasar batas rlimit di sandbox).
+    batch_format: item terbesar yang mungkin jalan paralel dijumlahkan.
+    compress_pdf / count_pages yang dipecah per rentang halaman: setiap
+    worker membaca seluruh file, gambar ter-decode terbagi antar worker.
+    Metadata preflight (job['preflight']) dipakai kalau ada.
+    """
+    job_type = job.get('type')
+    if job_type == 'batch_format':
+        costs = sorted((document_cost(item.get('input'), meta=item.get('preflight'))
+                        for item in job.get('items') or []
+                        if 'error' not in (item.get('preflight') or {})), reverse=True)
+        if not costs:
+            return Estimate(JOB_FLOOR, JOB_FLOOR)
+        return Estimate(sum(costs[:max(1, batch_concurrency)]), costs[0])
+    if job_type == 'grammar_check':
+        # Dibaca streaming per paragraf (iterparse): tidak sebanding ukuran dokumen
+        return Estimate(JOB_FLOOR, JOB_FLOOR)
+    if job_type == 'scan_template':
+        # Template di-compile sekali lalu di-cache
+        cost = document_cost(job.get('input'), meta=job.get('preflight'))
+        return Estimate(cost, cost)
+    meta = job.get('preflight') or {}
+    if job_type in ('compress_pdf', 'count_pages') and meta.get('kind') == 'pdf':
+        ranges = page_ranges(meta.get('pages'), meta.get('size', 0), pdf_workers)
+        if ranges:
+            cost = document_cost(job.get('input'), meta=meta)
+            return Estimate(cost + meta['size'] * (len(ranges) - 1), meta['size'] + cost // len(ranges))
+    converting = job_type == 'convert_pdf' or (job_type == 'pipeline' and 'convert' in (job.get('stages') or []))
+    cost = document_cost(job.get('input'), converting, job.get('preflight'))
+    if job.get('ref') and job_type in ('format', 'convert_pdf', 'pipeline'):
+        cost += document_cost(job['ref']) // 4  # Template: compile sekali, lalu dari cache
+    return Estimate(cost, cost)
+
+
+def process_limit():
+    """Batas memori proses untuk job di context ini (byte), None = default pool"""
+    return _process_limit.get()
+
+
+class MemoryBudget:
+    """
+    Admission control: job baru mulai hanya kalau total estimasi memori job
+    yang sedang berjalan + job ini masih di bawah anggaran.
+    - Job yang menunggu lebih dulu dijatah duluan; job kecil yang datang
+      belakangan hanya boleh menyalip kalau muat bersama jatah itu
+    - Job yang sendirian melebihi anggaran tetap jalan, tapi sendirian
+    """
+
+    def __init__(self, budget=None):
+        self.budget = budget or default_budget()
+        self._cond = threading.Condition()
+        self._used = 0
+        self._running = 0
+        self._waiting = []  # Tiket [cost] job yang menunggu, urut kedatangan
+
+    def _fits(self, ticket):
+        ahead = 0
+        for waiting in self._waiting:
+            if waiting is ticket:
+                break
+            ahead += waiting[0]
+        if self._running == 0 and ahead == 0:
+            return True
+        return self._used + ahead + ticket[0] <= self.budget
+
+    @contextmanager
+    def reserve(self, estimate):
+        """Tunggu jatah memori, jalankan blok dengan batas rlimit per proses, lalu kembalikan jatahnya"""
+        cost = min(estimate.total, self.budget)
+        ticket = [cost]
+        with telemetry.span('memory_wait'):
+            with self._cond:
+                self._waiting.append(ticket)
+                try:
+                    while not self._fits(ticket):
+                        self._cond.wait()
+                finally:
+                    # Hapus berdasarkan identitas: tiket lain bisa bernilai sama
+                    self._waiting = [waiting for waiting in self._waiting if waiting is not ticket]
+                self._used += cost
+                self._running += 1
+                # Jatah yang baru dilepas dari antrean bisa membuat job kecil di belakangnya muat
+                self._cond.notify_all()
+        token = _process_limit.set(max(SANDBOX_JOB_MIN_MB * MB, int(estimate.per_process * MEMORY_HEADROOM)))
+        try:
+            yield
+        finally:
+            _process_limit.reset(token)
+            with self._cond:
+                self._used -= cost
+                self._running -= 1
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'budget': self.budget,
+                'used': self._used,
+                'running': self._running,
+                'waiting': len(self._waiting),
+            }
@@ -0,0 +1,314 @@
+import os
+import json
+import time
+import threading
+
+import redis
+import psycopg2
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+
+from utils import telemetry
+
+DATABASE_URL = os.getenv('DATABASE_URL', '')
+# Flush kalau update tertunda mencapai ORDER_SINK_BATCH, atau paling lama tiap ORDER_SINK_INTERVAL detik
+ORDER_SINK_BATCH = int(os.getenv('ORDER_SINK_BATCH', '200'))
+ORDER_SINK_INTERVAL = float(os.getenv('ORDER_SINK_INTERVAL', '2'))
+ORDER_SINK_POOL_SIZE = int(os.getenv('ORDER_SINK_POOL_SIZE', '2'))
+# Backoff retry saat Postgres tidak bisa dihubungi (detik, berlipat dua sampai batas ini)
+ORDER_SINK_RETRY_MAX = float(os.getenv('ORDER_SINK_RETRY_MAX', '60'))
+
+# Update yang belum masuk Postgres: hash job key -> JSON update. Ditulis
+# sebelum job di-ack, dihapus setelah commit, dibaca ulang saat worker start.
+PENDING_KEY = 'order_updates:pending'
+
+# Status order dari hasil job (kolom orders.status, awalnya 'processing' dari backend).
+# Harus ada di validStatuses backend (order.controller updateOrderStatus):
+# dokumen jadi -> menunggu review staf, gagal -> FAILED
+ORDER_STATUSES = {
+    'success': 'PENDING_REVIEW',
+    'partial': 'PENDING_REVIEW',
+    'failed': 'FAILED',
+    'error': 'FAILED',
+}
+# Status yang boleh ditimpa engine; status dari staf (READY, COMPLETED, ...) tidak
+ENGINE_STATUSES = ('processing',) + tuple(sorted(set(ORDER_STATUSES.values())))
+# Job informasi (estimasi harga, cek) tidak mengubah status order
+INFO_JOBS = ('count_pages', 'grammar_check', 'scan_template')
+
+_UPDATE_SQL = f"""
+UPDATE orders AS o SET
+    status = CASE WHEN v.status IS NOT NULL AND o.status IN ({', '.join(f"'{s}'" for s in ENGINE_STATUSES)})
+                  THEN v.status ELSE o.status END,
+    page_count = COALESCE(v.page_count, o.page_count),
+    price = COALESCE(v.price, o.price),
+    updated_at = NOW()
+FROM (VALUES %s) AS v(order_id, status, page_count, price)
+WHERE o.order_id = v.order_id
+"""
+# NULL di VALUES tidak bertipe: cast eksplisit per kolom
+_ROW_TEMPLATE = '(%s::varchar, %s::varchar, %s::integer, %s::numeric)'
+_FIELDS = ('status', 'page_count', 'price')
+
+ORDER_SINK_ROWS = telemetry.REGISTRY.counter(
+    'smartcopy_order_updates_total', 'Order rows written to Postgres')
+ORDER_SINK_FLUSHES = telemetry.REGISTRY.counter(
+    'smartcopy_order_flushes_total', 'Order sink flushes, by outcome', ('status',))
+
+
+def _counts(result):
+    """(page_count, price) dari hasil job; pipeline dari tahap count_pages-nya"""
+    counted = (result.get('stages') or {}).get('count_pages') or result
+    page_count = counted.get('page_count')
+    if page_count is None:
+        page_count = result.get('pages')  # compress_pdf / convert_pdf
+    price = counted.get('price')
+    return (int(page_count) if page_count is not None else None,
+            round(float(price), 2) if price is not None else None)
+
+
+def order_update(job, result):
+    """
+    Update kolom orders untuk satu hasil job, None kalau job tidak terkait
+    order (tanpa 'orderRef') atau tidak ada yang perlu ditulis. Status order
+    hanya diubah job yang menghasilkan dokumen (format, convert, compress,
+    batch, pipeline); job INFO_JOBS cuma mengisi page_count & price kalau sukses.
+    """
+    order_id = job.get('orderRef') or job.get('order_id')
+    if not order_id:
+        return None
+    info = job.get('type') in INFO_JOBS
+    succeeded = result.get('status') == 'success'
+    if info and not succeeded:
+        return None  # Estimasi harga / cek yang gagal tidak menggagalkan order
+    status = None if info else ORDER_STATUSES.get(result.get('status'), ORDER_STATUSES['failed'])
+    page_count, price = _counts(result) if succeeded else (None, None)
+    if status is None and page_count is None and price is None:
+        return None
+    return {'order_id': str(order_id)[:50], 'status': status, 'page_count': page_count, 'price': price}
+
+
+def _merge(updates):
+    """Update per job -> satu baris per order; urut waktu, field terakhir yang bukan None menang"""
+    rows = {}
+    for update in sorted(updates, key=lambda item: item['at']):
+        row = rows.setdefault(update['order_id'], dict.fromkeys(_FIELDS))
+        for field in _FIELDS:
+            if update.get(field) is not None:
+                row[field] = update[field]
+    return [(order_id, row['status'], row['page_count'], row['price']) for order_id, row in rows.items()]
+
+
+class OrderSink:
+    """
+    Tulis hasil job ke tabel orders secara batch, bukan satu koneksi &
+    satu transaksi per dokumen.
+
+    - record(): update dicatat di hash Redis PENDING_KEY (tahan restart)
+      lalu di buffer memori; dipanggil sebelum job di-ack
+    - Thread flusher: tiap ORDER_SINK_INTERVAL detik atau saat buffer
+      mencapai ORDER_SINK_BATCH, semua update digabung per order dan
+      ditulis dengan satu UPDATE ... FROM (VALUES ...) (execute_values)
+      dalam satu transaksi, lewat pool koneksi kecil
+    - Gagal (Postgres mati / koneksi putus): batch dikembalikan ke buffer,
+      dicoba lagi dengan backoff. Data ditolak Postgres: batch ditulis
+      ulang per baris, hanya baris yang ditolak yang dibuang. Setelah
+      commit, entri dihapus dari Redis hanya kalau belum diganti hasil
+      yang lebih baru
+    - Start: entri yang tertinggal (worker mati sebelum flush) diputar
+      ulang. Update idempoten, jadi tertulis dua kali pun aman
+    DATABASE_URL kosong = sink nonaktif (record() tidak melakukan apa-apa).
+    """
+
+    def __init__(self, r, dsn=DATABASE_URL, batch_size=ORDER_SINK_BATCH,
+                 interval=ORDER_SINK_INTERVAL, pool_size=ORDER_SINK_POOL_SIZE):
+        self.r = r
+        self.dsn = dsn
+        self.batch_size = max(1, batch_size)
+        self.interval = interval
+        self.pool_size = max(1, pool_size)
+        self.enabled = bool(dsn)
+        self._pool = None
+        self._buffer = {}  # job key -> (raw JSON di Redis, update)
+        self._wake = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # --- Catat ---------------------------------------------------------
+
+    def record(self, key, job, result):
+        """Catat update order hasil job `key`; return update-nya (None = tidak ada)"""
+        if not self.enabled:
+            return None
+        update = order_update(job, result)
+        if update is None:
+            return None
+        update['at'] = time.time()
+        raw = json.dumps(update)
+        try:
+            self.r.hset(PENDING_KEY, key, raw)
+        except Exception as e:
+            # Tetap ditulis dari memori; hanya tidak tahan restart
+            print(f"   Order update not persisted in Redis: {e}")
+        with self._wake:
+            self._buffer[key] = (raw, update)
+            if len(self._buffer) >= self.batch_size:
+                self._wake.notify()
+        return update
+
+    def pending(self):
+        with self._wake:
+            return len(self._buffer)
+
+    # --- Flush ---------------------------------------------------------
+
+    def _connections(self):
+        if self._pool is None:
+            self._pool = ThreadedConnectionPool(1, self.pool_size, self.dsn)
+        return self._pool
+
+    def _write(self, rows):
+        pool = self._connections()
+        conn = pool.getconn()
+        broken = False
+        try:
+            with conn:  # Satu transaksi per flush: commit, atau rollback kalau gagal
+                with conn.cursor() as cur:
+                    execute_values(cur, _UPDATE_SQL, rows, template=_ROW_TEMPLATE, page_size=len(rows))
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            pool.putconn(conn, close=broken or conn.closed)
+
+    def _write_rows(self, rows):
+        """
+        Tulis rows; kalau Postgres menolak datanya (nilai salah, constraint),
+        tulis ulang per baris supaya update order lain tetap masuk.
+        Return baris yang dibuang. Error koneksi diteruskan (batch dicoba lagi).
+        """
+        try:
+            self._write(rows)
+            return []
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            raise
+        except psycopg2.Error as e:
+            if len(rows) == 1:
+                print(f"   Order sink: dropped update for order {rows[0][0]}: {e}")
+                return rows
+        dropped = []
+        for row in rows:
+            dropped += self._write_rows([row])
+        return dropped
+
+    def _forget(self, batch):
+        """Hapus entri Redis yang sudah tertulis, kecuali yang sudah diganti hasil baru"""
+        while True:
+            with self.r.pipeline() as pipe:
+                try:
+                    pipe.watch(PENDING_KEY)
+                    keys = list(batch)
+                    current = pipe.hmget(PENDING_KEY, keys)
+                    done = [key for key, raw in zip(keys, current) if raw == batch[key][0]]
+                    if not done:
+                        pipe.unwatch()
+                        return
+                    pipe.multi()
+                    pipe.hdel(PENDING_KEY, *done)
+                    pipe.execute()
+                    return
+                except redis.WatchError:
+                    continue  # Ada record() baru di tengah jalan, ulangi
+
+    def flush(self):
+        """Tulis semua update tertunda; return False kalau gagal (batch tetap tertunda)"""
+        with self._flush_lock:
+            with self._wake:
+                batch, self._buffer = self._buffer, {}
+            if not batch:
+                return True
+            rows = _merge([update for _, update in batch.values()])
+            try:
+                dropped = self._write_rows(rows)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                ORDER_SINK_FLUSHES.inc(status='retry')
+                print(f"   Order sink: Postgres unavailable, {len(rows)} update(s) kept for retry: {e}")
+                with self._wake:
+                    # Hasil yang dicatat selama flush lebih baru, jangan ditimpa
+                    for key, entry in batch.items():
+                        self._buffer.setdefault(key, entry)
+                return False
+            # Baris yang ditolak tetap ditolak kalau dicoba ulang: dibuang, jangan menyumbat antrean
+            ORDER_SINK_FLUSHES.inc(status='partial' if dropped else 'ok')
+            ORDER_SINK_ROWS.inc(len(rows) - len(dropped))
+            try:
+                self._forget(batch)
+            except Exception as e:
+                print(f"   Order sink: pending cleanup failed (will be replayed): {e}")
+            return True
+
+    # --- Lifecycle -----------------------------------------------------
+
+    def replay(self):
+        """Muat update yang belum sempat ditulis (dari run / worker sebelumnya)"""
+        try:
+            stored = self.r.hgetall(PENDING_KEY)
+        except Exception as e:
+            print(f"   Order sink: pending replay skipped: {e}")
+            return 0
+        loaded = 0
+        with self._wake:
+            for key, raw in stored.items():
+                try:
+                    update = json.loads(raw)
+                except ValueError:
+                    continue
+                if isinstance(update, dict) and update.get('order_id'):
+                    self._buffer.setdefault(key, (raw, update))
+                    loaded += 1
+        return loaded
+
+    def _run(self):
+        delay = 0
+        while not self._stop.is_set():
+            if delay:
+                self._stop.wait(delay)  # Backoff: Postgres belum bisa dihubungi
+            else:
+                with self._wake:
+                    if len(self._buffer) < self.batch_size:
+                        self._wake.wait(self.interval)
+            if self._stop.is_set():
+                break
+            try:
+                ok = self.flush()
+            except Exception as e:
+                print(f"   Order sink error: {e}")
+                ok = False
+            delay = 0 if ok else min(ORDER_SINK_RETRY_MAX, max(self.interval, delay * 2))
+
+    def start(self):
+        if not self.enabled or self._thread is not None:
+            return self
+        replayed = self.replay()
+        if replayed:
+            print(f"   Order sink: replaying {replayed} pending update(s)")
+        self._thread = threading.Thread(target=self._run, name='order-sink', daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        """Flush terakhir (mis. saat shutdown); yang gagal tetap tersimpan di Redis"""
+        self._stop.set()
+        with self._wake:
+            self._wake.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 5)
+        if self.enabled:
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"   Order sink: final flush failed: {e}")
+        if self._pool is not None:
+            self._pool.closeall()
+            self._pool = None
@@ -0,0 +1,317 @@
+from PyPDF2 import PdfReader
+from PyPDF2.generic import ArrayObject, IndirectObject
+import io
+import os
+import re
+import time
+import zipfile
+
+try:
+    import numpy as np
+except ImportError:  # Tanpa NumPy: gambar berwarna dinilai dari color space saja
+    np = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Harga per halaman (Rupiah), bisa diatur lewat env
+PRICE_MONO = float(os.getenv('PRICE_MONO_PER_PAGE', '500'))
+PRICE_COLOR = float(os.getenv('PRICE_COLOR_PER_PAGE', '1500'))
+
+# Toleransi: selisih antar kanal di bawah ini dianggap abu-abu
+COLOR_TOLERANCE = 0.02
+# Gambar dianggap berwarna kalau > 0.5% pikselnya berwarna
+COLOR_PIXEL_RATIO = 0.005
+PIXEL_TOLERANCE = 16  # 0-255
+
+_NUMBER = rb'[-+]?(?:\d+\.?\d*|\.\d+)'
+# Operator warna + operand angka di depannya, "/Nama Do", "/Nama cs", "/Nama sh"
+COLOR_OP_RE = re.compile(
+    rb'((?:' + _NUMBER + rb'\s+){1,4})(rg|RG|k|K|scn|SCN|sc|SC)(?![A-Za-z])'
+    rb'|/([^\s/\[\]()<>{}%]+)\s*(scn|SCN|cs|CS|Do|sh)(?![A-Za-z])'
+)
+
+_GRAY_SPACES = {'/DeviceGray', '/CalGray', '/G'}
+
+# <Pages> di docProps/app.xml; app.xml lebih besar dari batas ini tidak dibaca (cuma metadata)
+_APP_PAGES_RE = re.compile(rb'<(?:\w+:)?Pages>(\d+)</(?:\w+:)?Pages>')
+APP_XML_MAX = 256 * 1024
+
+
+def _is_gray_values(values):
+    """Nilai operand warna (1 = gray, 3 = RGB, 4 = CMYK) -> True kalau netral"""
+    if len(values) == 3:
+        return max(values) - min(values) <= COLOR_TOLERANCE
+    if len(values) == 4:
+        c, m, y, _ = values
+        return max(c, m, y) - min(c, m, y) <= COLOR_TOLERANCE
+    return True
+
+
+def _color_space_is_gray(space):
+    """Color space PDF -> True (gray), False (warna)"""
+    space = space.get_object() if isinstance(space, IndirectObject) else space
+    if isinstance(space, ArrayObject) and space:
+        family = space[0]
+        if family == '/ICCBased':
+            return int(space[1].get_object().get('/N', 3)) == 1
+        if family in ('/Indexed', '/I'):
+            return _color_space_is_gray(space[1])
+        if family in ('/Separation', '/DeviceN'):
+            names = space[1] if isinstance(space[1], ArrayObject) else [space[1]]
+            return all(name in ('/Black', '/All', '/None') for name in names)
+        if family == '/Pattern':
+            return False
+        return family in _GRAY_SPACES
+    return space in _GRAY_SPACES
+
+
+def _image_pixels_are_color(obj):
+    """
+    Fallback NumPy: decode gambar (diperkecil) lalu cek selisih antar kanal.
+    Scan hitam-putih yang disimpan sebagai RGB akan terdeteksi mono.
+    Return None kalau tidak bisa dianalisis.
+    """
+    if np is None:
+        return None
+    width, height = int(obj['/Width']), int(obj['/Height'])
+    filters = obj.get('/Filter')
+    if isinstance(filters, ArrayObject):
+        filters = filters[0] if len(filters) == 1 else None
+
+    if filters == '/DCTDecode' and Image is not None:
+        image = Image.open(io.BytesIO(obj._data))
+        image.draft('RGB', (max(1, width // 8), max(1, height // 8)))  # decode cepat 1/8
+        pixels = np.asarray(image.convert('RGB'))
+    elif obj.get('/ColorSpace') == '/DeviceRGB' and obj.get('/BitsPerComponent') == 8 \
+            and filters in (None, '/FlateDecode'):
+        data = obj.get_data()
+        obj.decoded_self = None
+        pixels = np.frombuffer(data, dtype=np.uint8)[:width * height * 3]
+        if pixels.size < width * height * 3:
+            return None
+        pixels = pixels.reshape(height, width, 3)[::4, ::4]
+    else:
+        return None
+
+    if pixels.ndim != 3 or pixels.shape[2] < 3:
+        return False
+    pixels = pixels.astype(np.int16)
+    chroma = pixels.max(axis=2) - pixels.min(axis=2)
+    return bool((chroma > PIXEL_TOLERANCE).mean() > COLOR_PIXEL_RATIO)
+
+
+class _PageClassifier:
+    """Klasifikasi warna per halaman; hasil XObject di-cache per objek"""
+
+    def __init__(self):
+        self.xobject_cache = {}
+        self.raster_checks = 0
+
+    def page_is_color(self, page):
+        return self._stream_is_color(_content_bytes(page), page.get('/Resources'), depth=0)
+
+    def _stream_is_color(self, content, resources, depth):
+        resources = resources.get_object() if resources is not None else {}
+        # Color space aktif (cs/CS) berwarna? Penting untuk sc/scn 1 operand
+        # di ruang Indexed/Separation.
+        space_is_color = False
+        for match in COLOR_OP_RE.finditer(content):
+            operands, op, name, named_op = match.groups()
+            if op is not None:
+                values = [float(v) for v in operands.split()]
+                if op in (b'rg', b'RG'):
+                    values = values[-3:]
+                elif op in (b'k', b'K'):
+                    values = values[-4:]
+                elif len(values) < 3 and space_is_color:
+                    return True
+                if not _is_gray_values(values):
+                    return True
+                continue
+
+            name = '/' + name.decode('latin-1')
+            if named_op in (b'cs', b'CS'):
+                space = _resource(resources, '/ColorSpace', name)
+                space_is_color = not _color_space_is_gray(space if space is not None else name) \
+                    and name not in ('/DeviceRGB', '/DeviceCMYK', '/RGB', '/CMYK')
+            elif named_op in (b'scn', b'SCN'):
+                # Pola (pattern/shading) -> cek color space shading-nya
+                if self._pattern_is_color(resources, name):
+                    return True
+            elif named_op == b'sh':
+                shading = _resource(resources, '/Shading', name)
+                if shading is not None and not _color_space_is_gray(shading.get('/ColorSpace', '/DeviceRGB')):
+                    return True
+            elif named_op == b'Do' and depth < 5:
+                if self._xobject_is_color(resources, name, depth):
+                    return True
+        return False
+
+    def _pattern_is_color(self, resources, name):
+        pattern = _resource(resources, '/Pattern', name)
+        if pattern is None:
+            return False
+        shading = pattern.get('/Shading')
+        if shading is None:
+            return True  # Tiling pattern: anggap warna (jarang di dokumen teks)
+        return not _color_space_is_gray(shading.get_object().get('/ColorSpace', '/DeviceRGB'))
+
+    def _xobject_is_color(self, resources, name, depth):
+        xobjects = resources.get('/XObject')
+        if xobjects is None:
+            return False
+        ref = xobjects.get_object().raw_get(name) if name in xobjects.get_object() else None
+        if ref is None:
+            return False
+        key = ref.idnum if isinstance(ref, IndirectObject) else id(ref)
+        if key in self.xobject_cache:
+            return self.xobject_cache[key]
+
+        obj = ref.get_object()
+        if obj.get('/Subtype') == '/Image':
+            result = self._image_is_color(obj)
+        elif obj.get('/Subtype') == '/Form':
+            result = self._stream_is_color(obj.get_data(), obj.get('/Resources'), depth + 1)
+            obj.decoded_self = None
+        else:
+            result = False
+        self.xobject_cache[key] = result
+        return result
+
+    def _image_is_color(self, obj):
+        if obj.get('/ImageMask'):
+            return False
+        space = obj.get('/ColorSpace', '/DeviceGray')
+        if _color_space_is_gray(space):
+            return False
+        # Color space berwarna: cek pikselnya (banyak scan B/W disimpan RGB)
+        self.raster_checks += 1
+        try:
+            verdict = _image_pixels_are_color(obj)
+        except Exception:
+            verdict = None
+        return True if verdict is None else verdict
+
+
+def _resource(resources, kind, name):
+    group = resources.get(kind)
+    if group is None:
+        return None
+    group = group.get_object()
+    return group[name].get_object() if name in group else None
+
+
+def _content_bytes(page):
+    """Gabungkan semua content stream halaman (decode Flate saja, tanpa parse)"""
+    contents = page.get('/Contents')
+    if contents is None:
+        return b''
+    contents = contents.get_object()
+    streams = contents if isinstance(contents, ArrayObject) else [contents]
+    chunks = []
+    for stream in streams:
+        stream = stream.get_object()
+        chunks.append(stream.get_data())
+        stream.decoded_self = None
+    return b'\n'.join(chunks)
+
+
+def docx_app_pages(package):
+    """
+    Perkiraan halaman .docx dari docProps/app.xml (ditulis Word saat save)
+    pada ZipFile yang sudah dibuka. None kalau tidak ada / tidak wajar
+    besarnya; error baca zip diteruskan ke pemanggil.
+    """
+    info = package.NameToInfo.get('docProps/app.xml')
+    if info is None or info.file_size > APP_XML_MAX:
+        return None
+    match = _APP_PAGES_RE.search(package.read(info))
+    return int(match.group(1)) if match else None
+
+
+def _docx_page_count(file_path):
+    with zipfile.ZipFile(file_path) as package:
+        return docx_app_pages(package)
+
+
+def classify_range(file_path, start, stop):
+    """
+    Sandbox entry point: klasifikasi warna halaman [start, stop) saja.
+    PDF besar dibagi per rentang ke beberapa worker (lihat worker_manager),
+    nomor halaman di hasil tetap nomor absolut (mulai 1).
+    """
+    try:
+        reader = PdfReader(file_path)
+        if reader.is_encrypted:
+            return {"success": False, "error": "PDF is password protected"}
+        classifier = _PageClassifier()
+        pages = reader.pages
+        color_pages = [number + 1 for number in range(start, min(stop, len(pages)))
+                       if classifier.page_is_color(pages[number])]
+        return {"success": True, "color_pages": color_pages, "raster_checks": classifier.raster_checks}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+def quote_price(mono_pages, color_pages, copies=1):
+    return (mono_pages * PRICE_MONO + color_pages * PRICE_COLOR) * max(1, int(copies))
+
+
+def count_pages(file_path, copies=1, kind=None):
+    """
+    Hitung halaman + klasifikasi warna/hitam-putih untuk estimasi harga.
+    PDF: jumlah halaman dari page tree (tanpa decode konten), warna dari
+    operator warna di content stream + color space gambar; analisis piksel
+    (NumPy) hanya untuk gambar ber-color space warna.
+    DOCX: jumlah halaman dari metadata, semua dihitung hitam-putih.
+    file_path boleh berupa stream; jenisnya lewat kind ('pdf' / 'docx').
+    """
+    started = time.perf_counter()
+    if kind is None:
+        kind = 'docx' if file_path.lower().endswith('.docx') else 'pdf'
+    try:
+        if kind == 'docx':
+            pages = _docx_page_count(file_path)
+            if pages is None:
+                return {"success": False, "error": "Page count not available in DOCX metadata"}
+            return {
+                "success": True,
+                "page_count": pages,
+                "color_pages": [],
+                "color_count": 0,
+                "mono_count": pages,
+                "estimated": True,
+                "price": quote_price(pages, 0, copies),
+                "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)
+            }
+
+        reader = PdfReader(file_path)
+        if reader.is_encrypted:
+            return {"success": False, "error": "PDF is password protected"}
+        page_count = int(reader.trailer['/Root']['/Pages']['/Count'])
+
+        classifier = _PageClassifier()
+        color_pages = []
+        for number, page in enumerate(reader.pages, start=1):
+            if classifier.page_is_color(page):
+                color_pages.append(number)
+
+        color_count = len(color_pages)
+        mono_count = page_count - color_count
+        return {
+            "success": True,
+            "page_count": page_count,
+            "color_pages": color_pages,
+            "color_count": color_count,
+            "mono_count": mono_count,
+            "estimated": False,
+            "raster_checks": classifier.raster_checks,
+            "price": quote_price(mono_count, color_count, copies),
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)
+        }
+
+    except Exception as e:
+        return {"success": False, "error": str(e)}
@@ -1,41 +1,430 @@
 from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import NameObject, NumberObject, IndirectObject
+import hashlib
+import io
 import os
+import shutil
+import time
 
-def compress_pdf(input_path, output_path):
+from utils import telemetry
+
+try:
+    from PIL import Image
+except ImportError:  # Tanpa Pillow: tahap gambar dilewati, sisanya tetap jalan
+    Image = None
+
+# Profil cetak: target DPI gambar + kualitas JPEG hasil recompress
+PRINT_PROFILES = {
+    'screen': {'dpi': 96, 'quality': 60},
+    'ebook': {'dpi': 150, 'quality': 70},
+    'print': {'dpi': 300, 'quality': 85},
+    'prepress': {'dpi': 400, 'quality': 92},
+}
+DEFAULT_PROFILE = os.getenv('PDF_COMPRESS_PROFILE', 'print')
+
+# Gambar baru di-downsample kalau DPI-nya > target * faktor ini
+DOWNSAMPLE_THRESHOLD = 1.5
+# Scan (RGB / grayscale) yang disimpan lossless (Flate / tanpa filter) di-encode ulang ke JPEG
+# walau resolusinya sudah pas: gambar besar yang hasil Flate-nya masih di atas
+# rasio ini dari ukuran mentahnya (foto/scan; grafik & teks jauh di bawahnya)
+REENCODE_MIN_PIXELS = 1000000
+REENCODE_MIN_RATIO = 0.1
+
+# PDF di atas ukuran ini dipecah per rentang halaman & diproses paralel
+# (satu rentang per worker sandbox); minimal halaman per rentang
+PDF_PARALLEL_MIN_MB = float(os.getenv('PDF_PARALLEL_MIN_MB', '8'))
+PDF_RANGE_MIN_PAGES = int(os.getenv('PDF_RANGE_MIN_PAGES', '8'))
+
+_COLOR_MODES = {'/DeviceRGB': 'RGB', '/DeviceGray': 'L'}
+
+
+class _Stage:
+    """Akumulasi waktu per tahap (dipanggil berulang per halaman)"""
+
+    def __init__(self):
+        self.timings = {}
+
+    def add(self, name, started):
+        self.timings[name] = self.timings.get(name, 0.0) + (time.perf_counter() - started)
+
+    def report(self):
+        # Tahap kompresi ikut masuk trace job (histogram stage_seconds)
+        for name, seconds in self.timings.items():
+            telemetry.record_span(f'compress.{name}', seconds)
+        return {name: round(seconds, 4) for name, seconds in self.timings.items()}
+
+
+def _stream_digest(obj):
+    """Hash isi stream (encoded) + kamus-nya, untuk deteksi objek kembar"""
+    sha1 = hashlib.sha1(obj._data if isinstance(obj._data, bytes) else bytes(obj._data))
+    for key in sorted(k for k in obj.keys() if k != '/Length'):
+        sha1.update(key.encode('latin-1'))
+        sha1.update(repr(obj[key]).encode('latin-1', 'replace'))
+    return sha1.hexdigest()
+
+
+def _font_digest(font):
+    """Hash font dict + file font yang di-embed (kalau ada)"""
+    sha1 = hashlib.sha1(repr(sorted(
+        (k, repr(v)) for k, v in font.items() if k != '/FontDescriptor'
+    )).encode('latin-1', 'replace'))
+    descriptor = font.get('/FontDescriptor')
+    if descriptor is not None:
+        descriptor = descriptor.get_object()
+        for key in ('/FontFile', '/FontFile2', '/FontFile3'):
+            if key in descriptor:
+                sha1.update(_stream_digest(descriptor[key].get_object()).encode())
+    return sha1.hexdigest()
+
+
+def _page_size_inches(page):
+    box = page.mediabox
+    return float(box.width) / 72, float(box.height) / 72
+
+
+def _lossless_scan(obj, filters, mode, width, height):
+    """Scan besar yang disimpan Flate / tanpa kompresi (lihat REENCODE_MIN_RATIO)"""
+    if filters == '/DCTDecode' or width * height < REENCODE_MIN_PIXELS:
+        return False
+    return len(obj._data) > width * height * len(mode) * REENCODE_MIN_RATIO
+
+
+def _recompress_image(obj, page_inches, profile):
+    """
+    Downsample + recompress satu image XObject di tempat (in-place).
+    DPI dihitung dengan asumsi gambar paling besar selebar halaman, jadi
+    hasilnya tidak pernah di bawah target DPI. Scan lossless yang besar
+    di-encode ulang ke JPEG tanpa downsample. Return selisih byte (>= 0).
+    """
+    if obj.get('/ImageMask') or '/Decode' in obj or obj.get('/BitsPerComponent') != 8:
+        return 0
+    mode = _COLOR_MODES.get(obj.get('/ColorSpace'))
+    filters = obj.get('/Filter')
+    if isinstance(filters, list):
+        filters = filters[0] if len(filters) == 1 else None
+    if mode is None or filters not in (None, '/FlateDecode', '/DCTDecode'):
+        return 0
+
+    width, height = int(obj['/Width']), int(obj['/Height'])
+    page_w, page_h = page_inches
+    dpi = max(width / page_w, height / page_h) if page_w and page_h else 0
+    scale = profile['dpi'] / dpi if dpi > profile['dpi'] * DOWNSAMPLE_THRESHOLD else 1.0
+    if scale == 1.0 and not _lossless_scan(obj, filters, mode, width, height):
+        return 0  # Resolusi sudah wajar, jangan re-encode (hindari JPEG di grafik / JPEG lain)
+
+    before = len(obj._data)
+    if filters == '/DCTDecode':
+        image = Image.open(io.BytesIO(obj._data))
+        image = image.convert(mode)
+    else:
+        image = Image.frombytes(mode, (width, height), obj.get_data())
+    # Jangan simpan salinan decoded di objek (boros memori)
+    obj.decoded_self = None
+
+    if scale < 1.0:
+        new_size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        image = image.resize(new_size, Image.LANCZOS)
+
+    out = io.BytesIO()
+    image.save(out, format='JPEG', quality=profile['quality'], optimize=True)
+    new_data = out.getvalue()
+    new_width, new_height = image.size
+    image.close()
+
+    if len(new_data) >= before:
+        return 0
+
+    obj._data = new_data
+    obj[NameObject('/Filter')] = NameObject('/DCTDecode')
+    obj[NameObject('/Width')] = NumberObject(new_width)
+    obj[NameObject('/Height')] = NumberObject(new_height)
+    if '/DecodeParms' in obj:
+        del obj['/DecodeParms']
+    return before - len(new_data)
+
+
+def _dedupe_resources(page, kind, seen, digest_fn, report):
+    """
+    Arahkan resource kembar (isi sama, objek beda) ke satu objek kanonik
+    sebelum halaman disalin ke writer, jadi duplikatnya tidak ikut ditulis.
+    Return list objek resource unik yang baru pertama kali ditemui.
+    """
+    resources = page.get('/Resources')
+    if resources is None:
+        return []
+    resources = resources.get_object()
+    entries = resources.get(kind)
+    if entries is None:
+        return []
+    entries = entries.get_object()
+
+    fresh = []
+    for name in list(entries.keys()):
+        ref = entries.raw_get(name)
+        if not isinstance(ref, IndirectObject):
+            continue
+        # (reader, idnum): merge_ranges membaca beberapa PDF parsial sekaligus
+        identity = (id(ref.pdf), ref.idnum)
+        if identity in seen['ids']:
+            continue
+        if identity in seen['merged']:
+            # Duplikat yang sama sudah dihitung di halaman sebelumnya
+            entries[NameObject(name)] = seen['merged'][identity]
+            continue
+        obj = ref.get_object()
+        digest = digest_fn(obj)
+        canonical = seen['digests'].get(digest)
+        if canonical is not None and (id(canonical.pdf), canonical.idnum) != identity:
+            entries[NameObject(name)] = canonical
+            seen['merged'][identity] = canonical
+            report['deduplicated'] += 1
+            if hasattr(obj, '_data'):
+                report['dedup_bytes'] += len(obj._data)
+            continue
+        seen['digests'][digest] = ref
+        seen['ids'].add(identity)
+        fresh.append(obj)
+    return fresh
+
+
+def _new_seen():
+    """State dedup: objek unik (ids), digest -> objek kanonik, duplikat -> kanonik"""
+    return {'ids': set(), 'digests': {}, 'merged': {}}
+
+
+def _size(target):
+    """Ukuran file path atau buffer BytesIO"""
+    if isinstance(target, str):
+        return os.path.getsize(target)
+    return target.getbuffer().nbytes
+
+
+def page_ranges(pages, size, workers):
+    """
+    Rentang halaman [(start, stop), ...] untuk diproses paralel, satu per
+    worker. None = jalur satu proses: PDF kecil (< PDF_PARALLEL_MIN_MB),
+    jumlah halaman tidak diketahui, atau rentangnya jadi terlalu pendek.
+    """
+    if not pages or workers < 2 or size < PDF_PARALLEL_MIN_MB * 1024 * 1024:
+        return None
+    count = min(workers, pages // PDF_RANGE_MIN_PAGES)
+    if count < 2:
+        return None
+    step, extra = divmod(pages, count)
+    ranges, start = [], 0
+    for index in range(count):
+        stop = start + step + (1 if index < extra else 0)
+        ranges.append((start, stop))
+        start = stop
+    return ranges
+
+
+def _new_report():
+    return {
+        'images_processed': 0,
+        'image_bytes_saved': 0,
+        'deduplicated': 0,
+        'dedup_bytes': 0,
+    }
+
+
+def _compress_pages(pages, writer, settings, report, stages):
+    """Dedup resource, recompress gambar & content stream, lalu salin halaman ke writer"""
+    seen_images = _new_seen()
+    seen_fonts = _new_seen()
+    for page in pages:
+        # 1. Deduplikasi gambar & font kembar
+        started = time.perf_counter()
+        images = _dedupe_resources(page, '/XObject', seen_images, _stream_digest, report)
+        _dedupe_resources(page, '/Font', seen_fonts, _font_digest, report)
+        stages.add('dedup', started)
+
+        # 2. Downsample + recompress gambar (butuh Pillow)
+        if Image is not None:
+            started = time.perf_counter()
+            page_inches = _page_size_inches(page)
+            for obj in images:
+                if obj.get('/Subtype') != '/Image':
+                    continue
+                try:
+                    saved = _recompress_image(obj, page_inches, settings)
+                except Exception as e:
+                    print(f"   [PDF] Image skipped: {e}")
+                    continue
+                if saved:
+                    report['images_processed'] += 1
+                    report['image_bytes_saved'] += saved
+            stages.add('images', started)
+
+        # 3. Compress Content Streams (Teks & Vektor)
+        started = time.perf_counter()
+        page.compress_content_streams()
+        writer.add_page(page)
+        stages.add('content_streams', started)
+
+
+def _write(writer, output_path, stages):
+    # Metadata Cleaning
+    writer.add_metadata({
+        '/Producer': 'SmartCopy AI Engine'
+    })
+    started = time.perf_counter()
+    if isinstance(output_path, str):
+        with open(output_path, 'wb') as f:
+            writer.write(f)
+    else:
+        writer.write(output_path)
+    stages.add('write', started)
+
+
+def _keep_original(input_path, output_path):
+    """
+    Hasil tulis ulang tidak lebih kecil (mis. scan yang resolusinya sudah
+    pas): output diganti salinan byte input. Return True kalau diganti.
+    """
+    if _size(output_path) < _size(input_path):
+        return False
+    if isinstance(output_path, str):
+        if isinstance(input_path, str):
+            shutil.copyfile(input_path, output_path)
+        else:
+            with open(output_path, 'wb') as f:
+                f.write(input_path.getvalue())
+        return True
+    output_path.seek(0)
+    output_path.truncate()
+    if isinstance(input_path, str):
+        with open(input_path, 'rb') as f:
+            shutil.copyfileobj(f, output_path)
+    else:
+        output_path.write(input_path.getvalue())
+    return True
+
+
+def _summary(input_path, output_path, profile, pages, report, stages):
+    original_size = _size(input_path)
+    kept = _keep_original(input_path, output_path)
+    new_size = original_size if kept else _size(output_path)
+    ratio = (1 - (new_size / original_size)) * 100
+    return {
+        "success": True,
+        "original_size": original_size,
+        "compressed_size": new_size,
+        "saved_percent": f"{ratio:.2f}%",
+        "kept_original": kept,
+        "profile": profile if profile in PRINT_PROFILES else DEFAULT_PROFILE,
+        "pages": pages,
+        "images_enabled": Image is not None,
+        **report,
+        "timings": stages.report()
+    }
+
+
+def compress_pdf(input_path, output_path, profile=DEFAULT_PROFILE):
     """
     Kompresi PDF secara agresif untuk menghemat storage server.
     Cocok untuk skripsi tebal (50MB -> 5MB).
+
+    Halaman diproses satu per satu: gambar di halaman itu langsung
+    di-downsample/recompress dan hasil decode-nya dilepas sebelum lanjut,
+    jadi paling banyak satu gambar ter-decode sekaligus. Selain itu tetap
+    di memori: seluruh file input (PdfReader membacanya utuh) dan semua
+    objek output (PdfWriter menahannya sampai write()), lihat PDF_FACTOR
+    di memory_budget. Output tidak pernah lebih besar dari
+    input: kalau hasilnya tidak lebih kecil, byte input disalin apa adanya
+    (kept_original, hemat 0%).
+    input_path / output_path boleh path atau BytesIO (tahap pipeline di memori).
+    PDF besar dipecah per rentang halaman oleh worker_manager
+    (compress_range + merge_ranges), fungsi ini jalur satu proses.
     """
     try:
+        stages = _Stage()
+        settings = PRINT_PROFILES.get(profile, PRINT_PROFILES[DEFAULT_PROFILE])
+        report = _new_report()
+
+        started = time.perf_counter()
         reader = PdfReader(input_path)
         writer = PdfWriter()
+        stages.add('open', started)
 
-        for page in reader.pages:
-            # 1. Compress Content Streams (Teks & Vektor)
-            page.compress_content_streams()
-            writer.add_page(page)
+        _compress_pages(reader.pages, writer, settings, report, stages)
+        _write(writer, output_path, stages)
+        return _summary(input_path, output_path, profile, len(reader.pages), report, stages)
 
-        # 2. Kurangi Kualitas Gambar (Optional - butuh library Pillow helper)
-        # Untuk clean python, kita pakai fitur bawaan PDF structure optimization saja.
-        
-        # 3. Metadata Cleaning
-        writer.add_metadata({
-            '/Producer': 'SmartCopy AI Engine'
-        })
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+def compress_range(input_path, output_path, start, stop, profile=DEFAULT_PROFILE):
+    """
+    Sandbox entry point: kompres halaman [start, stop) ke PDF parsial.
+    Dijalankan paralel satu rentang per worker, hasilnya digabung merge_ranges.
+    """
+    try:
+        stages = _Stage()
+        settings = PRINT_PROFILES.get(profile, PRINT_PROFILES[DEFAULT_PROFILE])
+        report = _new_report()
 
+        started = time.perf_counter()
+        reader = PdfReader(input_path)
+        writer = PdfWriter()
+        stages.add('open', started)
+
+        pages = reader.pages
+        _compress_pages((pages[index] for index in range(start, min(stop, len(pages)))),
+                        writer, settings, report, stages)
+        started = time.perf_counter()
         with open(output_path, 'wb') as f:
             writer.write(f)
-            
-        original_size = os.path.getsize(input_path)
-        new_size = os.path.getsize(output_path)
-        ratio = (1 - (new_size / original_size)) * 100
-        
-        return {
-            "success": True,
-            "original_size": original_size,
-            "compressed_size": new_size,
-            "saved_percent": f"{ratio:.2f}%"
-        }
+        stages.add('write', started)
+        return {"success": True, "pages": len(writer.pages), **report, "timings": stages.report()}
+
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+def merge_ranges(part_paths, output_path, input_path, profile=DEFAULT_PROFILE, range_reports=()):
+    """
+    Sandbox entry point: gabungkan PDF parsial (urut rentang) jadi satu output.
+    Resource yang sama di beberapa rentang (logo, font) disalin ke setiap
+    PDF parsial; di sini diarahkan lagi ke satu objek sebelum ditulis.
+    Gambar & content stream sudah dikompres, jadi tidak di-decode lagi.
+    Return laporan dengan bentuk yang sama seperti compress_pdf.
+    """
+    try:
+        stages = _Stage()
+        report = _new_report()
+        for part in range_reports:
+            for key in report:
+                report[key] += part.get(key, 0)
+            for name, seconds in (part.get('timings') or {}).items():
+                # Waktu semua rentang dijumlahkan (paralel: bisa > wall time job)
+                stages.timings[f'ranges.{name}'] = stages.timings.get(f'ranges.{name}', 0.0) + seconds
+
+        seen_images = _new_seen()
+        seen_fonts = _new_seen()
+        writer = PdfWriter()
+        # Semua reader tetap hidup sampai ditulis: resource kanonik bisa
+        # berasal dari part sebelumnya (writer memetakannya per id(reader))
+        readers = []
+        pages = 0
+        for path in part_paths:
+            started = time.perf_counter()
+            reader = PdfReader(path)
+            readers.append(reader)
+            stages.add('merge_open', started)
+            started = time.perf_counter()
+            for page in reader.pages:
+                _dedupe_resources(page, '/XObject', seen_images, _stream_digest, report)
+                _dedupe_resources(page, '/Font', seen_fonts, _font_digest, report)
+                writer.add_page(page)
+                pages += 1
+            stages.add('merge', started)
+
+        _write(writer, output_path, stages)
+        summary = _summary(input_path, output_path, profile, pages, report, stages)
+        summary['ranges'] = len(part_paths)
+        return summary
 
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -0,0 +1,213 @@
+import os
+import queue
+import shlex
+import signal
+import socket
+import shutil
+import tempfile
+import threading
+import subprocess
+import time
+import http.client
+import xmlrpc.client
+
+from utils import telemetry
+
+# Perintah server konversi (unoserver >= 2.0 di python sistem yang punya `uno`)
+CONVERTER_COMMAND = os.getenv('CONVERTER_COMMAND', 'unoserver')
+CONVERTER_EXECUTABLE = os.getenv('CONVERTER_EXECUTABLE', 'libreoffice')
+# Berapa konversi boleh jalan bersamaan (= jumlah instance LibreOffice)
+CONVERTER_POOL_SIZE = int(os.getenv('CONVERTER_POOL_SIZE', '1'))
+CONVERTER_TIMEOUT = int(os.getenv('CONVERTER_TIMEOUT', '120'))
+CONVERTER_START_TIMEOUT = int(os.getenv('CONVERTER_START_TIMEOUT', '60'))
+# LibreOffice pelan-pelan bocor memori: restart berkala
+CONVERTER_MAX_JOBS = int(os.getenv('CONVERTER_MAX_JOBS', '200'))
+# Port XML-RPC instance ke-i = BASE + 2i, port UNO = BASE + 2i + 1
+CONVERTER_BASE_PORT = int(os.getenv('CONVERTER_BASE_PORT', '2003'))
+CONVERTER_PROFILE_DIR = os.getenv('CONVERTER_PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'smartcopy-lo'))
+
+CONVERTER_RESTARTS = telemetry.REGISTRY.counter(
+    'smartcopy_converter_restarts_total', 'LibreOffice converter instances restarted', ('reason',))
+
+
+class ConverterError(Exception):
+    pass
+
+
+class _TimeoutTransport(xmlrpc.client.Transport):
+    """Transport XML-RPC dengan timeout socket (ServerProxy bawaan tanpa batas)"""
+
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        connection = super().make_connection(host)
+        connection.timeout = self.timeout
+        return connection
+
+
+class _ConverterInstance:
+    """Satu proses unoserver + LibreOffice headless dengan profil & port sendiri"""
+
+    def __init__(self, index):
+        self.index = index
+        self.port = CONVERTER_BASE_PORT + 2 * index
+        self.uno_port = self.port + 1
+        self.profile_dir = os.path.join(CONVERTER_PROFILE_DIR, str(index))
+        self.process = None
+        self.jobs_done = 0
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        cmd = shlex.split(CONVERTER_COMMAND) + [
+            '--interface', '127.0.0.1', '--port', str(self.port),
+            '--uno-port', str(self.uno_port),
+            '--executable', CONVERTER_EXECUTABLE,
+            '--user-installation', self.profile_dir
+        ]
+        try:
+            # Session sendiri: unoserver + soffice bisa dibunuh sekaligus lewat process group
+            self.process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                            start_new_session=True)
+        except OSError as e:
+            raise ConverterError(f"Cannot start converter ({CONVERTER_COMMAND}): {e}")
+        self.jobs_done = 0
+
+        # Server XML-RPC baru listen setelah LibreOffice siap
+        deadline = time.monotonic() + CONVERTER_START_TIMEOUT
+        while time.monotonic() < deadline:
+            if not self.alive():
+                raise ConverterError(f"Converter exited during startup (code {self.process.returncode})")
+            try:
+                with socket.create_connection(('127.0.0.1', self.port), timeout=1):
+                    print(f"[Converter] Instance {self.index} ready on :{self.port}")
+                    return
+            except OSError:
+                time.sleep(0.25)
+        self.kill()
+        raise ConverterError(f"Converter not ready after {CONVERTER_START_TIMEOUT}s")
+
+    def kill(self):
+        if self.process is None:
+            return
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        self.process.wait()
+        self.process = None
+
+    def restart(self, reason):
+        CONVERTER_RESTARTS.inc(reason=reason)
+        self.kill()
+        # Profil bisa rusak kalau soffice dibunuh di tengah jalan
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+        self.start()
+
+    def convert(self, input_path, output_path, convert_to='pdf', timeout=CONVERTER_TIMEOUT, data=None):
+        proxy = xmlrpc.client.ServerProxy(
+            f'http://127.0.0.1:{self.port}', transport=_TimeoutTransport(timeout), allow_none=True
+        )
+        # unoserver 2.x: convert(inpath, indata, outpath, convert_to, filtername, filter_options, update_index)
+        # Tanpa outpath, hasil konversi dikirim balik sebagai bytes
+        result = proxy.convert(
+            os.path.abspath(input_path) if input_path else None,
+            xmlrpc.client.Binary(data) if data is not None else None,
+            os.path.abspath(output_path) if output_path else None,
+            convert_to, None, [], True
+        )
+        self.jobs_done += 1
+        return getattr(result, 'data', result)
+
+
+class ConverterPool:
+    """
+    Instance LibreOffice headless yang tetap hangat, dipinjam per konversi
+    (seperti SandboxPool): biaya start ~detik dibayar sekali, bukan per file.
+    - Maksimal `size` konversi bersamaan; pemanggil lain menunggu giliran
+    - Timeout -> instance dibunuh (beserta soffice) & distart ulang
+    - Instance mati / crash -> distart ulang lalu dicoba sekali lagi
+    - Instance dinyalakan saat pertama dibutuhkan
+    """
+
+    def __init__(self, size=CONVERTER_POOL_SIZE, max_jobs=CONVERTER_MAX_JOBS):
+        self.size = size
+        self.max_jobs = max_jobs
+        self.instances = [_ConverterInstance(index) for index in range(size)]
+        self._idle = queue.Queue()
+        for instance in self.instances:
+            self._idle.put(instance)
+        self._closed = False
+
+    def warm(self):
+        """Nyalakan semua instance sekarang (bukan saat konversi pertama)"""
+        for instance in self.instances:
+            if not instance.alive():
+                instance.start()
+
+    def convert(self, input_path, output_path, convert_to='pdf', timeout=CONVERTER_TIMEOUT, data=None):
+        """
+        Konversi input_path -> output_path; raise ConverterError kalau gagal.
+        Input boleh bytes (`data`, input_path=None); tanpa output_path hasilnya
+        di-return sebagai bytes. Tidak ada file antara di disk.
+        """
+        if self._closed:
+            raise ConverterError("Converter pool is closed")
+        with telemetry.span('converter_wait'):
+            instance = self._idle.get()
+        try:
+            for attempt in (1, 2):
+                if not instance.alive():
+                    if instance.process is not None:
+                        CONVERTER_RESTARTS.inc(reason='crash')
+                        instance.kill()
+                    instance.start()
+                try:
+                    with telemetry.span('converter_exec'):
+                        result = instance.convert(input_path, output_path, convert_to, timeout, data)
+                    break
+                except socket.timeout:
+                    instance.restart('timeout')
+                    raise ConverterError(f"Conversion timed out after {timeout}s")
+                except (ConnectionError, http.client.HTTPException) as e:
+                    # Instance mati di tengah jalan: nyalakan ulang, coba sekali lagi
+                    if attempt == 2:
+                        instance.restart('crash')
+                        raise ConverterError(f"Converter unavailable: {e}")
+                    CONVERTER_RESTARTS.inc(reason='crash')
+                    instance.kill()
+                except xmlrpc.client.Fault as e:
+                    # Dokumen ditolak LibreOffice; instance-nya sendiri masih sehat
+                    raise ConverterError(f"Conversion failed: {e.faultString.strip().splitlines()[-1]}")
+            if self.max_jobs and instance.jobs_done >= self.max_jobs:
+                instance.restart('recycle')
+            return result
+        finally:
+            if self._closed:
+                instance.kill()
+            else:
+                self._idle.put(instance)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().kill()
+            except queue.Empty:
+                break
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_converter_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConverterPool()
+        return _pool
@@ -0,0 +1,383 @@
+import os
+import re
+import time
+import zipfile
+import zlib
+
+from utils import telemetry
+from utils.page_counter import docx_app_pages
+
+MB = 1024 * 1024
+
+# Batas upload: di atas ini ditolak sebelum masuk sandbox
+PREFLIGHT_MAX_UNCOMPRESSED_MB = int(os.getenv('PREFLIGHT_MAX_UNCOMPRESSED_MB', '1024'))
+PREFLIGHT_MAX_PARTS = int(os.getenv('PREFLIGHT_MAX_PARTS', '10000'))
+# Rasio kompresi per part (XML docx biasa 5-30x, zip bomb ribuan x);
+# hanya dicek untuk part besar, XML kecil yang sangat repetitif itu wajar
+PREFLIGHT_MAX_RATIO = int(os.getenv('PREFLIGHT_MAX_RATIO', '200'))
+RATIO_MIN_BYTES = 8 * MB
+
+_PDF_TAIL = 4096
+_PDF_OBJECT_CHUNK = 4096
+_PDF_MAX_PREV = 32
+_XREF_STREAM_MAX = 16 * MB
+
+_ZIP_MAGIC = b'PK\x03\x04'
+_OLE_MAGIC = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+_PDF_MAGIC = b'%PDF-'
+_ENCRYPTION_INFO = 'EncryptionInfo'.encode('utf-16-le')
+
+JOBS_REJECTED = telemetry.REGISTRY.counter(
+    'smartcopy_jobs_rejected_total', 'Jobs rejected by preflight', ('reason',))
+
+# Jenis input per tipe job (tuple = salah satu; None = ikut ekstensi: .pdf -> pdf,
+# selain itu docx). convert_pdf: PDF diteruskan apa adanya, .doc lama dibuka LibreOffice
+JOB_INPUT_KINDS = {
+    'format': 'docx',
+    'scan_template': 'docx',
+    'convert_pdf': ('docx', 'pdf', 'doc'),
+    'batch_format': 'docx',
+    'compress_pdf': 'pdf',
+    'count_pages': None,
+    'pipeline': None,
+}
+
+
+class PreflightError(ValueError):
+    """Upload ditolak; reason = kode singkat untuk metrik / backend"""
+
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+
+
+def _sniff(head):
+    if head.startswith(_ZIP_MAGIC):
+        return 'zip'
+    if head.startswith(_OLE_MAGIC):
+        return 'ole'
+    # Spesifikasi PDF: header boleh didahului sampah sampai 1024 byte
+    if _PDF_MAGIC in head[:1024]:
+        return 'pdf'
+    return None
+
+
+def _ole_is_encrypted(f, head):
+    """
+    DOCX ber-password disimpan sebagai OLE compound file berisi stream
+    EncryptionInfo + EncryptedPackage. Cukup baca sektor direktori pertama.
+    """
+    sector_size = 1 << int.from_bytes(head[30:32], 'little')
+    first_dir = int.from_bytes(head[48:52], 'little')
+    if sector_size not in (512, 4096) or first_dir >= 0xFFFFFFFA:
+        return False
+    f.seek((first_dir + 1) * sector_size)
+    return _ENCRYPTION_INFO in f.read(sector_size)
+
+
+def _inspect_docx(f, size):
+    try:
+        package = zipfile.ZipFile(f)
+    except (zipfile.BadZipFile, OSError) as e:
+        raise PreflightError('corrupt', f"Corrupt DOCX (zip directory unreadable: {e})")
+    with package:
+        infos = package.infolist()
+        if len(infos) > PREFLIGHT_MAX_PARTS:
+            raise PreflightError('too_many_parts', f"DOCX has {len(infos)} parts (max {PREFLIGHT_MAX_PARTS})")
+        names = set()
+        uncompressed = xml_bytes = 0
+        for info in infos:
+            if info.flag_bits & 0x1:
+                raise PreflightError('encrypted', "DOCX is password protected")
+            names.add(info.filename)
+            uncompressed += info.file_size
+            if info.filename.endswith('.xml') or info.filename.endswith('.rels'):
+                xml_bytes += info.file_size
+            if info.file_size >= RATIO_MIN_BYTES and info.file_size > max(info.compress_size, 1) * PREFLIGHT_MAX_RATIO:
+                raise PreflightError(
+                    'zip_bomb',
+                    f"DOCX part {info.filename} expands {info.file_size // max(info.compress_size, 1)}x "
+                    f"(max {PREFLIGHT_MAX_RATIO}x)")
+        if uncompressed > PREFLIGHT_MAX_UNCOMPRESSED_MB * MB:
+            raise PreflightError(
+                'too_large', f"DOCX expands to {uncompressed // MB}MB (max {PREFLIGHT_MAX_UNCOMPRESSED_MB}MB)")
+        if '[Content_Types].xml' not in names or 'word/document.xml' not in names:
+            raise PreflightError('wrong_type', "Zip file is not a Word document (word/document.xml missing)")
+
+        try:
+            pages = docx_app_pages(package)
+        except (zipfile.BadZipFile, zlib.error, OSError, EOFError) as e:
+            raise PreflightError('corrupt', f"Corrupt DOCX (docProps/app.xml: {e})")
+    return {'kind': 'docx', 'size': size, 'pages': pages, 'parts': len(infos),
+            'uncompressed': uncompressed, 'xml_bytes': xml_bytes}
+
+
+# --- PDF: trailer + xref saja --------------------------------------------
+
+_STARTXREF_RE = re.compile(rb'startxref\s+(\d+)')
+_REF_RE = r'/%s\s+(\d+)\s+\d+\s+R'
+_INT_RE = r'/%s\s+(\d+)'
+
+
+def _dict_ref(data, key):
+    match = re.search((_REF_RE % key).encode(), data)
+    return int(match.group(1)) if match else None
+
+
+def _dict_int(data, key):
+    match = re.search((_INT_RE % key).encode(), data)
+    return int(match.group(1)) if match else None
+
+
+class _PdfXref:
+    """Lookup offset objek lewat xref table / xref stream, mengikuti /Prev (update inkremental)"""
+
+    def __init__(self, f, size, offset):
+        self.f = f
+        self.size = size
+        self.sections = []  # (offset, trailer dict bytes, kind)
+        seen = set()
+        while offset is not None and offset not in seen and len(seen) < _PDF_MAX_PREV:
+            if not 0 <= offset < size:
+                raise PreflightError('corrupt', "Corrupt PDF (xref offset outside the file)")
+            seen.add(offset)
+            trailer, kind = self._read_section(offset)
+            self.sections.append((offset, trailer, kind))
+            offset = _dict_int(trailer, 'Prev')
+        self.trailer = self.sections[0][1]
+
+    def _read_section(self, offset):
+        self.f.seek(offset)
+        chunk = self.f.read(_PDF_OBJECT_CHUNK)
+        if chunk.lstrip().startswith(b'xref'):
+            return self._table_trailer(offset), 'table'
+        if re.match(rb'\s*\d+\s+\d+\s+obj', chunk) and b'/XRef' in chunk.split(b'stream', 1)[0]:
+            return chunk.split(b'stream', 1)[0], 'stream'
+        raise PreflightError('corrupt', "Corrupt PDF (startxref does not point to an xref)")
+
+    def _table_trailer(self, offset):
+        """Dictionary trailer setelah xref table (melompati entri per subsection)"""
+        f = self.f
+        f.seek(offset)
+        f.readline()  # 'xref'
+        while True:
+            position = f.tell()
+            line = f.readline()
+            match = re.match(rb'\s*(\d+)\s+(\d+)\s*$', line)
+            if match is None:
+                f.seek(position)
+                break
+            f.seek(f.tell() + int(match.group(2)) * 20)
+        # Entri yang tidak tepat 20 byte (writer tidak standar): cari kata 'trailer' ke depan
+        data = b''
+        while len(data) < _XREF_STREAM_MAX:
+            chunk = f.read(_PDF_OBJECT_CHUNK * 16)
+            if not chunk:
+                break
+            data += chunk
+            if b'trailer' in data and b'>>' in data.split(b'trailer', 1)[1]:
+                return data.split(b'trailer', 1)[1].split(b'startxref', 1)[0]
+        raise PreflightError('corrupt', "Corrupt PDF (trailer missing)")
+
+    def _table_lookup(self, offset, number):
+        f = self.f
+        f.seek(offset)
+        f.readline()
+        while True:
+            line = f.readline()
+            match = re.match(rb'\s*(\d+)\s+(\d+)\s*$', line)
+            if match is None:
+                return None
+            start, count = int(match.group(1)), int(match.group(2))
+            if start <= number < start + count:
+                f.seek(f.tell() + (number - start) * 20)
+                entry = f.read(20).split()
+                if len(entry) >= 3 and entry[2] == b'n':
+                    return int(entry[0])
+                return None
+            f.seek(f.tell() + count * 20)
+
+    def _stream_lookup(self, offset, header, number):
+        widths = re.search(rb'/W\s*\[\s*(\d+)\s+(\d+)\s+(\d+)\s*\]', header)
+        length = _dict_int(header, 'Length')
+        # /Length sebagai referensi objek tidak diikuti
+        if widths is None or length is None or length > _XREF_STREAM_MAX or _dict_ref(header, 'Length') is not None:
+            return None
+        widths = [int(w) for w in widths.groups()]
+        index = re.search(rb'/Index\s*\[([\d\s]+)\]', header)
+        if index is not None:
+            values = [int(v) for v in index.group(1).split()]
+            ranges = list(zip(values[::2], values[1::2]))
+        else:
+            ranges = [(0, _dict_int(header, 'Size') or 0)]
+
+        self.f.seek(offset + len(header))
+        raw = self.f.read(length + 16)
+        raw = raw[raw.index(b'stream') + 6:].lstrip(b'\r\n')[:length]
+        if b'/FlateDecode' in header:
+            try:
+                raw = zlib.decompressobj().decompress(raw, _XREF_STREAM_MAX)
+            except zlib.error:
+                return None
+        columns = _dict_int(header, 'Columns')
+        if _dict_int(header, 'Predictor') not in (None, 1):
+            raw = _png_unpredict(raw, columns or sum(widths))
+            if raw is None:
+                return None
+
+        row = sum(widths)
+        position = 0
+        for start, count in ranges:
+            if start <= number < start + count:
+                entry = raw[position + (number - start) * row:position + (number - start + 1) * row]
+                if len(entry) < row:
+                    return None
+                fields, cursor = [], 0
+                for width in widths:
+                    fields.append(int.from_bytes(entry[cursor:cursor + width], 'big'))
+                    cursor += width
+                kind = fields[0] if widths[0] else 1
+                # Tipe 2 = objek di dalam object stream (terkompresi): tidak dibuka
+                return fields[1] if kind == 1 else None
+            position += count * row
+        return None
+
+    def offset(self, number):
+        for offset, trailer, kind in self.sections:
+            found = self._table_lookup(offset, number) if kind == 'table' \
+                else self._stream_lookup(offset, trailer, number)
+            if found is not None:
+                return found
+        return None
+
+    def read_object(self, number):
+        offset = self.offset(number)
+        if offset is None or not 0 <= offset < self.size:
+            return None
+        self.f.seek(offset)
+        chunk = self.f.read(_PDF_OBJECT_CHUNK)
+        if not re.match(rb'\s*%d\s+\d+\s+obj' % number, chunk):
+            return None
+        return chunk.split(b'endobj', 1)[0].split(b'stream', 1)[0]
+
+
+def _png_unpredict(data, columns):
+    """PNG predictor (Predictor >= 10) untuk xref stream; None kalau filter tidak dikenal"""
+    rows = []
+    previous = bytearray(columns)
+    stride = columns + 1
+    for start in range(0, len(data) - stride + 1, stride):
+        kind, row = data[start], bytearray(data[start + 1:start + stride])
+        if kind == 2:
+            row = bytearray((value + above) & 0xFF for value, above in zip(row, previous))
+        elif kind == 1:
+            for i in range(1, len(row)):
+                row[i] = (row[i] + row[i - 1]) & 0xFF
+        elif kind != 0:
+            return None
+        rows.append(bytes(row))
+        previous = row
+    return b''.join(rows)
+
+
+def _inspect_pdf(f, size):
+    f.seek(max(0, size - _PDF_TAIL))
+    tail = f.read(_PDF_TAIL)
+    offsets = _STARTXREF_RE.findall(tail)
+    if b'%%EOF' not in tail or not offsets:
+        raise PreflightError('corrupt', "Corrupt or truncated PDF (startxref / %%EOF missing)")
+    xref = _PdfXref(f, size, int(offsets[-1]))
+    trailer = xref.trailer
+    if b'/Encrypt' in trailer:
+        raise PreflightError('encrypted', "PDF is password protected")
+
+    # Halaman: /Root -> /Pages -> /Count (None kalau ada di object stream)
+    pages = None
+    root = _dict_ref(trailer, 'Root')
+    catalog = xref.read_object(root) if root is not None else None
+    if catalog is not None:
+        pages_ref = _dict_ref(catalog, 'Pages')
+        tree = xref.read_object(pages_ref) if pages_ref is not None else None
+        if tree is not None:
+            pages = _dict_int(tree, 'Count')
+    return {'kind': 'pdf', 'size': size, 'pages': pages, 'updates': len(xref.sections)}
+
+
+def inspect_file(path, expected=None):
+    """
+    Cek cepat satu file upload tanpa decompress isi dokumen:
+    - DOCX: central directory zip (jumlah part, ukuran asli, rasio kompresi,
+      enkripsi) + halaman dari docProps/app.xml
+    - PDF: trailer & xref (enkripsi, halaman dari page tree)
+    - DOCX ber-password (OLE) ditolak; .doc lama (OLE) hanya kalau 'doc' diterima
+    expected: 'docx' / 'pdf' / 'doc' atau tuple beberapa jenis (None = dari ekstensi).
+    Return metadata {'kind', 'size', 'pages', ...}; raise PreflightError.
+    """
+    started = time.perf_counter()
+    if not path or not os.path.isfile(path):
+        raise PreflightError('missing', f"Input file not found: {path}")
+    if expected is None:
+        expected = 'pdf' if str(path).lower().endswith('.pdf') else 'docx'
+    kinds = (expected,) if isinstance(expected, str) else tuple(expected)
+    size = os.path.getsize(path)
+    if size == 0:
+        raise PreflightError('empty', "Input file is empty")
+
+    with open(path, 'rb') as f:
+        head = f.read(1024)
+        kind = _sniff(head)
+        if kind == 'ole':
+            if _ole_is_encrypted(f, head):
+                raise PreflightError('encrypted', "DOCX is password protected")
+            if 'doc' not in kinds:
+                raise PreflightError('legacy_doc', "Legacy .doc (Word 97-2003) is not supported, save it as .docx")
+            meta = {'kind': 'doc', 'size': size, 'pages': None}
+        elif kind == 'zip' and 'docx' in kinds:
+            meta = _inspect_docx(f, size)
+        elif kind == 'pdf' and 'pdf' in kinds:
+            meta = _inspect_pdf(f, size)
+        else:
+            found = {'zip': 'a zip/DOCX file', 'pdf': 'a PDF'}.get(kind, 'an unrecognized file')
+            wanted = ' or '.join(k.upper() for k in kinds)
+            raise PreflightError('wrong_type', f"Expected a {wanted}, got {found}")
+    meta['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    return meta
+
+
+def _expected_kind(job):
+    job_type = job.get('type')
+    if job_type == 'convert_pdf' and job.get('ref'):
+        return 'docx'  # Diformat dulu dengan template: harus DOCX
+    expected = JOB_INPUT_KINDS.get(job_type)
+    if expected is None:
+        return 'pdf' if str(job.get('input')).lower().endswith('.pdf') else 'docx'
+    return expected
+
+
+def preflight_job(job):
+    """
+    Preflight semua input job (in-place): metadata di job['preflight'],
+    batch per item di item['preflight'] (item yang ditolak berisi 'error'
+    dan tidak dijalankan). grammar_check non-.docx (teks biasa) dilewati.
+    Raise PreflightError kalau job ditolak seluruhnya.
+    """
+    job_type = job.get('type')
+    if job_type == 'batch_format':
+        items = job.get('items') or []
+        rejected = 0
+        for item in items:
+            try:
+                item['preflight'] = inspect_file(item.get('input'), 'docx')
+            except PreflightError as e:
+                rejected += 1
+                item['preflight'] = {'reason': e.reason, 'error': str(e)}
+        if items and rejected == len(items):
+            first = items[0]['preflight']
+            raise PreflightError(first['reason'], f"All {len(items)} batch item(s) rejected: {first['error']}")
+        return job
+    if job_type == 'grammar_check' and not str(job.get('input') or '').lower().endswith('.docx'):
+        return job
+    if job_type not in JOB_INPUT_KINDS and job_type != 'grammar_check':
+        return job
+    job['preflight'] = inspect_file(job.get('input'), _expected_kind(job))
+    return job
@@ -0,0 +1,326 @@
+import os
+import json
+import time
+import socket
+import hashlib
+import redis
+
+from utils import telemetry
+
+VISIBILITY_TIMEOUT = int(os.getenv('JOB_VISIBILITY_TIMEOUT', '60'))
+RESULT_TTL = int(os.getenv('JOB_RESULT_TTL', '3600'))
+MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+
+RESULT_PREFIX = 'job_result:'
+LOCK_PREFIX = 'job_lock:'
+PROGRESS_PREFIX = 'job_progress:'
+
+# Kelas prioritas: slack = batas waktu default sejak enqueue (detik),
+# on_late = tindakan kalau job baru diambil setelah deadline-nya lewat:
+#   run    -> tetap dikerjakan sesuai urutan deadline
+#   demote -> dijadwalkan ulang sekali di belakang job yang masih bisa tepat waktu
+#   shed   -> tidak dikerjakan, hasil 'expired' dipublikasikan
+# Sama dengan PRIORITY_SLACK di backend/src/utils/queue.js
+PRIORITY_CLASSES = {
+    'express': {'slack': 60, 'on_late': 'run'},
+    'normal': {'slack': 600, 'on_late': 'demote'},
+    'bulk': {'slack': 3600, 'on_late': 'demote'},
+}
+DEFAULT_PRIORITY = 'normal'
+LATE_GRACE = int(os.getenv('JOB_LATE_GRACE', '30'))
+# Token bangun worker yang menunggu; cukup sebanyak worker yang mungkin idle
+WAKE_MAX = 1000
+
+
+def job_priority(job):
+    priority = job.get('priority') if isinstance(job, dict) else None
+    return priority if priority in PRIORITY_CLASSES else DEFAULT_PRIORITY
+
+
+def job_deadline(job, now=None):
+    """
+    Deadline job (epoch ms): 'deadline' dari backend, atau enqueued_at
+    (atau sekarang) + slack kelasnya. Dipakai sebagai skor antrean: deadline
+    terdekat diambil duluan, jadi job bulk yang sudah lama menunggu tetap
+    maju (aging) tanpa mendahului job express yang masih segar.
+    """
+    if isinstance(job, dict) and job.get('deadline'):
+        return float(job['deadline'])
+    enqueued_at = job.get('enqueued_at') if isinstance(job, dict) else None
+    start = float(enqueued_at) if enqueued_at else (now or time.time()) * 1000
+    return start + PRIORITY_CLASSES[job_priority(job)]['slack'] * 1000
+
+
+def _parse(raw):
+    try:
+        job = json.loads(raw)
+    except ValueError:
+        return {}
+    return job if isinstance(job, dict) else {}
+
+
+def job_key(raw, job):
+    """ID job untuk idempotensi; job tanpa id pakai hash isi payload"""
+    if isinstance(job, dict) and job.get('id') is not None:
+        return str(job['id'])
+    return 'sha1-' + hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+class ReliableQueue:
+    """
+    Queue at-least-once berprioritas di atas Redis:
+    - Antrean: sorted set '<queue>:scheduled', skor = deadline job (ms).
+      Job yang masih di-RPUSH ke list '<queue>' (backend lama) dipindah
+      ke sana saat claim.
+    - Claim: job dengan deadline terdekat dipindah atomik (WATCH/MULTI) ke
+      list '<queue>:processing'; worker yang menunggu dibangunkan lewat
+      list '<queue>:wake'
+    - Job yang sudah lewat deadline: dijalankan, diturunkan, atau dibuang
+      sesuai kelasnya (PRIORITY_CLASSES)
+    - Lease: sorted set '<queue>:leases' (score = deadline), diperpanjang
+      lewat heartbeat selama job berjalan
+    - Reaper: job di processing yang lease-nya habis (worker mati/hang)
+      dikembalikan ke antrean dengan deadline aslinya
+    - Ack: hapus dari processing + leases setelah hasil dipublikasikan
+    - Idempotensi: lock per job id + skip job yang hasil suksesnya sudah ada
+    """
+
+    def __init__(self, r, queue_name, visibility_timeout=VISIBILITY_TIMEOUT,
+                 result_ttl=RESULT_TTL, max_attempts=MAX_ATTEMPTS):
+        self.r = r
+        self.queue_name = queue_name
+        self.scheduled = f"{queue_name}:scheduled"
+        self.wake = f"{queue_name}:wake"
+        self.processing = f"{queue_name}:processing"
+        self.leases = f"{queue_name}:leases"
+        self.attempts = f"{queue_name}:attempts"
+        self.visibility_timeout = visibility_timeout
+        self.result_ttl = result_ttl
+        self.max_attempts = max_attempts
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+    # --- Claim / Ack ---------------------------------------------------
+
+    def enqueue(self, job):
+        """Masukkan job (dict) ke antrean; priority/deadline/enqueued_at dilengkapi"""
+        now = time.time()
+        job = dict(job)
+        job.setdefault('enqueued_at', int(now * 1000))
+        job['priority'] = job_priority(job)
+        job['deadline'] = job_deadline(job, now)
+        raw = json.dumps(job)
+        pipe = self.r.pipeline()
+        pipe.zadd(self.scheduled, {raw: job['deadline']})
+        pipe.rpush(self.wake, 1)
+        pipe.ltrim(self.wake, -WAKE_MAX, -1)
+        pipe.execute()
+        return raw
+
+    def absorb_legacy(self, limit=100):
+        """Pindahkan job dari list '<queue>' (RPUSH lama / requeue) ke antrean berprioritas"""
+        with self.r.pipeline() as pipe:
+            try:
+                pipe.watch(self.queue_name)
+                raws = pipe.lrange(self.queue_name, 0, limit - 1)
+                if not raws:
+                    pipe.unwatch()
+                    return 0
+                pipe.multi()
+                pipe.ltrim(self.queue_name, len(raws), -1)
+                pipe.zadd(self.scheduled, {raw: job_deadline(_parse(raw)) for raw in raws})
+                pipe.execute()
+                return len(raws)
+            except redis.WatchError:
+                return 0  # Worker lain sedang memindahkan, coba lagi di claim berikutnya
+
+    def _pop_earliest(self):
+        """(raw, skor) job dengan deadline terdekat, dipindah atomik ke processing"""
+        while True:
+            with self.r.pipeline() as pipe:
+                try:
+                    pipe.watch(self.scheduled)
+                    head = pipe.zrange(self.scheduled, 0, 0, withscores=True)
+                    if not head:
+                        pipe.unwatch()
+                        return None
+                    raw, score = head[0]
+                    pipe.multi()
+                    pipe.zrem(self.scheduled, raw)
+                    pipe.rpush(self.processing, raw)
+                    pipe.zadd(self.leases, {raw: time.time() + self.visibility_timeout})
+                    pipe.execute()
+                    return raw, score
+                except redis.WatchError:
+                    continue  # Diambil worker lain duluan, ulangi dengan head baru
+
+    def _handle_late(self, raw, score):
+        """
+        Tindakan untuk job yang lewat deadline. Return True kalau job tetap
+        dijalankan sekarang. Job yang sudah pernah diturunkan (skor != deadline)
+        tidak diturunkan lagi.
+        """
+        job = _parse(raw)
+        deadline = job_deadline(job)
+        if score != deadline or time.time() * 1000 <= deadline + LATE_GRACE * 1000:
+            return True
+        priority = job_priority(job)
+        action = job.get('on_late') or PRIORITY_CLASSES[priority]['on_late']
+        telemetry.LATE_JOBS.inc(priority=priority, action=action)
+        if action == 'shed':
+            key = job_key(raw, job)
+            self.publish_result(key, {
+                "status": "expired",
+                "error": f"Deadline passed {time.time() - deadline / 1000:.0f}s before the job was started"
+            })
+            self.ack(raw, key)
+            return False
+        if action == 'demote':
+            pipe = self.r.pipeline(transaction=True)
+            pipe.lrem(self.processing, 1, raw)
+            pipe.zrem(self.leases, raw)
+            pipe.zadd(self.scheduled, {raw: time.time() * 1000 + PRIORITY_CLASSES[priority]['slack'] * 1000})
+            pipe.execute()
+            return False
+        return True
+
+    def claim(self, timeout=5):
+        """Ambil satu job (raw string, deadline terdekat) atau None kalau antrean kosong"""
+        until = time.time() + timeout
+        while True:
+            self.absorb_legacy()
+            popped = self._pop_earliest()
+            if popped is not None:
+                if self._handle_late(*popped):
+                    return popped[0]
+                continue
+            remaining = until - time.time()
+            if remaining <= 0:
+                return None
+            # Tunggu token dari enqueue; maks 1 detik supaya list lama tetap terbaca
+            self.r.blpop(self.wake, timeout=1)
+
+    def depth(self, limit=1000):
+        """Isi antrean per kelas: {kelas: {'depth', 'overdue', 'oldest_wait'}} (sampel maks `limit`)"""
+        now_ms = time.time() * 1000
+        stats = {name: {'depth': 0, 'overdue': 0, 'oldest_wait': 0.0} for name in PRIORITY_CLASSES}
+        for raw, score in self.r.zrange(self.scheduled, 0, limit - 1, withscores=True):
+            job = _parse(raw)
+            entry = stats[job_priority(job)]
+            entry['depth'] += 1
+            if score < now_ms:
+                entry['overdue'] += 1
+            if job.get('enqueued_at'):
+                entry['oldest_wait'] = max(entry['oldest_wait'], (now_ms - float(job['enqueued_at'])) / 1000)
+        return stats
+
+    def heartbeat(self, raws):
+        """Perpanjang lease job yang masih berjalan"""
+        if not raws:
+            return
+        deadline = time.time() + self.visibility_timeout
+        self.r.zadd(self.leases, {raw: deadline for raw in raws}, xx=True)
+
+    def ack(self, raw, key=None):
+        pipe = self.r.pipeline()
+        pipe.lrem(self.processing, 1, raw)
+        pipe.zrem(self.leases, raw)
+        if key is not None:
+            pipe.hdel(self.attempts, key)
+        pipe.execute()
+
+    def record_attempt(self, key):
+        """Hitung pengiriman ulang; True kalau job masih boleh dicoba"""
+        attempts = self.r.hincrby(self.attempts, key, 1)
+        return attempts <= self.max_attempts
+
+    def requeue_expired(self):
+        """
+        Kembalikan job dari worker yang mati/hang ke antrean (skor = deadline
+        aslinya, jadi biasanya langsung di depan).
+        Job di processing tanpa lease (worker mati tepat setelah BLMOVE)
+        diberi lease baru dulu sebagai masa tenggang.
+        """
+        now = time.time()
+        return sum(self._requeue_if_expired(raw, now) for raw in self.r.lrange(self.processing, 0, -1))
+
+    def _requeue_if_expired(self, raw, now):
+        """
+        Cek lease + pindah satu job dalam satu transaksi (WATCH processing &
+        leases): ack atau heartbeat di tengah jalan membatalkan & mengulang cek,
+        jadi job yang sudah selesai tidak kembali dan tidak di-requeue dua kali.
+        """
+        while True:
+            with self.r.pipeline() as pipe:
+                try:
+                    pipe.watch(self.processing, self.leases)
+                    if pipe.lpos(self.processing, raw) is None:
+                        pipe.unwatch()
+                        return False  # Sudah di-ack / di-requeue worker lain
+                    deadline = pipe.zscore(self.leases, raw)
+                    if deadline is not None and deadline > now:
+                        pipe.unwatch()
+                        return False
+                    pipe.multi()
+                    if deadline is None:
+                        pipe.zadd(self.leases, {raw: now + self.visibility_timeout})
+                        pipe.execute()
+                        return False
+                    pipe.lrem(self.processing, 1, raw)
+                    pipe.zrem(self.leases, raw)
+                    pipe.zadd(self.scheduled, {raw: job_deadline(_parse(raw))})
+                    pipe.rpush(self.wake, 1)
+                    pipe.execute()
+                    return True
+                except redis.WatchError:
+                    continue
+
+    # --- Idempotensi ---------------------------------------------------
+
+    def acquire(self, key):
+        return bool(self.r.set(LOCK_PREFIX + key, self.worker_id,
+                               nx=True, ex=self.visibility_timeout))
+
+    def refresh_locks(self, keys):
+        pipe = self.r.pipeline()
+        for key in keys:
+            pipe.expire(LOCK_PREFIX + key, self.visibility_timeout)
+        pipe.execute()
+
+    def release(self, key):
+        self.r.delete(LOCK_PREFIX + key)
+
+    def completed(self, key):
+        """True kalau job ini sudah pernah selesai dengan sukses"""
+        stored = self.r.get(RESULT_PREFIX + key)
+        if not stored:
+            return False
+        try:
+            return json.loads(stored).get('status') == 'success'
+        except (ValueError, AttributeError):
+            return False
+
+    # --- Hasil ---------------------------------------------------------
+
+    def publish_result(self, key, result):
+        """
+        Simpan hasil di 'job_result:<id>' dan kirim ke channel pub/sub
+        dengan nama yang sama, supaya backend bisa menunggu tanpa polling.
+        """
+        payload = json.dumps({"id": key, **result}, default=str)
+        pipe = self.r.pipeline()
+        pipe.set(RESULT_PREFIX + key, payload, ex=self.result_ttl)
+        pipe.publish(RESULT_PREFIX + key, payload)
+        pipe.execute()
+
+    def publish_progress(self, key, event):
+        """
+        Event progres (mis. per item batch): disimpan di list
+        'job_progress:<id>' untuk yang telat subscribe, dan di-PUBLISH
+        ke channel dengan nama yang sama.
+        """
+        payload = json.dumps(event)
+        pipe = self.r.pipeline()
+        pipe.rpush(PROGRESS_PREFIX + key, payload)
+        pipe.expire(PROGRESS_PREFIX + key, self.result_ttl)
+        pipe.publish(PROGRESS_PREFIX + key, payload)
+        pipe.execute()
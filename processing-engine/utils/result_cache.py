@@ -0,0 +1,154 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+
+# Naikkan kalau output engine berubah -> semua hasil lama otomatis tidak terpakai
+ENGINE_VERSION = os.getenv('ENGINE_VERSION', '1')
+
+RESULT_CACHE_DIR = os.getenv('RESULT_CACHE_DIR', '/app/storage/cache/results')
+RESULT_CACHE_MAX_BYTES = int(os.getenv('RESULT_CACHE_MAX_MB', '2048')) * 1024 * 1024
+
+CACHE_PREFIX = 'result_cache:'
+
+
+def file_digest(file_path):
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class ResultCache:
+    """
+    Cache hasil job berbasis isi file (content-addressed):
+    key = hash(isi input) + jenis job + parameter (termasuk versi template)
+    + ENGINE_VERSION. File upload ulang yang identik langsung dapat hasil lama.
+
+    - Artefak output disimpan di RESULT_CACHE_DIR/<key>/
+    - Index di Redis: '<prefix>entry:<key>' (hash), LRU di sorted set
+      '<prefix>lru' (score = terakhir dipakai), total ukuran di '<prefix>bytes'
+    - Statistik hit/miss/bytes_saved di hash '<prefix>stats'
+    """
+
+    def __init__(self, r, cache_dir=RESULT_CACHE_DIR, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.r = r
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lru = f"{CACHE_PREFIX}lru"
+        self.total_bytes = f"{CACHE_PREFIX}bytes"
+        self.stats_key = f"{CACHE_PREFIX}stats"
+
+    def _entry(self, key):
+        return f"{CACHE_PREFIX}entry:{key}"
+
+    def key(self, input_path, job_type, params=None):
+        payload = json.dumps({
+            'engine': ENGINE_VERSION,
+            'type': job_type,
+            'params': params or {}
+        }, sort_keys=True)
+        sha256 = hashlib.sha256(payload.encode('utf-8'))
+        sha256.update(file_digest(input_path).encode())
+        return sha256.hexdigest()
+
+    # --- Lookup / Store ------------------------------------------------
+
+    def lookup(self, key, output_path=None, input_size=0):
+        """
+        Hasil tersimpan (dict) atau None. Kalau ada artefak, disalin ke
+        output_path milik job ini.
+        """
+        entry = self.r.hgetall(self._entry(key))
+        if not entry:
+            self.r.hincrby(self.stats_key, 'misses', 1)
+            return None
+
+        artifact = entry.get('artifact')
+        if artifact:
+            artifact_path = os.path.join(self.cache_dir, key, artifact)
+            if not output_path or not os.path.exists(artifact_path):
+                # Artefak hilang dari disk / job tidak minta output: hitung miss
+                if not os.path.exists(artifact_path):
+                    self._drop(key, int(entry.get('size', 0)))
+                self.r.hincrby(self.stats_key, 'misses', 1)
+                return None
+            shutil.copyfile(artifact_path, output_path)
+
+        self.r.zadd(self.lru, {key: time.time()})
+        pipe = self.r.pipeline()
+        pipe.hincrby(self.stats_key, 'hits', 1)
+        pipe.hincrby(self.stats_key, 'bytes_saved', input_size)
+        pipe.hincrbyfloat(self.stats_key, 'seconds_saved', float(entry.get('elapsed', 0)))
+        pipe.execute()
+        return json.loads(entry['result'])
+
+    def store(self, key, result, artifact_path=None, elapsed=0.0):
+        """Simpan hasil sukses (+ salinan artefak), lalu evict LRU kalau kepenuhan"""
+        artifact = ''
+        size = len(json.dumps(result))
+        if artifact_path:
+            target_dir = os.path.join(self.cache_dir, key)
+            os.makedirs(target_dir, exist_ok=True)
+            artifact = os.path.basename(artifact_path)
+            # Tulis atomik (tmp + rename) supaya lookup paralel tidak baca file setengah jadi
+            fd, tmp_path = tempfile.mkstemp(dir=target_dir, suffix='.tmp')
+            os.close(fd)
+            shutil.copyfile(artifact_path, tmp_path)
+            os.replace(tmp_path, os.path.join(target_dir, artifact))
+            size += os.path.getsize(artifact_path)
+
+        pipe = self.r.pipeline()
+        pipe.hset(self._entry(key), mapping={
+            'result': json.dumps(result),
+            'artifact': artifact,
+            'size': size,
+            'elapsed': round(elapsed, 3)
+        })
+        pipe.zadd(self.lru, {key: time.time()})
+        pipe.incrby(self.total_bytes, size)
+        pipe.execute()
+        self.evict()
+
+    # --- Eviction --------------------------------------------------------
+
+    def _drop(self, key, size):
+        shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+        pipe = self.r.pipeline()
+        pipe.delete(self._entry(key))
+        pipe.zrem(self.lru, key)
+        pipe.decrby(self.total_bytes, size)
+        pipe.execute()
+
+    def evict(self):
+        """Buang entry paling lama tidak dipakai sampai total <= max_bytes"""
+        evicted = 0
+        while int(self.r.get(self.total_bytes) or 0) > self.max_bytes:
+            oldest = self.r.zpopmin(self.lru, 1)
+            if not oldest:
+                break
+            key = oldest[0][0]
+            size = int(self.r.hget(self._entry(key), 'size') or 0)
+            self._drop(key, size)
+            evicted += 1
+        if evicted:
+            self.r.hincrby(self.stats_key, 'evictions', evicted)
+        return evicted
+
+    def stats(self):
+        stats = self.r.hgetall(self.stats_key)
+        hits = int(stats.get('hits', 0))
+        misses = int(stats.get('misses', 0))
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / (hits + misses), 4) if hits + misses else 0.0,
+            'bytes_saved': int(stats.get('bytes_saved', 0)),
+            'seconds_saved': round(float(stats.get('seconds_saved', 0)), 3),
+            'evictions': int(stats.get('evictions', 0)),
+            'entries': self.r.zcard(self.lru),
+            'size_bytes': int(self.r.get(self.total_bytes) or 0)
+        }
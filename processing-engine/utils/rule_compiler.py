@@ -0,0 +1,233 @@
+import math
+import re
+from types import MappingProxyType
+from collections import namedtuple
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.shared import Cm, Inches, Length, Mm, Pt
+
+from utils.style_writer import set_run_font_name
+
+ALIGNMENTS = {
+    'left': WD_ALIGN_PARAGRAPH.LEFT,
+    'center': WD_ALIGN_PARAGRAPH.CENTER,
+    'right': WD_ALIGN_PARAGRAPH.RIGHT,
+    'justify': WD_ALIGN_PARAGRAPH.JUSTIFY,
+    'distribute': WD_ALIGN_PARAGRAPH.DISTRIBUTE,
+}
+# Nilai w:jc lain yang bisa keluar dari template scanner (template_stats
+# meneruskan nilai yang tidak dikenalnya apa adanya) -> alignment terdekat
+ALIGNMENT_ALIASES = {
+    'both': 'justify',
+    'start': 'left',
+    'end': 'right',
+    'thaiDistribute': 'distribute',
+    'lowKashida': 'justify',
+    'mediumKashida': 'justify',
+    'highKashida': 'justify',
+}
+UNITS = {'cm': Cm, 'mm': Mm, 'in': Inches, 'pt': Pt}
+SECTION_KINDS = ('abstract', 'chapter_headings', 'bibliography', 'table_of_contents')
+MARGIN_SIDES = ('top', 'bottom', 'left', 'right')
+
+# Key yang boleh ada di satu rule set (global = sama + 'margins')
+RULE_KEYS = {
+    'font', 'font_size', 'font_weight', 'title_style', 'line_spacing',
+    'spacing_before', 'spacing_after', 'alignment', 'indent_first_line',
+    'indent_hanging', 'text_transform', 'max_words'
+}
+
+# Atribut yang ditulis tiap rule (RunProp / ParagraphProp.attr)
+RULE_ATTRS = {
+    'font_name': {'name'},
+    'font_size': {'size'},
+    'font_weight': {'bold'},
+    'title_style': {'italic'},
+    'line_spacing': {'line_spacing'},
+    'spacing_before': {'space_before'},
+    'spacing_after': {'space_after'},
+    'alignment': {'alignment'},
+    'indent_first_line': {'first_line_indent'},
+    'indent_hanging': {'left_indent', 'first_line_indent'},
+}
+
+_NUMBER_UNIT = re.compile(r'^([-+]?(?:\d+\.?\d*|\.\d+))\s*([a-z]*)$')
+
+# Satu properti yang ditulis: nama rule (laporan perubahan), atribut
+# EffectiveFormat / paragraph_format, nilai target yang sudah dikonversi
+RunProp = namedtuple('RunProp', ['rule', 'attr', 'value', 'setter'])
+ParagraphProp = namedtuple('ParagraphProp', ['rule', 'attr', 'value'])
+
+# Rencana satu rule set: semua nilai sudah divalidasi & dikonversi
+SectionPlan = namedtuple('SectionPlan', [
+    'run_props',        # tuple RunProp, urut: font_name, font_size, font_weight, title_style
+    'paragraph_props',  # tuple ParagraphProp
+    'targets',          # frozenset nama rule yang atributnya ditulis plan ini (untuk _overridden)
+    'uppercase',        # text_transform == 'uppercase'
+    'max_words',        # int atau None
+])
+RulePlan = namedtuple('RulePlan', [
+    'margins',   # tuple (atribut section, Length) untuk rules global
+    'sections',  # {'global' / jenis bagian: SectionPlan} (read-only), hanya yang ada di rules
+])
+
+
+class RuleError(ValueError):
+    """Rules JSON tidak valid (key, satuan, atau angka salah)"""
+
+
+def _set_size(run, value):
+    run.font.size = value
+
+
+def _set_bold(run, value):
+    run.font.bold = value
+
+
+def _set_italic(run, value):
+    run.font.italic = value
+
+
+def parse_length(value, where, default_unit='cm', allow_negative=False):
+    """'1.5cm' / '12pt' / '1in' / '25mm' / angka (default cm) -> Length"""
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise RuleError(f"{where}: expected a length like '2.5cm', got {value!r}")
+    if isinstance(value, str):
+        match = _NUMBER_UNIT.match(value.strip().lower())
+        if match is None:
+            raise RuleError(f"{where}: cannot parse length {value!r}")
+        number, unit = float(match.group(1)), match.group(2) or default_unit
+    else:
+        number, unit = float(value), default_unit
+    if unit not in UNITS:
+        raise RuleError(f"{where}: unknown unit '{unit}' (use {', '.join(UNITS)})")
+    if not math.isfinite(number) or (number < 0 and not allow_negative):
+        raise RuleError(f"{where}: invalid value {value!r}")
+    return UNITS[unit](number)
+
+
+def parse_font_size(value, where):
+    """'12pt' / 12 -> Length (pt)"""
+    size = parse_length(value, where, default_unit='pt')
+    if size <= 0:
+        raise RuleError(f"{where}: font size must be positive, got {value!r}")
+    return size
+
+
+def _parse_line_spacing(value, where):
+    try:
+        spacing = float(value)
+    except (TypeError, ValueError):
+        raise RuleError(f"{where}: line spacing must be a number, got {value!r}")
+    if isinstance(value, bool) or not math.isfinite(spacing) or spacing <= 0:
+        raise RuleError(f"{where}: invalid line spacing {value!r}")
+    return spacing
+
+
+def _choice(rules, key, choices, where, aliases=None):
+    value = rules.get(key)
+    if aliases and isinstance(value, str):
+        value = aliases.get(value, value)
+    if value is not None and (not isinstance(value, str) or value not in choices):
+        raise RuleError(f"{where}.{key}: expected one of {', '.join(sorted(choices))}, got {value!r}")
+    return value
+
+
+def compile_section(rules, where):
+    """Validasi satu rule set & ubah jadi SectionPlan"""
+    if not isinstance(rules, dict):
+        raise RuleError(f"{where}: expected an object, got {type(rules).__name__}")
+    allowed = RULE_KEYS | {'margins'} if where == 'global' else RULE_KEYS
+    unknown = sorted(set(rules) - allowed)
+    if unknown:
+        raise RuleError(f"{where}: unknown rule(s) {', '.join(unknown)}")
+
+    run_props = []
+    paragraph_props = []
+    font = rules.get('font', {})
+    if not isinstance(font, dict) or set(font) - {'name', 'size'}:
+        raise RuleError(f"{where}.font: expected {{'name', 'size'}}, got {font!r}")
+    if 'name' in font:
+        if not isinstance(font['name'], str) or not font['name'].strip():
+            raise RuleError(f"{where}.font.name: expected a font name, got {font['name']!r}")
+        run_props.append(RunProp('font_name', 'name', font['name'], set_run_font_name))
+    # font_size di level rule set menang atas font.size
+    if 'font_size' in rules:
+        size = parse_font_size(rules['font_size'], f"{where}.font_size")
+        run_props.append(RunProp('font_size', 'size', size, _set_size))
+    elif 'size' in font:
+        size = parse_font_size(font['size'], f"{where}.font.size")
+        run_props.append(RunProp('font_size', 'size', size, _set_size))
+    if _choice(rules, 'font_weight', {'bold', 'normal'}, where) == 'bold':
+        run_props.append(RunProp('font_weight', 'bold', True, _set_bold))
+    if _choice(rules, 'title_style', {'italic', 'normal'}, where) == 'italic':
+        run_props.append(RunProp('title_style', 'italic', True, _set_italic))
+
+    if 'line_spacing' in rules:
+        spacing = _parse_line_spacing(rules['line_spacing'], f"{where}.line_spacing")
+        paragraph_props.append(ParagraphProp('line_spacing', 'line_spacing', spacing))
+    for key, attr in (('spacing_before', 'space_before'), ('spacing_after', 'space_after')):
+        if key in rules:
+            paragraph_props.append(ParagraphProp(key, attr, parse_length(rules[key], f"{where}.{key}")))
+    alignment = _choice(rules, 'alignment', set(ALIGNMENTS), where, ALIGNMENT_ALIASES)
+    if alignment is not None:
+        paragraph_props.append(ParagraphProp('alignment', 'alignment', ALIGNMENTS[alignment]))
+    if 'indent_first_line' in rules:
+        indent = parse_length(rules['indent_first_line'], f"{where}.indent_first_line", allow_negative=True)
+        paragraph_props.append(ParagraphProp('indent_first_line', 'first_line_indent', indent))
+    if 'indent_hanging' in rules:
+        # Hanging indent = indent kiri + first line negatif dengan ukuran sama
+        indent = parse_length(rules['indent_hanging'], f"{where}.indent_hanging")
+        paragraph_props.append(ParagraphProp('indent_hanging', 'left_indent', indent))
+        paragraph_props.append(ParagraphProp('indent_hanging', 'first_line_indent', Length(-indent)))
+
+    max_words = rules.get('max_words')
+    if max_words is not None and (isinstance(max_words, bool) or not isinstance(max_words, int) or max_words <= 0):
+        raise RuleError(f"{where}.max_words: expected a positive integer, got {max_words!r}")
+
+    # Rule lain yang menulis atribut yang sama ikut tertimpa: indent_hanging
+    # menulis first_line_indent, jadi indent_first_line global dilewati
+    written = {prop.attr for prop in run_props} | {prop.attr for prop in paragraph_props}
+    targets = frozenset(rule for rule, attrs in RULE_ATTRS.items() if attrs & written)
+    return SectionPlan(
+        run_props=tuple(run_props),
+        paragraph_props=tuple(paragraph_props),
+        targets=targets,
+        uppercase=_choice(rules, 'text_transform', {'uppercase', 'none'}, where) == 'uppercase',
+        max_words=max_words
+    )
+
+
+def compile_rules(rules):
+    """
+    Validasi rules JSON SmartProcessor ('global' + 'sections') sekali dan
+    ubah jadi RulePlan: ukuran sudah jadi Length, line spacing sudah float,
+    tiap rule set cuma berisi properti yang memang ditulis. Loop per run
+    tinggal mengiterasi tuple, tanpa parsing / cek key.
+    Key top-level lain (mis. 'category') diabaikan.
+    Raise RuleError kalau rules tidak valid.
+    """
+    if not isinstance(rules, dict):
+        raise RuleError(f"Rules must be an object, got {type(rules).__name__}")
+    sections = {}
+    margins = ()
+    if 'global' in rules:
+        global_rules = rules['global']
+        sections['global'] = compile_section(global_rules, 'global')
+        margin_rules = global_rules.get('margins', {})
+        if not isinstance(margin_rules, dict) or set(margin_rules) - set(MARGIN_SIDES):
+            raise RuleError(f"global.margins: expected {{top, bottom, left, right}}, got {margin_rules!r}")
+        margins = tuple(
+            (f'{side}_margin', parse_length(margin_rules[side], f"global.margins.{side}"))
+            for side in MARGIN_SIDES if side in margin_rules
+        )
+
+    section_rules = rules.get('sections', {})
+    if not isinstance(section_rules, dict):
+        raise RuleError(f"sections: expected an object, got {type(section_rules).__name__}")
+    unknown = sorted(set(section_rules) - set(SECTION_KINDS))
+    if unknown:
+        raise RuleError(f"sections: unknown section(s) {', '.join(unknown)}")
+    for kind in SECTION_KINDS:
+        if kind in section_rules:
+            sections[kind] = compile_section(section_rules[kind], f"sections.{kind}")
+    return RulePlan(margins=margins, sections=MappingProxyType(sections))
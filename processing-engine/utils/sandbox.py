@@ -1,52 +1,314 @@
-import subprocess
 import tempfile
-import shutil
+import importlib
+import contextvars
+import multiprocessing
+import queue
+import threading
+import traceback
+import time
 import os
-import signal
-
-def run_in_sandbox(script_path, args, timeout=30):
-    """
-    Menjalankan script Python lain di dalam lingkungan terisolasi (Sandbox).
-    Tujuannya: Jika script error atau kena virus, sistem utama tetap aman.
-    """
-    # 1. Buat folder sementara (akan otomatis dihapus setelah selesai)
-    with tempfile.TemporaryDirectory() as sandbox_dir:
-        print(f"[Sandbox] Created isolate env: {sandbox_dir}")
-        
-        # 2. Salin script worker ke dalam sandbox
-        sandbox_script = os.path.join(sandbox_dir, os.path.basename(script_path))
-        shutil.copy2(script_path, sandbox_script)
-        
-        # 3. Siapkan Command
-        # cmd = ['python3', sandbox_script] + args
-        # Catatan: Untuk MVP, kita jalankan langsung. 
-        # Idealnya memakai Docker-in-Docker atau Chroot, tapi tempfile sudah cukup untuk level file.
-        
-        cmd = ['python', script_path] + args # Running direct for now to allow imports
-        
+from contextlib import contextmanager
+
+from utils import memory_budget, telemetry
+
+try:
+    import resource
+except ImportError:  # Non-POSIX (dev di Windows): tanpa batas memori
+    resource = None
+
+SANDBOX_POOL_SIZE = int(os.getenv('SANDBOX_POOL_SIZE', '1'))
+SANDBOX_MEMORY_MB = int(os.getenv('SANDBOX_MEMORY_MB', '1024'))
+SANDBOX_MAX_JOBS = int(os.getenv('SANDBOX_MAX_JOBS', '200'))
+# Job yang deadline-nya sudah (hampir) lewat tetap boleh menunggu worker selama ini (detik)
+SANDBOX_WAIT_MIN = float(os.getenv('SANDBOX_WAIT_MIN', '60'))
+
+# Modul berat yang di-import sekali (di proses forkserver, atau saat worker
+# lahir kalau spawn), bukan per job
+PREWARM_MODULES = [
+    'docx', 'lxml.etree', 'PyPDF2',
+    'style_applicator', 'smart_processor', 'template_scanner', 'pipeline',
+    'utils.pdf_compressor', 'utils.page_counter', 'utils.grammar_checker'
+]
+
+# (lane, deadline epoch detik) job yang sedang berjalan di context ini (lihat job_context)
+_job = contextvars.ContextVar('smartcopy_sandbox_job', default=(None, None))
+
+
+@contextmanager
+def job_context(lane, deadline=None):
+    """
+    SandboxPool.run() di dalam blok ini (termasuk thread fan-out lewat
+    telemetry.bind) hanya memakai worker milik `lane`, dan menunggu worker
+    kosong paling lama sampai `deadline`.
+    """
+    token = _job.set((lane, deadline))
+    try:
+        yield
+    finally:
+        _job.reset(token)
+
+
+def _resolve_task(target):
+    """'modul:fungsi' -> callable"""
+    module_name, func_name = target.split(':', 1)
+    return getattr(importlib.import_module(module_name), func_name)
+
+
+def _apply_limits(memory_limit_mb):
+    if resource is None or not memory_limit_mb:
+        return
+    limit = memory_limit_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _address_space():
+    """Ukuran address space proses saat ini (byte), dasar batas per job"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _current_limit():
+    """Soft limit RLIMIT_AS yang sedang berlaku (byte), 0 = tanpa batas"""
+    if resource is None:
+        return 0
+    soft = resource.getrlimit(resource.RLIMIT_AS)[0]
+    return 0 if soft == resource.RLIM_INFINITY else soft
+
+
+def _limit_job(job_limit):
+    """
+    Turunkan soft limit RLIMIT_AS untuk satu job: baseline proses + jatah job
+    (dari estimasi memori). Tidak pernah melewati hard limit pool; return
+    soft limit semula supaya bisa dikembalikan setelah job selesai.
+    """
+    if resource is None or not job_limit:
+        return None
+    soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    limit = _address_space() + job_limit
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+    return soft
+
+
+def _worker_main(conn, memory_limit_mb):
+    """
+    Loop proses worker: terima (target, args) lewat pipe, jalankan di cwd
+    sementara, kirim balik hasil terstruktur. None = perintah berhenti.
+    """
+    _apply_limits(memory_limit_mb)
+    for module_name in PREWARM_MODULES:
+        try:
+            importlib.import_module(module_name)
+        except ImportError:
+            pass
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if message is None:
+            break
+
+        target, args, options = message
+        with tempfile.TemporaryDirectory() as sandbox_dir, \
+                telemetry.trace(job_type=target) as job_trace, \
+                telemetry.profiled(options.get('profile')) as profile:
+            os.chdir(sandbox_dir)
+            telemetry.reset_peak_rss()
+            cpu_started = time.process_time()
+            previous_limit = _limit_job(options.get('memory_limit'))
+            try:
+                result = _resolve_task(target)(*args)
+                reply = {"success": True, "result": result}
+            except MemoryError:
+                limit_mb = _current_limit() // (1024 * 1024) or memory_limit_mb
+                reply = {"success": False, "error": f"Memory limit exceeded ({limit_mb}MB)", "memory_exceeded": True}
+            except Exception as e:
+                reply = {
+                    "success": False,
+                    "error": str(e),
+                    "traceback": traceback.format_exc()
+                }
+            finally:
+                os.chdir('/')
+                if previous_limit is not None:
+                    resource.setrlimit(resource.RLIMIT_AS, (previous_limit, resource.getrlimit(resource.RLIMIT_AS)[1]))
+        # Span, puncak RSS & profil ikut dikirim balik ke trace job di parent
+        reply['_telemetry'] = {
+            'spans': job_trace.to_dict()['spans'],
+            'peak_rss': telemetry.peak_rss_bytes(),
+            'cpu': time.process_time() - cpu_started,
+            'profile': profile.get('text')
+        }
+        conn.send(reply)
+
+
+class _SandboxWorker:
+    """Satu proses worker yang hidup lama + ujung pipe milik parent"""
+
+    def __init__(self, ctx, memory_limit_mb, lane):
+        self.lane = lane
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(child_conn, memory_limit_mb),
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.jobs_done = 0
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=5)
+        self.kill()
+
+
+class SandboxPool:
+    """
+    Pool proses Python yang sudah 'hangat' (python-docx, lxml sudah di-import):
+    biaya spawn + import dibayar sekali, isolasi tetap dijaga:
+    - Timeout per job -> proses dibunuh & diganti yang baru
+    - Crash -> proses diganti yang baru
+    - Batas memori (RLIMIT_AS) per proses, diperketat per job sesuai estimasi
+      memorinya: job yang lepas kendali gagal dengan MemoryError, bukan OOM container
+    - Setiap job jalan di cwd sementara yang dihapus setelahnya
+    Aman dipanggil dari banyak thread; tiap panggilan meminjam satu worker.
+    Worker dibagi per lane (`lanes`): job (dan fan-out batch / rentang PDF-nya)
+    hanya meminjam worker lane-nya sendiri, jadi satu job berat tidak bisa
+    menghabiskan worker lane quick. Menunggu worker dibatasi deadline job.
+    Worker lahir dari forkserver (proses satu thread dengan PREWARM_MODULES
+    sudah di-import), bukan fork dari parent yang punya banyak thread (lane,
+    lease, metrics, order sink): fork di tengah lock yang sedang dipegang
+    thread lain bisa membuat child deadlock. Tanpa forkserver: spawn.
+    """
+
+    def __init__(self, size=SANDBOX_POOL_SIZE, memory_limit_mb=SANDBOX_MEMORY_MB,
+                 max_jobs_per_worker=SANDBOX_MAX_JOBS, lanes=None, default_lane=None):
+        """
+        lanes: {nama_lane: jumlah_worker}; tanpa lanes = satu lane berisi `size` worker
+        default_lane: lane untuk panggilan di luar job_context() / lane tak dikenal
+        """
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            self.ctx = multiprocessing.get_context('forkserver')
+            # Berlaku sebelum forkserver jalan (pool pertama); modul yang gagal di-import dilewati
+            self.ctx.set_forkserver_preload(PREWARM_MODULES)
+        else:
+            self.ctx = multiprocessing.get_context('spawn')
+        self.memory_limit_mb = memory_limit_mb
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.lanes = {name: count for name, count in (lanes or {'default': size}).items() if count > 0}
+        self.default_lane = default_lane if default_lane in self.lanes else next(iter(self.lanes))
+        self.size = sum(self.lanes.values())
+        self._idle = {name: queue.Queue() for name in self.lanes}
+        self._lock = threading.Lock()
+        self._closed = False
+        for name, count in self.lanes.items():
+            for _ in range(count):
+                self._idle[name].put(self._spawn(name))
+        layout = ', '.join(f'{name}={count}' for name, count in self.lanes.items())
+        print(f"[Sandbox] Pool ready: {self.size} worker(s) ({layout}), {memory_limit_mb}MB cap each")
+
+    def _spawn(self, lane):
+        return _SandboxWorker(self.ctx, self.memory_limit_mb, lane)
+
+    def _lane(self):
+        lane = _job.get()[0]
+        return lane if lane in self.lanes else self.default_lane
+
+    def lane_size(self):
+        """Jumlah worker lane job saat ini: batas fan-out yang masuk akal"""
+        return self.lanes[self._lane()]
+
+    def run(self, target, args, timeout=30):
+        """
+        Jalankan `target` ('modul:fungsi') dengan `args` di salah satu worker.
+        Return: {"success": bool, "result": ..., "error": ...}
+        """
+        if self._closed:
+            return {"success": False, "error": "Sandbox pool is closed"}
+
+        job_trace = telemetry.current_trace()
+        options = {
+            'profile': job_trace.profile if job_trace is not None else None,
+            'memory_limit': memory_budget.process_limit()
+        }
+        lane, deadline = self._lane(), _job.get()[1]
+        wait = max(SANDBOX_WAIT_MIN, deadline - time.time()) if deadline else None
+        with telemetry.span('sandbox_wait'):
+            try:
+                worker = self._idle[lane].get(timeout=wait)
+            except queue.Empty:
+                return {"success": False, "error": f"No sandbox worker free in lane '{lane}' within {wait:.0f}s"}
+        started = time.perf_counter()
         try:
-            # 4. Eksekusi dengan Timeout Ketat
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=timeout,
-                cwd=sandbox_dir # Working directory dipindah ke sandbox
-            )
-            
-            return {
-                "success": result.returncode == 0,
-                "stdout": result.stdout,
-                "stderr": result.stderr
-            }
-            
-        except subprocess.TimeoutExpired:
-            return {
-                "success": False,
-                "error": f"Execution timed out after {timeout}s (Potential infinite loop/malware)"
-            }
-        except Exception as e:
-            return {
-                "success": False,
-                "error": str(e)
-            }
+            worker.conn.send((target, list(args), options))
+            if not worker.conn.poll(timeout):
+                telemetry.SANDBOX_RESPAWNS.inc(reason='timeout')
+                worker.kill()
+                worker = self._spawn(worker.lane)
+                return {
+                    "success": False,
+                    "error": f"Execution timed out after {timeout}s (Potential infinite loop/malware)"
+                }
+            reply = worker.conn.recv()
+            worker.jobs_done += 1
+            if reply.pop('memory_exceeded', False):
+                # Heap bekas MemoryError bisa terfragmentasi: ganti proses baru
+                telemetry.SANDBOX_RESPAWNS.inc(reason='memory')
+                worker.stop()
+                worker = self._spawn(worker.lane)
+        except (EOFError, BrokenPipeError, OSError):
+            exit_code = worker.process.exitcode
+            telemetry.SANDBOX_RESPAWNS.inc(reason='crash')
+            worker.kill()
+            worker = self._spawn(worker.lane)
+            return {"success": False, "error": f"Sandbox worker crashed (exit code {exit_code})"}
+        finally:
+            self._release(worker)
+
+        stats = reply.pop('_telemetry', None)
+        if job_trace is not None:
+            job_trace.add('sandbox_exec', started, time.perf_counter() - started)
+            if stats:
+                job_trace.merge(stats['spans'], started)
+                job_trace.peak_rss = max(job_trace.peak_rss, stats['peak_rss'])
+                job_trace.cpu_seconds += stats['cpu']
+                if stats['profile']:
+                    job_trace.profiles.append({'target': target, 'profile': stats['profile']})
+        return reply
+
+    def _release(self, worker):
+        if self.max_jobs_per_worker and worker.jobs_done >= self.max_jobs_per_worker:
+            # Daur ulang berkala supaya memory leak tidak menumpuk
+            telemetry.SANDBOX_RESPAWNS.inc(reason='recycle')
+            worker.stop()
+            worker = self._spawn(worker.lane)
+        if self._closed:
+            worker.stop()
+        else:
+            self._idle[worker.lane].put(worker)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+        for idle in self._idle.values():
+            while True:
+                try:
+                    idle.get_nowait().stop()
+                except queue.Empty:
+                    break
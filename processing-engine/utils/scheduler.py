@@ -0,0 +1,72 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class LaneScheduler:
+    """
+    Menjalankan banyak job sekaligus, dipisah per 'lane'.
+    Setiap lane punya slot sendiri, jadi job cepat (scan_template) tidak
+    terjebak di belakang job berat (compress_pdf) yang sedang berjalan.
+
+    Thread lane hanya ringan (I/O, menunggu hasil); kerja CPU berat dijalankan
+    di proses sandbox supaya tidak rebutan GIL.
+    """
+
+    def __init__(self, lanes, job_lanes, default_lane, max_pending=None):
+        """
+        lanes: {nama_lane: jumlah_slot}
+        job_lanes: {job_type: nama_lane}
+        max_pending: batas job yang sudah diambil dari queue tapi belum selesai
+        """
+        self.lanes = dict(lanes)
+        self.job_lanes = dict(job_lanes)
+        self.default_lane = default_lane
+        self.max_pending = max_pending or sum(self.lanes.values()) * 2
+        self._executors = {
+            name: ThreadPoolExecutor(max_workers=size, thread_name_prefix=f'lane-{name}')
+            for name, size in self.lanes.items()
+        }
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._in_flight = {name: 0 for name in self.lanes}
+
+    def lane_for(self, job_type):
+        return self.job_lanes.get(job_type, self.default_lane)
+
+    def acquire_slot(self, timeout=None):
+        """Tunggu sampai boleh mengambil job baru dari queue"""
+        return self._slots.acquire(timeout=timeout)
+
+    def release_slot(self):
+        self._slots.release()
+
+    def submit(self, job_type, fn, *args, lane=None):
+        """
+        Jalankan fn(*args) di lane milik job_type (atau `lane` kalau diberikan,
+        mis. job berukuran besar ke lane 'large').
+        Slot yang diambil lewat acquire_slot() dilepas saat job selesai.
+        """
+        lane = lane or self.lane_for(job_type)
+        with self._lock:
+            self._in_flight[lane] += 1
+
+        def _run():
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self._in_flight[lane] -= 1
+                self._slots.release()
+
+        return self._executors[lane].submit(_run)
+
+    def stats(self):
+        with self._lock:
+            return {
+                lane: {"size": self.lanes[lane], "in_flight": count}
+                for lane, count in self._in_flight.items()
+            }
+
+    def shutdown(self, wait=True):
+        for executor in self._executors.values():
+            executor.shutdown(wait=wait)
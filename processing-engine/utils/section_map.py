@@ -0,0 +1,121 @@
+import re
+
+# Keyword pembuka tiap bagian khusus (dicocokkan sebagai substring, huruf kecil)
+SECTION_KEYWORDS = {
+    'abstract': ['abstract', 'abstrak'],
+    'bibliography': ['daftar pustaka', 'bibliography', 'references', 'referensi'],
+    'table_of_contents': ['daftar isi', 'table of contents', 'contents'],
+}
+
+# Paragraf yang mengandung salah satu marker ini tidak terkena aturan global
+SECTION_MARKERS = [
+    'abstract', 'abstrak', 'bab', 'chapter',
+    'daftar pustaka', 'bibliography', 'daftar isi'
+]
+
+# "BAB I", "BAB II", "CHAPTER 1", dst. (dicocokkan pada teks huruf kecil)
+CHAPTER_RE = re.compile(r'^(bab|chapter)\s+[ivx\d]+')
+MARKER_RE = re.compile('|'.join(re.escape(m) for m in SECTION_MARKERS))
+KEYWORD_RES = {
+    kind: re.compile('|'.join(re.escape(k) for k in keywords))
+    for kind, keywords in SECTION_KEYWORDS.items()
+}
+
+BODY = 'body'
+CHAPTER_HEADING = 'chapter_heading'
+
+
+class SectionMap:
+    """
+    Hasil klasifikasi paragraf dalam satu kali jalan (single pass).
+    `doc.paragraphs` hanya dibaca sekali, semua rule applier membaca dari sini.
+    """
+
+    def __init__(self, paragraphs, texts, marked, chapters, sections, kinds):
+        self.paragraphs = paragraphs
+        self.texts = texts
+        self.marked = marked
+        self.chapters = chapters
+        self.sections = sections
+        # indeks paragraf -> tuple jenis bagian (satu paragraf bisa masuk >1 bagian)
+        self.kinds = kinds
+        self._index = {id(p): i for i, p in enumerate(paragraphs)}
+
+    def index_of(self, para):
+        """Indeks paragraf (proxy dari map ini), None kalau bukan dari map ini"""
+        return self._index.get(id(para))
+
+    def section(self, kind):
+        """Paragraf (proxy) milik bagian `kind`, urut sesuai dokumen"""
+        return [self.paragraphs[i] for i in self.sections.get(kind, [])]
+
+    def chapter_headings(self):
+        return [self.paragraphs[i] for i in self.chapters]
+
+    def unmarked(self):
+        """Paragraf tanpa marker bagian khusus (target aturan global)"""
+        return [p for p, m in zip(self.paragraphs, self.marked) if not m]
+
+
+class SectionClassifier:
+    """
+    Klasifikasi paragraf satu per satu, urut dokumen (state machine).
+    Dipakai build_section_map dan scanner template yang membaca XML
+    secara streaming (tanpa objek paragraf python-docx).
+    """
+
+    def __init__(self):
+        # state: 0 = belum ketemu, 1 = sedang mengumpulkan, 2 = selesai
+        self.state = {kind: 0 for kind in SECTION_KEYWORDS}
+
+    def classify(self, text):
+        """Return (marked, is_chapter, kinds) untuk teks paragraf berikutnya"""
+        text_lower = text.lower().strip()
+        marked = MARKER_RE.search(text_lower) is not None
+        is_chapter = CHAPTER_RE.match(text_lower) is not None
+        para_kinds = [CHAPTER_HEADING] if is_chapter else []
+
+        for kind, keyword_re in KEYWORD_RES.items():
+            current = self.state[kind]
+            if current == 0:
+                if keyword_re.search(text_lower):
+                    self.state[kind] = 1
+            elif current == 1:
+                if is_chapter:
+                    self.state[kind] = 2
+                elif text_lower:
+                    para_kinds.append(kind)
+
+        return marked, is_chapter, tuple(para_kinds) or (BODY,)
+
+
+def build_section_map(paragraphs):
+    """
+    Klasifikasi semua paragraf sekaligus.
+    Aturan deteksi sama persis dengan pencarian per-bagian yang lama:
+    - Bagian dimulai SETELAH paragraf pertama yang mengandung keyword-nya
+    - Bagian berhenti di heading BAB/CHAPTER berikutnya
+    - Paragraf kosong dilewati
+    """
+    paragraphs = list(paragraphs)
+    texts = []
+    marked = []
+    chapters = []
+    kinds = []
+    sections = {kind: [] for kind in SECTION_KEYWORDS}
+    classifier = SectionClassifier()
+
+    for index, para in enumerate(paragraphs):
+        text = para.text
+        texts.append(text)
+
+        is_marked, is_chapter, para_kinds = classifier.classify(text)
+        marked.append(is_marked)
+        if is_chapter:
+            chapters.append(index)
+        for kind in para_kinds:
+            if kind in sections:
+                sections[kind].append(index)
+        kinds.append(para_kinds)
+
+    return SectionMap(paragraphs, texts, marked, chapters, sections, kinds)
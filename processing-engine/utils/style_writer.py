@@ -0,0 +1,139 @@
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+
+from utils.effective_format import same_value
+
+# Atribut tema di w:rFonts menang atas nama font biasa, jadi ikut dibuang
+_THEME_FONT_ATTRS = ['w:asciiTheme', 'w:hAnsiTheme', 'w:eastAsiaTheme', 'w:cstheme']
+_FONT_ATTRS = ['w:ascii', 'w:hAnsi', 'w:cs']
+# Urutan child w:rPr (CT_RPr); child di luar urutan bikin Word menganggap file rusak
+_RPR_ORDER = (
+    'w:rStyle', 'w:rFonts', 'w:b', 'w:bCs', 'w:i', 'w:iCs', 'w:caps', 'w:smallCaps',
+    'w:strike', 'w:dstrike', 'w:outline', 'w:shadow', 'w:emboss', 'w:imprint',
+    'w:noProof', 'w:snapToGrid', 'w:vanish', 'w:webHidden', 'w:color', 'w:spacing',
+    'w:w', 'w:kern', 'w:position', 'w:sz', 'w:szCs', 'w:highlight', 'w:u', 'w:effect',
+    'w:bdr', 'w:shd', 'w:fitText', 'w:vertAlign', 'w:rtl', 'w:cs', 'w:em', 'w:lang',
+    'w:eastAsianLayout', 'w:specVanish', 'w:oMath', 'w:rPrChange',
+)
+
+
+def _child(parent, tag, before=()):
+    """Ambil child `tag`, buat kalau belum ada"""
+    element = parent.find(qn(tag))
+    if element is None:
+        element = OxmlElement(tag)
+        for successor in before:
+            anchor = parent.find(qn(successor))
+            if anchor is not None:
+                anchor.addprevious(element)
+                break
+        else:
+            parent.append(element)
+    return element
+
+
+def _rpr_child(r_pr, tag):
+    """Child w:rPr `tag`, kalau dibuat disisipkan sesuai urutan skema"""
+    return _child(r_pr, tag, before=_RPR_ORDER[_RPR_ORDER.index(tag) + 1:])
+
+
+def _set_rpr_font(r_pr, font_name=None, font_size=None):
+    """Tulis font/ukuran ke sebuah w:rPr; True kalau ada yang berubah"""
+    changed = False
+    if font_name is not None:
+        r_fonts = _rpr_child(r_pr, 'w:rFonts')
+        for attr in _THEME_FONT_ATTRS:
+            if r_fonts.get(qn(attr)) is not None:
+                del r_fonts.attrib[qn(attr)]
+                changed = True
+        for attr in _FONT_ATTRS:
+            if r_fonts.get(qn(attr)) != font_name:
+                r_fonts.set(qn(attr), font_name)
+                changed = True
+    if font_size is not None:
+        half_points = str(int(round(font_size.pt * 2)))
+        for tag in ('w:sz', 'w:szCs'):
+            element = _rpr_child(r_pr, tag)
+            if element.get(qn('w:val')) != half_points:
+                element.set(qn('w:val'), half_points)
+                changed = True
+    return changed
+
+
+def set_run_font_name(run, font_name):
+    """run.font.name = font_name, plus buang asciiTheme/hAnsiTheme yang akan menimpanya"""
+    run.font.name = font_name
+    r_fonts = run._r.rPr.rFonts
+    for attr in ('w:asciiTheme', 'w:hAnsiTheme'):
+        if r_fonts.get(qn(attr)) is not None:
+            del r_fonts.attrib[qn(attr)]
+
+
+def set_doc_defaults(doc, font_name=None, font_size=None):
+    """Font & ukuran default dokumen (w:docDefaults/w:rPrDefault)"""
+    styles = doc.styles.element
+    doc_defaults = styles.find(qn('w:docDefaults'))
+    if doc_defaults is None:
+        doc_defaults = OxmlElement('w:docDefaults')
+        styles.insert(0, doc_defaults)
+    r_pr_default = _child(doc_defaults, 'w:rPrDefault', before=('w:pPrDefault',))
+    r_pr = _child(r_pr_default, 'w:rPr')
+    return _set_rpr_font(r_pr, font_name, font_size)
+
+
+def set_style_format(style, fmt, font_name=None, font_size=None, line_spacing=None):
+    """
+    Samakan satu paragraph style dengan target kalau nilai efektifnya
+    (termasuk warisan base_style) berbeda. Return jumlah atribut yang diubah.
+    """
+    changed = 0
+    style_id = style.style_id
+    if font_name is not None and fmt.style_value(style_id, 'font', 'name') != font_name:
+        _set_rpr_font(style.element.get_or_add_rPr(), font_name=font_name)
+        changed += 1
+    if font_size is not None and not same_value(fmt.style_value(style_id, 'font', 'size'), font_size):
+        _set_rpr_font(style.element.get_or_add_rPr(), font_size=font_size)
+        changed += 1
+    if line_spacing is not None and not same_value(
+            fmt.style_value(style_id, 'paragraph', 'line_spacing'), line_spacing):
+        style.paragraph_format.line_spacing = line_spacing
+        changed += 1
+    return changed
+
+
+def strip_run_format(run, font_name=False, font_size=False):
+    """
+    Buang format langsung di run supaya run mewarisi style.
+    Return True kalau ada elemen yang dibuang.
+    """
+    r_pr = run._r.rPr
+    if r_pr is None:
+        return False
+    tags = []
+    if font_name:
+        tags.append('w:rFonts')
+    if font_size:
+        tags += ['w:sz', 'w:szCs']
+    removed = False
+    for tag in tags:
+        element = r_pr.find(qn(tag))
+        if element is not None:
+            r_pr.remove(element)
+            removed = True
+    if len(r_pr) == 0 and not r_pr.attrib:
+        run._r.remove(r_pr)
+    return removed
+
+
+def strip_paragraph_line_spacing(para):
+    """Buang line spacing langsung (w:spacing/@line) agar ikut style"""
+    p_pr = para._p.pPr
+    spacing = p_pr.find(qn('w:spacing')) if p_pr is not None else None
+    if spacing is None or spacing.get(qn('w:line')) is None:
+        return False
+    for attr in ('w:line', 'w:lineRule'):
+        if spacing.get(qn(attr)) is not None:
+            del spacing.attrib[qn(attr)]
+    if not spacing.attrib:
+        p_pr.remove(spacing)
+    return True
@@ -0,0 +1,403 @@
+import io
+import os
+import json
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+try:
+    import resource
+except ImportError:  # Non-Linux
+    resource = None
+
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9100'))  # 0 = endpoint mati
+TRACE_HISTORY = int(os.getenv('TRACE_HISTORY', '200'))
+PROFILE_TTL = int(os.getenv('PROFILE_TTL', '3600'))
+
+# Profil satu job: backend/ops set 'profile_job:<id>' = cpu|memory,
+# hasilnya di 'profile_result:<id>'
+PROFILE_PREFIX = 'profile_job:'
+PROFILE_RESULT_PREFIX = 'profile_result:'
+PROFILE_MODES = ('cpu', 'memory')
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+BYTES_BUCKETS = tuple(mb * 1024 * 1024 for mb in (32, 64, 128, 256, 512, 1024, 2048))
+
+
+def _label_key(label_names, labels):
+    return tuple(str(labels.get(name, '')) for name in label_names)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(label_names, values, extra=None):
+    pairs = list(zip(label_names, values)) + (extra or [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value=1, **labels):
+        key = _label_key(self.label_names, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.label_names, key)} {value:g}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._values = {}  # key -> [counts per bucket..., count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(self.label_names, labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+            state[-2] += 1
+            state[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, state):
+                    labels = _format_labels(self.label_names, key, [('le', f'{bound:g}')])
+                    lines.append(f'{self.name}_bucket{labels} {count}')
+                labels = _format_labels(self.label_names, key, [('le', '+Inf')])
+                lines.append(f'{self.name}_bucket{labels} {state[-2]}')
+                lines.append(f'{self.name}_count{_format_labels(self.label_names, key)} {state[-2]}')
+                lines.append(f'{self.name}_sum{_format_labels(self.label_names, key)} {state[-1]:g}')
+        return lines
+
+
+class Registry:
+    """Metrik in-process + collector (dipanggil saat scrape, mis. statistik Redis)"""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, *args, **kwargs):
+        metric = Counter(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kwargs):
+        metric = Histogram(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        """collector() -> iterable (nama, tipe, help, nilai); nama boleh berlabel: 'x{a="b"}'"""
+        self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collector in self.collectors:
+            try:
+                samples = list(collector())
+            except Exception as e:
+                lines.append(f'# collector error: {e}')
+                continue
+            described = set()
+            for name, kind, help_text, value in samples:
+                base = name.split('{', 1)[0]
+                if base not in described:
+                    described.add(base)
+                    lines += [f'# HELP {base} {help_text}', f'# TYPE {base} {kind}']
+                lines.append(f'{name} {value:g}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+JOBS = REGISTRY.counter('smartcopy_jobs_total', 'Jobs processed', ('type', 'status'))
+JOB_SECONDS = REGISTRY.histogram('smartcopy_job_duration_seconds', 'Job processing time', ('type',))
+QUEUE_SECONDS = REGISTRY.histogram('smartcopy_queue_wait_seconds', 'Time from enqueue to claim', ('type', 'priority'))
+DEADLINE_MISSED = REGISTRY.counter('smartcopy_deadline_missed_total', 'Jobs finished after their deadline', ('priority',))
+LATE_JOBS = REGISTRY.counter('smartcopy_late_jobs_total', 'Jobs claimed after their deadline, by action taken',
+                             ('priority', 'action'))
+STAGE_SECONDS = REGISTRY.histogram('smartcopy_stage_seconds', 'Time per traced stage', ('stage',))
+PEAK_RSS = REGISTRY.histogram('smartcopy_job_peak_rss_bytes', 'Peak RSS of the sandbox process per job',
+                              ('type',), BYTES_BUCKETS)
+BYTES_IN = REGISTRY.counter('smartcopy_bytes_in_total', 'Input bytes processed', ('type',))
+BYTES_OUT = REGISTRY.counter('smartcopy_bytes_out_total', 'Output bytes written', ('type',))
+SANDBOX_RESPAWNS = REGISTRY.counter('smartcopy_sandbox_respawns_total', 'Sandbox workers replaced', ('reason',))
+
+# Trace terakhir (untuk /traces)
+RECENT_TRACES = deque(maxlen=TRACE_HISTORY)
+
+
+class Trace:
+    """Span satu job. Aman dipakai dari beberapa thread (item batch)."""
+
+    def __init__(self, job_id=None, job_type=None, profile=None):
+        self.job_id = job_id
+        self.job_type = job_type
+        self.profile = profile
+        self.profiles = []
+        self.started_at = time.time()
+        self._origin = time.perf_counter()
+        self.spans = []
+        self.peak_rss = 0
+        self.cpu_seconds = 0.0  # CPU proses sandbox yang dipakai job ini
+        self._lock = threading.Lock()
+
+    def add(self, name, started, duration):
+        """started = perf_counter() awal span (boleh sebelum trace dimulai)"""
+        with self._lock:
+            self.spans.append({
+                'name': name,
+                'start_ms': round((started - self._origin) * 1000, 2),
+                'duration_ms': round(duration * 1000, 2)
+            })
+
+    def merge(self, spans, started, prefix=''):
+        """Span dari proses lain (sandbox), relatif terhadap `started` di proses ini"""
+        with self._lock:
+            for span_data in spans:
+                self.spans.append({
+                    'name': prefix + span_data['name'],
+                    'start_ms': round((started - self._origin) * 1000 + span_data['start_ms'], 2),
+                    'duration_ms': span_data['duration_ms']
+                })
+
+    def elapsed(self):
+        return time.perf_counter() - self._origin
+
+    def to_dict(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda item: item['start_ms'])
+        return {
+            'job_id': self.job_id,
+            'type': self.job_type,
+            'started_at': self.started_at,
+            'duration_ms': round(self.elapsed() * 1000, 2),
+            'peak_rss': self.peak_rss,
+            'cpu_ms': round(self.cpu_seconds * 1000, 2),
+            'spans': spans
+        }
+
+
+_current = contextvars.ContextVar('smartcopy_trace', default=None)
+
+
+def current_trace():
+    return _current.get()
+
+
+@contextmanager
+def trace(job_id=None, job_type=None, profile=None):
+    """Aktifkan trace baru untuk kode di dalam blok (thread/context ini)"""
+    active = Trace(job_id, job_type, profile)
+    token = _current.set(active)
+    try:
+        yield active
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def span(name):
+    """Ukur satu tahap; tanpa trace aktif cuma no-op murah"""
+    active = _current.get()
+    if active is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        active.add(name, started, time.perf_counter() - started)
+
+
+def record_span(name, duration, started=None):
+    """Span yang durasinya sudah diukur sendiri (mis. antrean, timing kompresi)"""
+    active = _current.get()
+    if active is None:
+        return
+    if started is None:
+        started = time.perf_counter() - duration
+    active.add(name, started, duration)
+
+
+def bind(fn):
+    """
+    Bungkus fn supaya jalan dengan trace aktif saat ini (untuk thread pool).
+    Seluruh context ikut (mis. batas memori job), disalin per panggilan.
+    """
+    captured = contextvars.copy_context()
+
+    def wrapper(*args, **kwargs):
+        return captured.copy().run(fn, *args, **kwargs)
+    return wrapper
+
+
+def finish_job(active, status, bytes_in=0, bytes_out=0):
+    """Catat metrik job + simpan trace-nya di riwayat"""
+    job_type = active.job_type or 'unknown'
+    JOBS.inc(type=job_type, status=status)
+    JOB_SECONDS.observe(active.elapsed(), type=job_type)
+    with active._lock:
+        spans = list(active.spans)
+    for span_data in spans:
+        STAGE_SECONDS.observe(span_data['duration_ms'] / 1000, stage=span_data['name'])
+    if active.peak_rss:
+        PEAK_RSS.observe(active.peak_rss, type=job_type)
+    if bytes_in:
+        BYTES_IN.inc(bytes_in, type=job_type)
+    if bytes_out:
+        BYTES_OUT.inc(bytes_out, type=job_type)
+    summary = active.to_dict()
+    summary['status'] = status
+    RECENT_TRACES.append(summary)
+    return summary
+
+
+# --- RSS & profiling (dipakai di proses sandbox) -------------------------
+
+def reset_peak_rss():
+    """Reset high-water mark RSS (Linux: clear_refs 5) supaya puncak terukur per job"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_bytes():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is not None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return 0
+
+
+@contextmanager
+def profiled(mode):
+    """
+    cProfile (mode 'cpu') atau tracemalloc ('memory') selama blok berjalan.
+    Hasil teks ada di output['text'] setelah blok selesai.
+    """
+    output = {}
+    if mode not in PROFILE_MODES:
+        yield output
+        return
+
+    if mode == 'cpu':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield output
+        finally:
+            profiler.disable()
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(40)
+            output['text'] = stream.getvalue()
+    else:
+        tracemalloc.start(25)
+        try:
+            yield output
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            lines = [f'traced current={current} peak={peak}']
+            lines += [str(stat) for stat in snapshot.statistics('lineno')[:30]]
+            output['text'] = '\n'.join(lines)
+
+
+# --- HTTP endpoint ---------------------------------------------------------
+
+def _handler(redis_client):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def _send(self, code, body, content_type='application/json'):
+            payload = body.encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            if url.path == '/metrics':
+                self._send(200, REGISTRY.render(), 'text/plain; version=0.0.4')
+            elif url.path == '/traces':
+                job_id = query.get('job', [None])[0]
+                traces = [t for t in list(RECENT_TRACES) if job_id is None or t['job_id'] == job_id]
+                self._send(200, json.dumps(traces))
+            elif url.path == '/profile' and redis_client is not None:
+                job_id = query.get('job', [''])[0]
+                result = redis_client.get(PROFILE_RESULT_PREFIX + job_id)
+                self._send(200 if result else 404, result or json.dumps({'error': 'No profile yet'}))
+            else:
+                self._send(404, json.dumps({'error': 'Not found'}))
+
+        def do_POST(self):
+            # POST /profile?job=<id>&mode=cpu|memory -> profil job itu (worker mana pun yang ambil)
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            job_id = query.get('job', [''])[0]
+            mode = query.get('mode', ['cpu'])[0]
+            if url.path != '/profile' or redis_client is None or not job_id or mode not in PROFILE_MODES:
+                self._send(400, json.dumps({'error': 'Use POST /profile?job=<id>&mode=cpu|memory'}))
+                return
+            redis_client.set(PROFILE_PREFIX + job_id, mode, ex=PROFILE_TTL)
+            self._send(200, json.dumps({'job': job_id, 'mode': mode, 'armed': True}))
+
+        def log_message(self, *args):
+            pass  # Scrape tiap beberapa detik: jangan penuhi log
+
+    return MetricsHandler
+
+
+def start_metrics_server(port=METRICS_PORT, redis_client=None):
+    """Endpoint /metrics, /traces, /profile di thread daemon; None kalau port 0"""
+    if not port:
+        return None
+    server = ThreadingHTTPServer(('0.0.0.0', port), _handler(redis_client))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"📈 Metrics endpoint on :{port}/metrics")
+    return server
@@ -0,0 +1,129 @@
+import os
+import copy
+import json
+import hashlib
+import tempfile
+from functools import lru_cache
+from docx.shared import Pt
+from utils.template_stats import build_rules
+
+# Naikkan kalau format hasil compile berubah -> cache lama otomatis diabaikan
+COMPILED_VERSION = 2
+
+TEMPLATE_CACHE_DIR = os.getenv('TEMPLATE_CACHE_DIR', '/app/storage/cache/templates')
+TEMPLATE_CACHE_SIZE = int(os.getenv('TEMPLATE_CACHE_SIZE', '64'))
+
+DEFAULT_FONT = 'Times New Roman'
+
+
+def compile_template(file_path):
+    """
+    Parse master .docx sekali dan ambil aturannya dalam bentuk ringkas
+    (ukuran halaman dalam EMU, aman disimpan sebagai JSON):
+    - page: margin + ukuran kertas dari section pertama
+    - font / dominant_font: font efektif terbanyak di body (berbobot karakter)
+    - rules: rules lengkap untuk SmartProcessor (global + per bagian)
+    - stats: ringkasan histogram per bagian
+    """
+    scan = build_rules(file_path)
+    page = scan['page']
+    font = scan['font']
+
+    return {
+        'version': COMPILED_VERSION,
+        'page': {key: int(value) if value is not None else None for key, value in page.items()},
+        'font': {
+            'name': font['name'],
+            'size': int(Pt(font['size'])) if font['size'] is not None else None
+        },
+        'dominant_font': font['name'],
+        'rules': scan['rules'],
+        'stats': scan['stats'],
+        'sampling': scan['sampling']
+    }
+
+
+def _file_hash(file_path):
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def _read_disk_cache(content_hash):
+    cache_path = os.path.join(TEMPLATE_CACHE_DIR, f"{content_hash}.json")
+    try:
+        with open(cache_path, 'r') as f:
+            compiled = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if compiled.get('version') != COMPILED_VERSION:
+        return None
+    return compiled
+
+
+def _write_disk_cache(content_hash, compiled):
+    """Tulis atomik (tmp + rename) supaya worker lain tidak baca file setengah jadi"""
+    try:
+        os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=TEMPLATE_CACHE_DIR, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(compiled, f)
+        os.replace(tmp_path, os.path.join(TEMPLATE_CACHE_DIR, f"{content_hash}.json"))
+    except OSError as e:
+        print(f"[TemplateCache] Disk cache unavailable: {e}")
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def _load_compiled(abs_path, mtime_ns, size):
+    # mtime_ns & size ikut jadi key LRU: file diedit -> key baru -> compile ulang
+    content_hash = _file_hash(abs_path)
+    compiled = _read_disk_cache(content_hash)
+    if compiled is None:
+        print(f"[TemplateCache] Compiling template: {abs_path}")
+        compiled = compile_template(abs_path)
+        compiled['hash'] = content_hash
+        _write_disk_cache(content_hash, compiled)
+    return compiled
+
+
+def get_compiled_rules(file_path):
+    """
+    Aturan template hasil compile, di-cache di memori (LRU, per proses)
+    dan di disk (dibagi antar worker, key = hash isi file).
+    Hasilnya dipakai bersama: jangan diubah (mutate) oleh pemanggil.
+    """
+    abs_path = os.path.abspath(file_path)
+    stat = os.stat(abs_path)
+    return _load_compiled(abs_path, stat.st_mtime_ns, stat.st_size)
+
+
+def to_scanner_rules(compiled):
+    """Skema hasil template_scanner.scan_template"""
+    page = compiled['page']
+    font = {'name': compiled['dominant_font'] or f"{DEFAULT_FONT} (Default)"}
+    if compiled['font']['size'] is not None:
+        font['size'] = f"{compiled['font']['size'] / 12700:g}pt"
+    return {
+        'margin': {
+            'top_cm': round(page['top'] / 360000, 2),
+            'bottom_cm': round(page['bottom'] / 360000, 2),
+            'left_cm': round(page['left'] / 360000, 2),
+            'right_cm': round(page['right'] / 360000, 2)
+        },
+        'font': font,
+        # Siap disimpan sebagai rules_json template
+        'rules': to_processor_rules(compiled)
+    }
+
+
+def to_processor_rules(compiled):
+    """
+    Skema rules untuk SmartProcessor ('global' + 'sections').
+    Margin ditulis dalam pt: docx menyimpan margin dalam twips, jadi pt selalu eksak.
+    Selalu salinan baru: hasil compile dipakai bersama antar job.
+    """
+    rules = copy.deepcopy(compiled['rules'])
+    rules['global'].setdefault('font', {}).setdefault('name', DEFAULT_FONT)
+    return rules
@@ -0,0 +1,328 @@
+import os
+import zipfile
+from collections import Counter
+from lxml import etree
+
+from utils.body_walker import in_fallback, paragraph_runs, runs_text
+from utils.docx_io import read_layout
+from utils.effective_format import read_theme_fonts, rpr_font_name
+from utils.rule_compiler import ALIGNMENT_ALIASES, ALIGNMENTS
+from utils.section_map import SectionClassifier, BODY, CHAPTER_HEADING
+
+_W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+# Di atas ukuran document.xml ini, format paragraf body diambil sampel
+# (setiap paragraf ke-N); teks tetap dibaca semua untuk deteksi bagian.
+TEMPLATE_SAMPLE_BYTES = int(os.getenv('TEMPLATE_SAMPLE_MB', '8')) * 1024 * 1024
+
+# Bagian hasil deteksi -> nama rule set di SmartProcessor
+SECTION_RULES = {
+    BODY: 'global',
+    CHAPTER_HEADING: 'chapter_headings',
+    'abstract': 'abstract',
+    'bibliography': 'bibliography',
+    'table_of_contents': 'table_of_contents',
+}
+
+_RUN_PROPS = ('name', 'size', 'bold')
+_PARA_PROPS = ('line_spacing', 'space_before', 'space_after', 'first_line', 'left', 'alignment')
+_FALSE = {'0', 'false', 'off', 'none'}
+
+
+def _attr(element, name):
+    return element.get(f'{_W}{name}') if element is not None else None
+
+
+class _StyleResolver:
+    """
+    Nilai efektif dari styles.xml: docDefaults -> base style -> style.
+    Hasil resolve per style (dan per pasangan paragraph/character style)
+    di-memo, jadi ribuan paragraf dengan style sama hanya di-resolve sekali.
+    """
+
+    def __init__(self, package):
+        self.theme_fonts = self._read_theme(package)
+        self.styles = {}
+        self.default_para = None
+        self.defaults = {}
+        try:
+            root = etree.fromstring(package.read('word/styles.xml'))
+        except KeyError:
+            root = None
+        if root is not None:
+            doc_defaults = root.find(f'{_W}docDefaults')
+            if doc_defaults is not None:
+                self.defaults.update(self.run_props(doc_defaults.find(f'{_W}rPrDefault/{_W}rPr')))
+                self.defaults.update(self.para_props(doc_defaults.find(f'{_W}pPrDefault/{_W}pPr')))
+            for style in root.iter(f'{_W}style'):
+                style_id = _attr(style, 'styleId')
+                props = self.run_props(style.find(f'{_W}rPr'))
+                props.update(self.para_props(style.find(f'{_W}pPr')))
+                self.styles[style_id] = (_attr(style.find(f'{_W}basedOn'), 'val'), props)
+                if _attr(style, 'type') == 'paragraph' and _attr(style, 'default') in ('1', 'true', 'on'):
+                    self.default_para = style_id
+        self._memo = {}
+
+    @staticmethod
+    def _read_theme(package):
+        """Font tema (minor/major latin) untuk rFonts/@asciiTheme"""
+        try:
+            return read_theme_fonts(package.read('word/theme/theme1.xml'))
+        except KeyError:
+            return {}
+
+    def run_props(self, r_pr):
+        props = {}
+        if r_pr is None:
+            return props
+        name = rpr_font_name(r_pr, self.theme_fonts)
+        if name:
+            props['name'] = name
+        size = _attr(r_pr.find(f'{_W}sz'), 'val')
+        if size is not None:
+            props['size'] = int(size) / 2
+        bold = r_pr.find(f'{_W}b')
+        if bold is not None:
+            props['bold'] = (_attr(bold, 'val') or 'true').lower() not in _FALSE
+        return props
+
+    @staticmethod
+    def para_props(p_pr):
+        props = {}
+        if p_pr is None:
+            return props
+        spacing = p_pr.find(f'{_W}spacing')
+        if spacing is not None:
+            line = _attr(spacing, 'line')
+            # Hanya spasi kelipatan (lineRule auto) yang setara rule line_spacing
+            if line is not None and _attr(spacing, 'lineRule') in (None, 'auto'):
+                props['line_spacing'] = round(int(line) / 240, 2)
+            for side, key in (('before', 'space_before'), ('after', 'space_after')):
+                value = _attr(spacing, side)
+                if value is not None:
+                    props[key] = int(value) / 20
+        ind = p_pr.find(f'{_W}ind')
+        if ind is not None:
+            left = _attr(ind, 'left') or _attr(ind, 'start')
+            if left is not None:
+                props['left'] = int(left) / 20
+            if _attr(ind, 'hanging') is not None:
+                props['first_line'] = -int(_attr(ind, 'hanging')) / 20
+            elif _attr(ind, 'firstLine') is not None:
+                props['first_line'] = int(_attr(ind, 'firstLine')) / 20
+        alignment = _attr(p_pr.find(f'{_W}jc'), 'val')
+        alignment = ALIGNMENT_ALIASES.get(alignment, alignment)
+        if alignment in ALIGNMENTS:  # Nilai lain (mis. numTab) dianggap tidak diatur
+            props['alignment'] = alignment
+        return props
+
+    def style_props(self, style_id):
+        """Properti gabungan rantai basedOn (tanpa docDefaults)"""
+        key = ('style', style_id)
+        if key in self._memo:
+            return self._memo[key]
+        chain = []
+        seen = set()
+        while style_id in self.styles and style_id not in seen:
+            seen.add(style_id)
+            based_on, props = self.styles[style_id]
+            chain.append(props)
+            style_id = based_on
+        merged = {}
+        for props in reversed(chain):
+            merged.update(props)
+        self._memo[key] = merged
+        return merged
+
+    def resolve(self, para_style, run_style):
+        """docDefaults <- paragraph style <- character style"""
+        key = (para_style or self.default_para, run_style)
+        if key not in self._memo:
+            merged = dict(self.defaults)
+            merged.update(self.style_props(key[0]))
+            if run_style:
+                merged.update({k: v for k, v in self.style_props(run_style).items() if k in _RUN_PROPS})
+            self._memo[key] = merged
+        return self._memo[key]
+
+
+class _Histograms:
+    """Histogram per bagian, bobot = jumlah karakter"""
+
+    def __init__(self):
+        self.sections = {}
+        self.uppercase = Counter()
+
+    def add(self, section, prop, value, weight):
+        if value is None or weight <= 0:
+            return
+        self.sections.setdefault(section, {}).setdefault(prop, Counter())[value] += weight
+
+    def mode(self, section, prop):
+        counter = self.sections.get(section, {}).get(prop)
+        return counter.most_common(1)[0][0] if counter else None
+
+    def summary(self, top=3):
+        report = {}
+        for section, props in self.sections.items():
+            report[section] = {}
+            for prop, counter in props.items():
+                total = sum(counter.values())
+                report[section][prop] = [
+                    {'value': value, 'share': round(weight / total, 3)}
+                    for value, weight in counter.most_common(top)
+                ]
+        return report
+
+
+def _scan_paragraph(p, runs, resolver, histograms, section):
+    p_pr = p.find(f'{_W}pPr')
+    para_style = _attr(p_pr.find(f'{_W}pStyle') if p_pr is not None else None, 'val')
+    base = resolver.resolve(para_style, None)
+    direct = resolver.para_props(p_pr)
+
+    chars = 0
+    for run in runs:
+        text_length = sum(len(t.text or '') for t in run.iterchildren(f'{_W}t'))
+        if not text_length:
+            continue
+        chars += text_length
+        r_pr = run.find(f'{_W}rPr')
+        run_style = _attr(r_pr.find(f'{_W}rStyle') if r_pr is not None else None, 'val')
+        props = resolver.resolve(para_style, run_style)
+        props_direct = resolver.run_props(r_pr)
+        for prop in _RUN_PROPS:
+            value = props_direct.get(prop, props.get(prop))
+            if prop == 'bold' and value is None:
+                value = False
+            histograms.add(section, prop, value, text_length)
+
+    for prop in _PARA_PROPS:
+        histograms.add(section, prop, direct.get(prop, base.get(prop)), chars)
+    return chars
+
+
+def scan_statistics(file_path, sample_bytes=TEMPLATE_SAMPLE_BYTES):
+    """
+    Satu kali jalan atas word/document.xml (iterparse): setiap paragraf
+    diklasifikasikan ke bagiannya, lalu properti efektifnya (lewat hierarki
+    style) dimasukkan ke histogram per bagian, berbobot jumlah karakter.
+    Dokumen besar: paragraf body diambil sampel setiap ke-N.
+    """
+    histograms = _Histograms()
+    classifier = SectionClassifier()
+    scanned = sampled_out = 0
+
+    with zipfile.ZipFile(file_path) as package:
+        resolver = _StyleResolver(package)
+        xml_size = package.getinfo('word/document.xml').file_size
+        stride = max(1, -(-xml_size // sample_bytes)) if sample_bytes else 1
+        body_seen = 0
+
+        with package.open('word/document.xml') as xml:
+            for _, p in etree.iterparse(xml, events=('end',), tag=f'{_W}p'):
+                # Text box bukan isi utama (dan mc:Fallback = salinan text box yang sama)
+                if p.getparent() is not None and p.getparent().tag == f'{_W}txbxContent' or in_fallback(p):
+                    continue
+                # Run milik paragraf ini saja: teks text box di dalamnya tidak ikut
+                runs = paragraph_runs(p)
+                text = runs_text(runs)
+                marked, is_chapter, kinds = classifier.classify(text)
+                if text.strip():
+                    for kind in kinds:
+                        if kind == BODY:
+                            # Judul bagian (ABSTRAK, DAFTAR PUSTAKA, ...) bukan target aturan global
+                            if marked:
+                                continue
+                            body_seen += 1
+                            if (body_seen - 1) % stride:
+                                sampled_out += 1
+                                continue
+                        section = SECTION_RULES[kind]
+                        _scan_paragraph(p, runs, resolver, histograms, section)
+                        if kind == CHAPTER_HEADING:
+                            histograms.uppercase[text.strip() == text.strip().upper()] += len(text)
+                    scanned += 1
+                p.clear()
+                # Lepas paragraf yang sudah diproses (memori tetap kecil)
+                while p.getprevious() is not None:
+                    del p.getparent()[0]
+
+    return histograms, {'paragraphs': scanned, 'stride': stride, 'skipped': sampled_out}
+
+
+def _pt(value):
+    return f"{value:g}pt"
+
+
+def _section_rules(histograms, section):
+    """Nilai terbanyak per properti -> rule dalam skema SmartProcessor"""
+    rules = {}
+    name = histograms.mode(section, 'name')
+    size = histograms.mode(section, 'size')
+    if section == 'global':
+        font = {}
+        if name:
+            font['name'] = name
+        if size:
+            font['size'] = _pt(size)
+        if font:
+            rules['font'] = font
+    else:
+        if name:
+            rules['font'] = {'name': name}
+        if size:
+            rules['font_size'] = _pt(size)
+        if histograms.mode(section, 'bold'):
+            rules['font_weight'] = 'bold'
+
+    line_spacing = histograms.mode(section, 'line_spacing')
+    if line_spacing:
+        rules['line_spacing'] = line_spacing
+    for prop, key in (('space_before', 'spacing_before'), ('space_after', 'spacing_after')):
+        value = histograms.mode(section, prop)
+        if value is not None:
+            rules[key] = _pt(value)
+    alignment = histograms.mode(section, 'alignment')
+    if alignment:
+        rules['alignment'] = alignment
+    first_line = histograms.mode(section, 'first_line')
+    if first_line:
+        if first_line < 0 and section == 'bibliography':
+            rules['indent_hanging'] = _pt(-first_line)
+        elif first_line > 0:
+            rules['indent_first_line'] = _pt(first_line)
+    return rules
+
+
+def build_rules(file_path, sample_bytes=TEMPLATE_SAMPLE_BYTES):
+    """
+    Rules lengkap (skema SmartProcessor: 'global' + 'sections') dari
+    statistik seluruh dokumen, plus ringkasan histogram untuk debugging.
+    """
+    histograms, sampling = scan_statistics(file_path, sample_bytes)
+    page = read_layout(file_path)
+
+    rules = {'global': _section_rules(histograms, 'global'), 'sections': {}}
+    rules['global']['margins'] = {
+        side: _pt(page[side] / 12700)
+        for side in ('top', 'bottom', 'left', 'right') if page[side] is not None
+    }
+    for kind, section in SECTION_RULES.items():
+        if section == 'global' or section not in histograms.sections:
+            continue
+        section_rules = _section_rules(histograms, section)
+        if section == 'chapter_headings' and histograms.uppercase[True] > histograms.uppercase[False]:
+            section_rules['text_transform'] = 'uppercase'
+        rules['sections'][section] = section_rules
+
+    return {
+        'rules': rules,
+        'page': page,
+        'font': {
+            'name': histograms.mode('global', 'name'),
+            'size': histograms.mode('global', 'size')
+        },
+        'stats': histograms.summary(),
+        'sampling': sampling
+    }
@@ -2,19 +2,413 @@ import os
 import time
 import redis
 import json
+import atexit
+import shutil
+import tempfile
+import threading
 import traceback
-from utils.sandbox import run_in_sandbox
-from utils.pdf_compressor import compress_pdf
-# Grammar checker loaded lazily to save RAM if needed, or precached
-# from utils.grammar_checker import IndoGrammarAgent
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from PyPDF2 import PdfReader
+from utils import telemetry
+from utils.reliable_queue import ReliableQueue, job_deadline, job_key, job_priority
+from utils.memory_budget import JOBS_OVERSIZED, LARGE_JOB_MB, MB, MemoryBudget, estimate_job_memory
+from utils.preflight import JOBS_REJECTED, PreflightError, preflight_job
+from utils.order_sink import OrderSink
+from utils.result_cache import ResultCache
+from utils.rule_compiler import RuleError, compile_rules
+from utils.sandbox import SandboxPool, job_context
+from utils.scheduler import LaneScheduler
+from utils.pdf_compressor import DEFAULT_PROFILE, page_ranges
+from utils.page_counter import quote_price
+from utils.pdf_converter import ConverterError, get_converter_pool
+from utils.grammar_checker import GRAMMAR_MAX_DETAILS
+from utils.template_cache import COMPILED_VERSION, get_compiled_rules, to_processor_rules
+from style_applicator import resolve_reference
+from pipeline import document_kind, plan_pipeline
 
 REDIS_URL = os.getenv('REDIS_URL', 'redis://redis:6379/0')
 QUEUE_NAME = 'smartcopy_jobs'
 
-def handle_job(job):
+# Paralelisme: default = jumlah core, bisa di-override lewat env
+WORKER_CONCURRENCY = int(os.getenv('WORKER_CONCURRENCY', '0')) or os.cpu_count() or 1
+# Berapa dokumen satu batch diproses paralel (default = semua core)
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '0')) or WORKER_CONCURRENCY
+QUICK_LANE_SIZE = int(os.getenv('QUICK_LANE_SIZE', '0')) or max(1, WORKER_CONCURRENCY // 4)
+# Job yang estimasi memorinya besar (> LARGE_JOB_MB) jalan di lane sendiri
+LARGE_LANE_SIZE = int(os.getenv('LARGE_LANE_SIZE', '1'))
+# PDF besar: berapa rentang halaman diproses paralel (default = semua core)
+PDF_PARALLEL_WORKERS = int(os.getenv('PDF_PARALLEL_WORKERS', '0')) or WORKER_CONCURRENCY
+
+# Lane per jenis job: job cepat punya slot sendiri
+LANES = {
+    'quick': QUICK_LANE_SIZE,
+    'heavy': WORKER_CONCURRENCY,
+    'large': LARGE_LANE_SIZE,
+}
+JOB_LANES = {
+    'scan_template': 'quick',
+    'count_pages': 'quick',
+    'grammar_check': 'quick',
+    'format': 'heavy',
+    'compress_pdf': 'heavy',
+    'batch_format': 'heavy',
+    'convert_pdf': 'heavy',
+    'pipeline': 'heavy',
+}
+
+# Nyalakan LibreOffice saat start (default: saat job convert pertama datang)
+CONVERTER_PREWARM = os.getenv('CONVERTER_PREWARM', '0') == '1'
+
+# Pool sandbox dibuat sekali (lazy), dipakai ulang oleh semua job.
+# Worker dibagi per lane sebanyak slot lane-nya: fan-out job heavy (batch,
+# rentang PDF) tidak bisa memakai worker lane quick / large.
+_sandbox_pool = None
+
+def get_sandbox_pool():
+    global _sandbox_pool
+    if _sandbox_pool is None:
+        _sandbox_pool = SandboxPool(lanes=LANES, default_lane='heavy')
+    return _sandbox_pool
+
+# Anggaran memori bersama semua lane (admission control per job)
+_memory_budget = None
+
+def get_memory_budget():
+    global _memory_budget
+    if _memory_budget is None:
+        _memory_budget = MemoryBudget()
+    return _memory_budget
+
+# Update tabel orders (status, page_count, price) di-batch, dibuat di main()
+_order_sink = None
+
+def record_order(key, job_data, result):
+    """Catat hasil job untuk order-nya; dipanggil sebelum ack (lihat utils/order_sink)"""
+    if _order_sink is None:
+        return
+    try:
+        _order_sink.record(key, job_data, result)
+    except Exception as e:
+        print(f"   Order update failed: {e}")
+
+def estimate_job(job):
+    """Estimasi memori job (lihat memory_budget); gagal baca file -> estimasi minimum"""
+    try:
+        return estimate_job_memory(job, BATCH_CONCURRENCY, PDF_PARALLEL_WORKERS)
+    except Exception as e:
+        print(f"   Memory estimate failed: {e}")
+        return estimate_job_memory({})
+
+def batch_rules(job):
+    """Rules batch: 'rules' eksplisit, atau template ('ref') yang di-compile sekali"""
+    rules = job.get('rules')
+    if rules:
+        return json.loads(rules) if isinstance(rules, str) else rules
+    return to_processor_rules(get_compiled_rules(resolve_reference(job.get('ref'))))
+
+def run_batch(job, progress=None):
+    """
+    Format banyak dokumen dengan satu rule set. Item dibagi ke worker
+    sandbox secara paralel; item yang gagal tidak menghentikan item lain.
+    Setiap item selesai -> progress(event).
+    """
+    items = job.get('items') or []
+    rules = batch_rules(job)
+    try:
+        # Rules salah ketahuan sekali di sini, bukan di setiap item
+        compile_rules(rules)
+    except RuleError as e:
+        return {"status": "failed", "error": f"Invalid rules: {e}", "total": len(items),
+                "succeeded": 0, "failed": len(items), "items": []}
+    check_only = bool(job.get('check_only', False))
+    use_styles = bool(job.get('use_styles', False))
+    pool = get_sandbox_pool()
+    
+    def run_item(index, item):
+        entry = {"index": index, "input": item.get('input')}
+        if item.get('id') is not None:
+            entry['id'] = item['id']
+        # Ditolak preflight: tidak dikirim ke sandbox
+        rejected = (item.get('preflight') or {}).get('error')
+        if rejected:
+            entry.update({"status": "failed", "stage": "preflight", "error": rejected})
+            return entry
+        try:
+            result = pool.run(
+                'smart_processor:process_file',
+                [item['input'], item.get('output'), rules, check_only, use_styles],
+                timeout=120
+            )
+            report = result.get('result') or {}
+            if result['success'] and report.get('success'):
+                entry.update({
+                    "status": "success",
+                    "file": report['output_path'],
+                    "compliant": report['compliant'],
+                    "changes": report['changes'],
+                    "warnings": report['warnings']
+                })
+            else:
+                entry.update({"status": "failed", "error": result.get('error') or report.get('error')})
+        except Exception as e:
+            entry.update({"status": "failed", "error": str(e)})
+        return entry
+    
+    results = [None] * len(items)
+    done = 0
+    # Thread executor tidak mewarisi context: trace job diikat ke tiap item
+    run_traced = telemetry.bind(run_item)
+    with ThreadPoolExecutor(max_workers=max(1, min(BATCH_CONCURRENCY, pool.lane_size(), len(items)))) as executor:
+        futures = {executor.submit(run_traced, index, item): index for index, item in enumerate(items)}
+        for future in as_completed(futures):
+            entry = future.result()
+            results[entry['index']] = entry
+            done += 1
+            print(f"   [{done}/{len(items)}] {entry['status']}: {entry['input']}")
+            if progress is not None:
+                try:
+                    progress({"done": done, "total": len(items), **entry})
+                except Exception as e:
+                    print(f"   Progress publish failed: {e}")
+    
+    failed = sum(1 for entry in results if entry['status'] != 'success')
+    if not items or failed == len(items):
+        status = "failed"
+    else:
+        status = "partial" if failed else "success"
+    return {
+        "status": status,
+        "total": len(items),
+        "succeeded": len(items) - failed,
+        "failed": failed,
+        "items": results
+    }
+
+def pdf_ranges(job):
+    """
+    Rentang halaman untuk jalur paralel compress/count (jumlah halaman dari
+    preflight, lihat pdf_compressor.page_ranges); None = satu proses.
+    """
+    meta = job.get('preflight') or {}
+    if meta.get('kind') != 'pdf':
+        return None
+    # Tidak lebih dari worker lane job ini (lane 'large' = biasanya satu proses)
+    workers = min(PDF_PARALLEL_WORKERS, get_sandbox_pool().lane_size())
+    return page_ranges(meta.get('pages'), meta.get('size', 0), workers)
+
+def run_ranges(target, tasks, timeout):
+    """Satu task per rentang halaman, paralel di sandbox pool; hasil urut tasks"""
+    pool = get_sandbox_pool()
+    # Thread executor tidak mewarisi context: trace & batas memori job diikat ke tiap task
+    run_traced = telemetry.bind(pool.run)
+    with ThreadPoolExecutor(max_workers=len(tasks)) as executor:
+        futures = [executor.submit(run_traced, target, args, timeout) for args in tasks]
+        return [future.result() for future in futures]
+
+def _task_result(result):
+    return result.get('result') or {"success": False, "error": result.get('error')}
+
+def run_compress(job, profile):
+    """
+    Kompres PDF. PDF besar dipecah per rentang halaman: setiap rentang
+    dikompres di worker sandbox sendiri (paralel), lalu PDF parsialnya
+    digabung jadi satu output dengan resource kembar dideduplikasi.
+    """
+    input_path = job.get('input')
+    output_path = job.get('output')
+    ranges = pdf_ranges(job)
+    if ranges is None:
+        return _task_result(get_sandbox_pool().run(
+            'utils.pdf_compressor:compress_pdf',
+            [input_path, output_path, profile],
+            timeout=300
+        ))
+    
+    print(f"   Splitting into {len(ranges)} page range(s)")
+    with tempfile.TemporaryDirectory(prefix='smartcopy-compress-') as work_dir:
+        parts = [os.path.join(work_dir, f'range-{index}.pdf') for index in range(len(ranges))]
+        with telemetry.span('compress.ranges'):
+            results = run_ranges('utils.pdf_compressor:compress_range', [
+                [input_path, part, start, stop, profile] for part, (start, stop) in zip(parts, ranges)
+            ], timeout=300)
+        reports = [_task_result(result) for result in results]
+        for (start, stop), report in zip(ranges, reports):
+            if not report['success']:
+                return {"success": False, "error": f"Pages {start + 1}-{stop}: {report['error']}"}
+        with telemetry.span('compress.merge'):
+            return _task_result(get_sandbox_pool().run(
+                'utils.pdf_compressor:merge_ranges',
+                [parts, output_path, input_path, profile, reports],
+                timeout=300
+            ))
+
+def run_count_pages(job, copies):
+    """Hitung halaman + warna; PDF besar diklasifikasi per rentang halaman secara paralel"""
+    input_path = job.get('input')
+    ranges = pdf_ranges(job)
+    if ranges is None:
+        return _task_result(get_sandbox_pool().run(
+            'utils.page_counter:count_pages',
+            [input_path, copies],
+            timeout=30
+        ))
+    
+    started = time.perf_counter()
+    print(f"   Splitting into {len(ranges)} page range(s)")
+    results = run_ranges('utils.page_counter:classify_range',
+                         [[input_path, start, stop] for start, stop in ranges], timeout=30)
+    color_pages = []
+    raster_checks = 0
+    for result in results:
+        res = _task_result(result)
+        if not res['success']:
+            return res
+        color_pages.extend(res['color_pages'])
+        raster_checks += res['raster_checks']
+    page_count = ranges[-1][1]
+    color_count = len(color_pages)
+    mono_count = page_count - color_count
+    return {
+        "success": True,
+        "page_count": page_count,
+        "color_pages": color_pages,
+        "color_count": color_count,
+        "mono_count": mono_count,
+        "estimated": False,
+        "raster_checks": raster_checks,
+        "price": quote_price(mono_count, color_count, copies),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        "ranges": len(ranges)
+    }
+
+def compress_option(job):
+    """'compress': true / nama profil -> profil kompresi, None = tanpa kompres"""
+    compress = job.get('compress')
+    if not compress:
+        return None
+    return compress if isinstance(compress, str) else DEFAULT_PROFILE
+
+def run_convert(job):
+    """
+    Dokumen -> PDF siap cetak lewat converter LibreOffice yang sudah hangat.
+    Opsional dirantai: format (ada 'ref') -> convert -> compress ('compress').
+    File antara hanya di folder temp lokal, yang ditulis ke storage cuma output akhir.
+    """
+    input_path = job.get('input')
+    output_path = job.get('output')
+    profile = compress_option(job)
+    result = {"status": "success", "file": output_path}
+    
+    with tempfile.TemporaryDirectory(prefix='smartcopy-convert-') as work_dir:
+        source = input_path
+        if job.get('ref'):
+            formatted = os.path.join(work_dir, 'formatted.docx')
+            with telemetry.span('convert.format'):
+                res = get_sandbox_pool().run(
+                    'style_applicator:apply_style',
+                    [input_path, resolve_reference(job['ref']), formatted, False],
+                    timeout=60
+                )
+            if not (res['success'] and res['result']):
+                return {"status": "failed", "stage": "format", "error": res.get('error') or 'Style applicator failed'}
+            result['format'] = {"compliant": res['result']['compliant'], "changes": res['result']['changes']}
+            source = formatted
+        
+        if source.lower().endswith('.pdf'):
+            pdf_path = source
+        else:
+            pdf_path = os.path.join(work_dir, 'converted.pdf')
+            with telemetry.span('convert.render'):
+                try:
+                    get_converter_pool().convert(source, pdf_path, timeout=job.get('timeout') or 120)
+                except ConverterError as e:
+                    return {"status": "failed", "stage": "convert", "error": str(e)}
+        
+        if profile:
+            with telemetry.span('convert.compress'):
+                res = get_sandbox_pool().run(
+                    'utils.pdf_compressor:compress_pdf',
+                    [pdf_path, output_path, profile],
+                    timeout=300
+                )
+            compressed = res.get('result') or {"success": False, "error": res.get('error')}
+            if not compressed['success']:
+                return {"status": "failed", "stage": "compress", "error": compressed['error']}
+            result['compress'] = {key: compressed[key] for key in ('profile', 'original_size', 'compressed_size', 'saved_percent')}
+            result['pages'] = compressed['pages']
+        else:
+            shutil.copyfile(pdf_path, output_path)
+            with open(output_path, 'rb') as f:
+                result['pages'] = len(PdfReader(f).pages)
+    return result
+
+def pipeline_options(job):
+    """Opsi tahap pipeline: template, rules eksplisit, dst. (sama dengan job satuannya)"""
+    rules = job.get('rules')
+    return {
+        'ref': resolve_reference(job['ref']) if job.get('ref') else None,
+        'rules': json.loads(rules) if isinstance(rules, str) else rules,
+        'use_styles': bool(job.get('use_styles', False)),
+        'copies': job.get('copies', 1),
+        'profile': job.get('profile', DEFAULT_PROFILE),
+    }
+
+def run_pipeline(job):
+    """
+    Beberapa tahap engine dalam satu job, mis.
+    ["scan_template", "format", "smart_rules", "convert", "count_pages", "compress"].
+    Tahap berurutan jalan dalam satu panggilan sandbox dengan dokumen tetap
+    di memori; antar segmen (sandbox <-> converter) yang dikirim bytes,
+    bukan file. Hanya hasil akhir yang ditulis ke 'output'.
+    """
+    stages = job.get('stages')
+    options = pipeline_options(job)
+    try:
+        segments = plan_pipeline(stages, job.get('input'), options['ref'], options['rules'])
+        if options['rules'] and 'smart_rules' in stages:
+            compile_rules(options['rules'])
+    except ValueError as e:  # Termasuk RuleError
+        return {"status": "failed", "error": str(e)}
+    
+    output_path = job.get('output')
+    result = {"status": "success", "file": output_path, "stages": {}, "timings_ms": {}}
+    timings = result['timings_ms']
+    source, kind = job.get('input'), document_kind(job.get('input'))
+    for index, (runner, names) in enumerate(segments):
+        target = output_path if index == len(segments) - 1 else None
+        if runner == 'converter':
+            started = time.perf_counter()
+            try:
+                with telemetry.span('pipeline.convert'):
+                    data = get_converter_pool().convert(
+                        source if isinstance(source, str) else None, target,
+                        timeout=job.get('timeout') or 120,
+                        data=source if isinstance(source, bytes) else None
+                    )
+            except ConverterError as e:
+                return {"status": "failed", "stage": "convert", "error": str(e), "stages": result['stages']}
+            timings['convert'] = round((time.perf_counter() - started) * 1000, 1)
+            result['stages']['convert'] = {}
+            source, kind = data, 'pdf'
+            continue
+        
+        res = get_sandbox_pool().run('pipeline:run_segment', [names, source, kind, options, target], timeout=300)
+        report = res.get('result') or {"success": False, "stage": names[0], "error": res.get('error')}
+        result['stages'].update(report.get('stages') or {})
+        for name, ms in (report.get('timings_ms') or {}).items():
+            timings[name] = round(timings.get(name, 0) + ms, 1)
+        if not report['success']:
+            return {"status": "failed", "stage": report.get('stage'), "error": report.get('error'), "stages": result['stages']}
+        if report.get('data') is not None:
+            source = report['data']
+        kind = report['kind']
+    return result
+
+def handle_job(job, progress=None):
     """
     Dispatcher utama: Membedah job dan memanggil tool yang sesuai.
     Job Format: { "type": "format", "input": "...", "ref": "...", "output": "..." }
+    progress: callback event progres (dipakai batch_format)
     """
     job_type = job.get('type')
     print(f">> [Worker] Received Job: {job_type}")
@@ -28,18 +422,26 @@ def handle_job(job):
             
             # Jalan di dalam Sandbox agar aman
             print(f"   Executing Style Applicator in Sandbox...")
-            result = run_in_sandbox(
-                '/app/style_applicator.py', 
-                [input_path, ref_path, output_path],
+            check_only = bool(job.get('check_only', False)) # True = cek kepatuhan saja
+            result = get_sandbox_pool().run(
+                'style_applicator:apply_style',
+                [input_path, resolve_reference(ref_path), output_path, check_only],
                 timeout=60
             )
             
-            if result['success']:
+            if result['success'] and result['result']:
+                report = result['result']
                 print("   ✅ Format Success!")
-                return {"status": "success", "file": output_path}
+                return {
+                    "status": "success",
+                    "file": None if check_only else output_path,
+                    "compliant": report['compliant'],
+                    "changes": report['changes']
+                }
             else:
-                print(f"   ❌ Format Failed: {result.get('error') or result.get('stderr')}")
-                return {"status": "failed", "error": result.get('error')}
+                error = result.get('error') or 'Style applicator failed'
+                print(f"   ❌ Format Failed: {error}")
+                return {"status": "failed", "error": error}
 
         # 2. JOB: SCAN TEMPLATE
         elif job_type == 'scan_template':
@@ -47,31 +449,87 @@ def handle_job(job):
             category = job.get('category', 'default')
             
             print(f"   Scanning Template ({category})...")
-            result = run_in_sandbox(
-                '/app/template_scanner.py',
-                [input_path, category],
+            result = get_sandbox_pool().run(
+                'template_scanner:scan_template',
+                [input_path],
                 timeout=30
             )
-             
-            if result['success']:
+            
+            rules = result.get('result') or {}
+            if result['success'] and 'error' not in rules:
                 print("   ✅ Scan Success!")
-                return {"status": "success", "category": category}
+                rules['category'] = category
+                return {"status": "success", "category": category, "rules": rules}
             else:
-                return {"status": "failed", "error": result.get('stderr')}
+                return {"status": "failed", "error": result.get('error') or rules.get('error')}
 
         # 3. JOB: COMPRESS PDF
         elif job_type == 'compress_pdf':
-            input_path = job.get('input')
-            output_path = job.get('output')
+            profile = job.get('profile', DEFAULT_PROFILE) # screen / ebook / print / prepress
             
-            print("   Compressing PDF...")
-            res = compress_pdf(input_path, output_path)
+            print(f"   Compressing PDF ({profile})...")
+            res = run_compress(job, profile)
             if res['success']:
                 print(f"   ✅ Compressed: {res['saved_percent']} saved")
-                return res
+                return {"status": "success", **res}
+            else:
+                return {"status": "failed", "error": res['error']}
+
+        # 4. JOB: HITUNG HALAMAN + ESTIMASI HARGA (warna vs hitam-putih)
+        elif job_type == 'count_pages':
+            copies = job.get('copies', 1)
+            
+            res = run_count_pages(job, copies)
+            if res['success']:
+                print(f"   ✅ Pages: {res['page_count']} ({res['color_count']} color), price {res['price']:.0f}")
+                return {"status": "success", **res}
             else:
                 return {"status": "failed", "error": res['error']}
 
+        # 5. JOB: CEK TATA BAHASA (seluruh dokumen, di-stream per paragraf)
+        elif job_type == 'grammar_check':
+            input_path = job.get('input')
+            max_details = job.get('max_details', GRAMMAR_MAX_DETAILS)
+            
+            result = get_sandbox_pool().run(
+                'utils.grammar_checker:check_document',
+                [input_path, max_details],
+                timeout=60
+            )
+            res = result.get('result') or {"success": False, "error": result.get('error')}
+            if res['success']:
+                print(f"   ✅ Grammar: {res['issues_count']} issue(s) in {res['words']} words")
+                return {"status": "success", **res}
+            else:
+                return {"status": "failed", "error": res['error']}
+
+        # 6. JOB: BATCH FORMAT (banyak dokumen, satu template/rules)
+        elif job_type == 'batch_format':
+            print(f"   Formatting batch of {len(job.get('items') or [])} document(s)...")
+            result = run_batch(job, progress)
+            print(f"   ✅ Batch: {result['succeeded']}/{result['total']} succeeded")
+            return result
+
+        # 7. JOB: KONVERSI KE PDF (opsional format -> convert -> compress)
+        elif job_type == 'convert_pdf':
+            print(f"   Converting to PDF{' (format first)' if job.get('ref') else ''}...")
+            result = run_convert(job)
+            if result['status'] == 'success':
+                print(f"   ✅ Converted: {result['pages']} page(s)")
+            else:
+                print(f"   ❌ Convert Failed ({result['stage']}): {result['error']}")
+            return result
+
+        # 8. JOB: PIPELINE (beberapa tahap, dokumen tetap di memori antar tahap)
+        elif job_type == 'pipeline':
+            print(f"   Running pipeline: {' -> '.join(map(str, job.get('stages') or []))}")
+            result = run_pipeline(job)
+            if result['status'] == 'success':
+                print(f"   ✅ Pipeline done: {result['timings_ms']}")
+            else:
+                print(f"   ❌ Pipeline Failed ({result.get('stage') or 'plan'}): {result['error']}")
+            return result
+
         else:
             return {"status": "failed", "error": "Unknown Job Type"}
 
@@ -80,37 +538,373 @@ def handle_job(job):
         traceback.print_exc()
         return {"status": "error", "message": str(e)}
 
+def cache_params(job):
+    """
+    Parameter yang ikut menentukan hasil job (bagian dari key cache).
+    None = jenis job ini tidak di-cache.
+    """
+    job_type = job.get('type')
+    if job_type == 'format':
+        compiled = get_compiled_rules(resolve_reference(job.get('ref')))
+        return {
+            'template': compiled['hash'],
+            'compiled': COMPILED_VERSION,
+            'check_only': bool(job.get('check_only', False))
+        }
+    if job_type == 'scan_template':
+        return {'category': job.get('category', 'default')}
+    if job_type == 'compress_pdf':
+        return {'profile': job.get('profile', DEFAULT_PROFILE)}
+    if job_type == 'count_pages':
+        return {'copies': job.get('copies', 1)}
+    if job_type == 'grammar_check':
+        return {'max_details': job.get('max_details', GRAMMAR_MAX_DETAILS)}
+    if job_type == 'convert_pdf':
+        params = {'compress': compress_option(job)}
+        if job.get('ref'):
+            params['template'] = get_compiled_rules(resolve_reference(job['ref']))['hash']
+            params['compiled'] = COMPILED_VERSION
+        return params
+    if job_type == 'pipeline':
+        options = pipeline_options(job)
+        params = {key: options[key] for key in ('rules', 'use_styles', 'copies', 'profile')}
+        params['stages'] = job.get('stages')
+        if options['ref']:
+            params['template'] = get_compiled_rules(options['ref'])['hash']
+            params['compiled'] = COMPILED_VERSION
+        return params
+    return None
+
+def cache_artifact(job):
+    """File output job yang ikut disimpan di cache (None = hasil JSON saja)"""
+    if job.get('type') == 'format' and not job.get('check_only'):
+        return job.get('output')
+    if job.get('type') in ('compress_pdf', 'convert_pdf', 'pipeline'):
+        return job.get('output')
+    return None
+
+def process_job(job, cache=None, progress=None):
+    """handle_job + cache hasil berbasis isi file: upload ulang yang identik tidak diproses lagi"""
+    key = None
+    artifact = cache_artifact(job)
+    if cache is not None and job.get('input') and not job.get('no_cache'):
+        try:
+            params = cache_params(job)
+            if params is not None:
+                key = cache.key(job['input'], job.get('type'), params)
+                with telemetry.span('cache_lookup'):
+                    cached = cache.lookup(key, artifact, os.path.getsize(job['input']))
+                if cached is not None:
+                    print(f"   ⚡ Cache hit ({job.get('type')})")
+                    if cached.get('file'):
+                        cached['file'] = artifact
+                    cached['cached'] = True
+                    return cached
+        except Exception as e:
+            print(f"   Result cache unavailable: {e}")
+            key = None
+    
+    started = time.perf_counter()
+    with telemetry.span('handle'):
+        result = handle_job(job, progress)
+    if key is not None and result.get('status') == 'success':
+        try:
+            cache.store(key, result, artifact, time.perf_counter() - started)
+        except Exception as e:
+            print(f"   Result cache store failed: {e}")
+    return result
+
+# Job yang sedang berjalan: job_key -> raw payload (refresh lock idempotensi)
+_in_flight = {}
+# Job yang sudah di-claim tapi belum selesai (antre di lane, menunggu jatah
+# memori, atau berjalan): raw -> jumlah. Lease semuanya diperpanjang heartbeat,
+# supaya job yang masih antre tidak dikembalikan reaper lalu jalan dua kali.
+_claimed = {}
+_in_flight_lock = threading.Lock()
+
+def hold_claim(raw):
+    with _in_flight_lock:
+        _claimed[raw] = _claimed.get(raw, 0) + 1
+
+def drop_claim(raw):
+    """Job sudah di-ack (atau gagal sebelum ack: lease dibiarkan habis, reaper yang mengembalikan)"""
+    with _in_flight_lock:
+        count = _claimed.pop(raw, 0) - 1
+        if count > 0:
+            _claimed[raw] = count
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path) if path else 0
+    except OSError:
+        return 0
+
+def _job_bytes(job, result):
+    """(bytes input, bytes output) untuk metrik throughput"""
+    items = job.get('items') or [job]
+    bytes_in = sum(_file_size(item.get('input')) for item in items)
+    if job.get('type') == 'batch_format':
+        outputs = [entry.get('file') for entry in result.get('items') or []]
+    else:
+        outputs = [job.get('output')] if result.get('status') == 'success' else []
+    return bytes_in, sum(_file_size(path) for path in outputs)
+
+def _profile_mode(jobs, key):
+    """Mode profil yang di-arm lewat POST /profile (None = tidak diprofil)"""
+    try:
+        return jobs.r.get(telemetry.PROFILE_PREFIX + key)
+    except Exception:
+        return None
+
+def _finish_trace(jobs, key, job_data, job_trace, result):
+    status = result.get('status', 'unknown')
+    bytes_in, bytes_out = _job_bytes(job_data, result)
+    summary = telemetry.finish_job(job_trace, status, bytes_in, bytes_out)
+    stages = {}
+    for span_data in summary['spans']:
+        stages[span_data['name']] = round(stages.get(span_data['name'], 0) + span_data['duration_ms'], 2)
+    # Satu baris JSON per job: gampang di-grep / di-ingest log collector
+    print("   trace " + json.dumps({
+        'job': key, 'type': summary['type'], 'status': status,
+        'ms': summary['duration_ms'], 'peak_rss': summary['peak_rss'],
+        'bytes_in': bytes_in, 'bytes_out': bytes_out, 'stages_ms': stages
+    }))
+    if job_trace.profiles:
+        try:
+            pipe = jobs.r.pipeline()
+            pipe.set(telemetry.PROFILE_RESULT_PREFIX + key, json.dumps({
+                'job': key, 'mode': job_trace.profile, 'trace': summary, 'profiles': job_trace.profiles
+            }), ex=telemetry.PROFILE_TTL)
+            pipe.delete(telemetry.PROFILE_PREFIX + key)
+            pipe.execute()
+        except Exception as e:
+            print(f"   Profile store failed: {e}")
+
+def run_job(jobs, raw, job_data, cache=None, claimed_at=None, estimate=None, lane=None):
+    """Dijalankan di thread lane: jatah memori -> idempotensi -> proses -> publish -> ack"""
+    try:
+        # Worker sandbox dipinjam dari lane job ini, ditunggu paling lama sampai deadline-nya
+        with job_context(lane, job_deadline(job_data) / 1000):
+            return _traced_job(jobs, raw, job_data, cache, claimed_at, estimate)
+    finally:
+        drop_claim(raw)
+
+def _traced_job(jobs, raw, job_data, cache, claimed_at, estimate):
+    key = job_key(raw, job_data)
+    with telemetry.trace(key, job_data.get('type'), _profile_mode(jobs, key)) as job_trace:
+        # Waktu antre: enqueue (backend, epoch ms) -> claim, lalu claim -> slot lane
+        if claimed_at is not None:
+            now, now_perf = time.time(), time.perf_counter()
+            enqueued_at = job_data.get('enqueued_at')
+            if enqueued_at:
+                waited = max(0.0, claimed_at - enqueued_at / 1000)
+                telemetry.QUEUE_SECONDS.observe(waited, type=job_trace.job_type or 'unknown',
+                                                priority=job_priority(job_data))
+                telemetry.record_span('queue_wait', waited, now_perf - (now - enqueued_at / 1000))
+            telemetry.record_span('lane_wait', max(0.0, now - claimed_at))
+        with get_memory_budget().reserve(estimate or estimate_job(job_data)):
+            result = _run_job(jobs, raw, job_data, key, cache)
+        if result is not None:
+            _finish_trace(jobs, key, job_data, job_trace, result)
+            if job_data.get('deadline') and time.time() * 1000 > job_deadline(job_data):
+                telemetry.DEADLINE_MISSED.inc(priority=job_priority(job_data))
+        return result
+
+def _run_job(jobs, raw, job_data, key, cache):
+    """Isi run_job; None = job dilewati (sudah selesai / duplikat)"""
+    if jobs.completed(key):
+        print(f"   Job {key} already completed, skipping")
+        jobs.ack(raw, key)
+        return None
+    if not jobs.acquire(key):
+        # Salinan lain sedang diproses worker lain. Jangan di-ack: kalau salinan
+        # ini hasil reaper, entri processing milik pemegang lock sudah hilang dan
+        # job lenyap kalau pemegangnya mati. Dibiarkan di processing tanpa
+        # heartbeat: ack pemegang ikut menghapusnya, kalau pemegang mati lease
+        # habis dan reaper mengembalikannya ke antrean.
+        print(f"   Job {key} is running elsewhere, leaving duplicate to the lease reaper")
+        return None
+    
+    with _in_flight_lock:
+        _in_flight[key] = raw
+    try:
+        if jobs.record_attempt(key):
+            result = process_job(job_data, cache, lambda event: jobs.publish_progress(key, event))
+        else:
+            result = {"status": "failed", "error": f"Gave up after {jobs.max_attempts} attempts"}
+        with telemetry.span('publish'):
+            jobs.publish_result(key, result)
+            record_order(key, job_data, result)
+            jobs.ack(raw, key)
+        return result
+    finally:
+        with _in_flight_lock:
+            _in_flight.pop(key, None)
+        jobs.release(key)
+
+def preflight(jobs, raw, job_data):
+    """
+    Cek cepat input sebelum job dapat lane & jatah memori (lihat utils/preflight).
+    Metadata ditempel ke job_data['preflight']. Job yang ditolak langsung
+    dipublish gagal & di-ack; return False. Kalau publish/ack gagal (Redis),
+    job tetap tidak dijalankan: lease-nya habis, reaper mengantrekan ulang.
+    """
+    try:
+        preflight_job(job_data)
+        return True
+    except PreflightError as e:
+        JOBS_REJECTED.inc(reason=e.reason)
+        print(f"   ⛔ Rejected by preflight ({e.reason}): {e}")
+        key = job_key(raw, job_data)
+        result = {"status": "failed", "stage": "preflight", "reason": e.reason, "error": str(e)}
+        try:
+            jobs.publish_result(key, result)
+            record_order(key, job_data, result)
+            jobs.ack(raw, key)
+        except redis.RedisError as err:
+            print(f"   Preflight rejection not published: {err}")
+        return False
+    except Exception as e:
+        # Preflight sendiri gagal (bug / IO): biarkan job jalan seperti biasa
+        print(f"   Preflight skipped: {e}")
+        return True
+
+def maintain_leases(jobs, stop_event):
+    """Heartbeat lease job yang berjalan + kembalikan job milik worker mati"""
+    interval = max(1, jobs.visibility_timeout // 3)
+    while not stop_event.wait(interval):
+        try:
+            with _in_flight_lock:
+                claimed = list(_claimed)
+                running = list(_in_flight)
+            jobs.heartbeat(claimed)
+            jobs.refresh_locks(running)
+            requeued = jobs.requeue_expired()
+            if requeued:
+                print(f"   ♻️  Requeued {requeued} expired job(s)")
+        except Exception as e:
+            print(f"   Lease maintenance error: {e}")
+
+def prewarm_converter():
+    try:
+        get_converter_pool().warm()
+    except ConverterError as e:
+        print(f"   Converter prewarm failed: {e}")
+
+def register_metrics(scheduler, cache, queue):
+    """Gauge yang dibaca saat scrape: job berjalan, slot lane, antrean per kelas, result cache"""
+    def collect():
+        with _in_flight_lock:
+            running = len(_in_flight)
+        yield 'smartcopy_jobs_in_flight', 'gauge', 'Jobs currently running', running
+        for lane, stats in scheduler.stats().items():
+            yield f'smartcopy_lane_{lane}_in_flight', 'gauge', f'Jobs running in lane {lane}', stats['in_flight']
+        depth = queue.depth()
+        for priority, stats in depth.items():
+            yield f'smartcopy_queue_depth{{priority="{priority}"}}', 'gauge', 'Jobs waiting per priority class', stats['depth']
+        for priority, stats in depth.items():
+            yield f'smartcopy_queue_overdue{{priority="{priority}"}}', 'gauge', 'Waiting jobs already past their deadline', stats['overdue']
+        for priority, stats in depth.items():
+            yield f'smartcopy_queue_oldest_wait_seconds{{priority="{priority}"}}', 'gauge', 'Age of the oldest waiting job', stats['oldest_wait']
+        memory = get_memory_budget().stats()
+        yield 'smartcopy_memory_budget_bytes', 'gauge', 'Memory budget for running jobs', memory['budget']
+        yield 'smartcopy_memory_reserved_bytes', 'gauge', 'Estimated memory of running jobs', memory['used']
+        yield 'smartcopy_memory_waiting_jobs', 'gauge', 'Jobs waiting for memory budget', memory['waiting']
+        cached = cache.stats()
+        yield 'smartcopy_result_cache_hits_total', 'counter', 'Result cache hits', cached['hits']
+        yield 'smartcopy_result_cache_misses_total', 'counter', 'Result cache misses', cached['misses']
+        yield 'smartcopy_result_cache_bytes', 'gauge', 'Result cache size', cached['size_bytes']
+        yield 'smartcopy_result_cache_seconds_saved_total', 'counter', 'Processing time saved by cache hits', cached['seconds_saved']
+        if _order_sink is not None:
+            yield 'smartcopy_order_updates_pending', 'gauge', 'Order updates waiting for the next Postgres flush', _order_sink.pending()
+    telemetry.REGISTRY.register_collector(collect)
+
+def dispatch(scheduler, jobs, cache, raw, claimed_at):
+    """
+    Job yang baru di-claim -> lane. Return True kalau masuk lane (slot dilepas
+    saat job selesai); False = job tidak dijalankan (payload rusak / ditolak
+    preflight, sudah di-ack).
+    """
+    try:
+        job_data = json.loads(raw)
+    except json.JSONDecodeError:
+        job_data = None
+    if not isinstance(job_data, dict):
+        print("   Error: Invalid JSON Job Data")
+        jobs.ack(raw)
+        return False
+    
+    # Upload rusak / ber-password / .doc / zip bomb ditolak di sini (milidetik)
+    if not preflight(jobs, raw, job_data):
+        return False
+    
+    # Estimasi memori sebelum mulai: job besar ke lane 'large'
+    estimate = estimate_job(job_data)
+    lane = scheduler.lane_for(job_data.get('type'))
+    if estimate.total > LARGE_JOB_MB * MB:
+        lane = 'large'
+        JOBS_OVERSIZED.inc(type=job_data.get('type') or 'unknown')
+        print(f"   Large job ({estimate.total // MB}MB estimated) -> lane 'large'")
+    scheduler.submit(job_data.get('type'), run_job, jobs, raw, job_data, cache, claimed_at, estimate, lane,
+                     lane=lane)
+    return True
+
 def main():
+    global _order_sink
+    scheduler = LaneScheduler(LANES, JOB_LANES, default_lane='heavy')
+    get_sandbox_pool()  # Pre-warm sebelum job pertama datang
+    if CONVERTER_PREWARM:
+        threading.Thread(target=prewarm_converter, daemon=True).start()
+    
+    # Endpoint metrik/trace/profil; koneksi Redis sendiri supaya tetap hidup saat loop reconnect
+    metrics_redis = redis.from_url(REDIS_URL, decode_responses=True)
+    telemetry.start_metrics_server(redis_client=metrics_redis)
+    register_metrics(scheduler, ResultCache(metrics_redis), ReliableQueue(metrics_redis, QUEUE_NAME))
+    # Sink orders pakai koneksi Redis yang sama: pending update tetap tercatat saat loop reconnect
+    _order_sink = OrderSink(metrics_redis).start()
+    atexit.register(_order_sink.close)
+    
     print("🚀 SmartCopy Python Engine Started (Optimized Mode)")
     print(f"   Listening on Queue: {QUEUE_NAME}")
+    print(f"   Lanes: {', '.join(f'{name}={size}' for name, size in LANES.items())}")
+    print(f"   Memory budget: {get_memory_budget().budget // MB}MB")
+    if _order_sink.enabled:
+        print(f"   Order sink: batch {_order_sink.batch_size} / {_order_sink.interval:g}s")
     
-    try:
-        r = redis.from_url(REDIS_URL, decode_responses=True)
-        
-        while True:
-            # Blocking Pop: Tunggu sampai ada job (Hemat CPU)
-            # Format: (queue_name, data)
-            item = r.blpop(QUEUE_NAME, timeout=5)
+    # Reconnect dalam loop (bukan rekursi) supaya stack tidak terus bertambah
+    while True:
+        stop_event = threading.Event()
+        try:
+            r = redis.from_url(REDIS_URL, decode_responses=True)
+            jobs = ReliableQueue(r, QUEUE_NAME)
+            cache = ResultCache(r)
+            threading.Thread(
+                target=maintain_leases, args=(jobs, stop_event), daemon=True
+            ).start()
             
-            if item:
-                queue, data_str = item
+            while True:
+                # Ambil job baru hanya kalau masih ada slot (backpressure)
+                scheduler.acquire_slot()
+                raw, submitted = None, False
                 try:
-                    job_data = json.loads(data_str)
-                    result = handle_job(job_data)
-                    
-                    # TODO: Publish result back to Redis Key for Backend to pick up
-                    # r.set(f"job_result:{job_data.get('id')}", json.dumps(result), ex=3600)
-                    
-                except json.JSONDecodeError:
-                    print("   Error: Invalid JSON Job Data")
-            
-            # Idle beat
-            # time.sleep(0.1) # Tidak perlu karena blpop sudah blocking
+                    # Blocking claim: job dengan deadline terdekat dipindah atomik ke list processing
+                    raw = jobs.claim(timeout=5)
+                    if raw is None:
+                        continue
+                    hold_claim(raw)
+                    submitted = dispatch(scheduler, jobs, cache, raw, time.time())
+                finally:
+                    # Slot hanya dibawa job yang sudah masuk lane; selain itu
+                    # (ditolak, di-ack, atau error Redis di tengah jalan) dilepas di sini
+                    if not submitted:
+                        scheduler.release_slot()
+                        if raw is not None:
+                            drop_claim(raw)
 
-    except Exception as e:
-        print(f"🔥 Redis Connection Error: {e}")
-        time.sleep(5) # Auto-reconnect delay
-        main()
+        except Exception as e:
+            print(f"🔥 Redis Connection Error: {e}")
+            stop_event.set()
+            time.sleep(5) # Auto-reconnect delay
 
 if __name__ == "__main__":
     main()